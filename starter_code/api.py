@@ -0,0 +1,237 @@
+from app import app, db
+from models import Venue, Artist, Show
+from forms import genres
+from flask import Blueprint, Response, request, jsonify, abort, stream_with_context
+import datetime
+import json
+import export
+import versions
+
+#----------------------------------------------------------------------------#
+# JSON API.
+#----------------------------------------------------------------------------#
+
+# /api/v1 list endpoints for venues, artists and shows. Pages are keyset
+# paginated (venues and artists by id, shows by (start_time, id)) so every
+# page costs the same index range scan however deep the client pages;
+# next_cursor is passed back as ?after=. ?fields=id,name selects columns in
+# SQL, and city, state, genre and from/to (show start time) filter them.
+# ?format=ndjson streams every matching row as newline-delimited JSON from a
+# server-side cursor, fetched API_STREAM_CHUNK rows at a time.
+
+blueprint = Blueprint('api', __name__, url_prefix='/api/v1')
+
+GENRES = {genre.lower(): genre for genre, _ in genres}
+
+VENUE_FIELDS = dict((column.name, column) for column in (
+  Venue.id, Venue.name, Venue.city, Venue.state, Venue.address, Venue.phone,
+  Venue.genres, Venue.image_link, Venue.facebook_link, Venue.website,
+  Venue.seeking_talent, Venue.seeking_description, Venue.timezone
+))
+
+ARTIST_FIELDS = dict((column.name, column) for column in (
+  Artist.id, Artist.name, Artist.city, Artist.state, Artist.phone,
+  Artist.genres, Artist.image_link, Artist.website, Artist.facebook_link,
+  Artist.seeking_venue, Artist.seeking_description
+))
+
+SHOW_FIELDS = {
+  'id': Show.id,
+  'start_time': Show.start_time,
+  'end_time': Show.end_time,
+  'venue_id': Show.venue_id,
+  'venue_name': Venue.name,
+  'venue_timezone': Venue.timezone,
+  'artist_id': Show.artist_id,
+  'artist_name': Artist.name,
+  'artist_image_link': Artist.image_link
+}
+
+
+def _json_default(value):
+  if isinstance(value, (datetime.datetime, datetime.date)):
+    return value.isoformat()
+  raise TypeError(repr(value))
+
+
+def _fields(available):
+  # requested field names in request order, all of them by default
+  names = [name for name in request.args.get('fields', '').split(',') if name]
+  if not names:
+    return list(available)
+  unknown = [name for name in names if name not in available]
+  if unknown:
+    abort(400, 'unknown fields: %s' % ', '.join(unknown))
+  return names
+
+
+def _time(name):
+  value = request.args.get(name)
+  if value is None:
+    return None
+  try:
+    return Show.parse_start_time(value)
+  except ValueError:
+    abort(400, 'invalid %s: %s' % (name, value))
+
+
+def _genres():
+  try:
+    return [GENRES[genre.lower()] for genre in request.args.getlist('genre')]
+  except KeyError as error:
+    abort(400, 'unknown genre: %s' % error.args[0])
+
+
+def _place_filters(query, model):
+  # city, state and genre filters on venues and artists
+  city = request.args.get('city')
+  state = request.args.get('state')
+  if city:
+    query = query.filter(model.city == city)
+  if state:
+    query = query.filter(model.state == state.upper())
+  for genre in _genres():
+    query = query.filter(model.genres.contains([genre]))
+  return query
+
+
+def _show_range_filter(query, model):
+  # venues and artists with at least one show between from and to; the
+  # views are keyed on 'shows' too, since show writes change this
+  start, end = _time('from'), _time('to')
+  conditions = []
+  if start is not None:
+    conditions.append(Show.start_time >= start)
+  if end is not None:
+    conditions.append(Show.start_time < end)
+  if not conditions:
+    return query
+  return query.filter(model.shows.any(db.and_(*conditions)))
+
+
+def _per_page():
+  per_page = request.args.get('limit', app.config['API_PER_PAGE'], type=int)
+  return max(1, min(per_page, app.config['API_MAX_PER_PAGE']))
+
+
+def _list(query, names, cursor_names, encode_cursor):
+  # one keyset page as JSON, or the whole result as NDJSON
+  if request.args.get('format') == 'ndjson':
+    query = query.execution_options(stream_results=True).yield_per(app.config['API_STREAM_CHUNK'])
+    def generate():
+      for row in query:
+        values = row._asdict()
+        yield json.dumps(dict((name, values[name]) for name in names), default=_json_default) + '\n'
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+  per_page = _per_page()
+  rows = query.limit(per_page + 1).all()
+  has_next = len(rows) > per_page
+  rows = rows[:per_page]
+  data = []
+  for row in rows:
+    values = row._asdict()
+    data.append(dict((name, values[name]) for name in names))
+  last = rows[-1]._asdict() if rows else None
+  return Response(json.dumps({
+    'success': True,
+    'data': data,
+    'next_cursor': encode_cursor(*[last[name] for name in cursor_names]) if has_next else None
+  }, default=_json_default), mimetype='application/json')
+
+
+def _entities(model, available):
+  names = _fields(available)
+  # the cursor column is always selected, even when not returned
+  columns = [available[name].label(name) for name in names]
+  if 'id' not in names:
+    columns.append(model.id.label('id'))
+  query = _place_filters(db.session.query(*columns), model)
+  query = _show_range_filter(query, model)
+  after = request.args.get('after')
+  if after is not None:
+    try:
+      query = query.filter(model.id > int(after))
+    except ValueError:
+      abort(400, 'invalid cursor: %s' % after)
+  return _list(query.order_by(model.id), names, ['id'], str)
+
+
+@blueprint.route('/venues')
+@versions.conditional('venues', 'shows')
+def venues():
+  return _entities(Venue, VENUE_FIELDS)
+
+
+@blueprint.route('/artists')
+@versions.conditional('artists', 'shows')
+def artists():
+  return _entities(Artist, ARTIST_FIELDS)
+
+
+@blueprint.route('/shows')
+@versions.conditional('shows', 'venues', 'artists')
+def shows():
+  # city, state and genre match the venue's city and state and the artist's
+  # genres; from/to bound the start time
+  names = _fields(SHOW_FIELDS)
+  columns = [SHOW_FIELDS[name].label(name) for name in names]
+  for name in ('start_time', 'id'):
+    if name not in names:
+      columns.append(SHOW_FIELDS[name].label(name))
+  query = db.session.query(*columns) \
+    .join(Artist, Show.artist_id == Artist.id) \
+    .join(Venue, Show.venue_id == Venue.id)
+
+  city = request.args.get('city')
+  state = request.args.get('state')
+  if city:
+    query = query.filter(Venue.city == city)
+  if state:
+    query = query.filter(Venue.state == state.upper())
+  for genre in _genres():
+    query = query.filter(Artist.genres.contains([genre]))
+  for name, column in (('venue_id', Show.venue_id), ('artist_id', Show.artist_id)):
+    value = request.args.get(name)
+    if value is not None:
+      try:
+        query = query.filter(column == int(value))
+      except ValueError:
+        abort(400, 'invalid %s: %s' % (name, value))
+  start, end = _time('from'), _time('to')
+  if start is not None:
+    query = query.filter(Show.start_time >= start)
+  if end is not None:
+    query = query.filter(Show.start_time < end)
+
+  after = request.args.get('after')
+  if after is not None:
+    try:
+      query = query.filter(db.tuple_(Show.start_time, Show.id) > db.tuple_(*Show.decode_cursor(after)))
+    except ValueError:
+      abort(400, 'invalid cursor: %s' % after)
+  return _list(query.order_by(Show.start_time, Show.id), names, ['start_time', 'id'], Show.encode_cursor)
+
+
+@blueprint.route('/export/shows.csv')
+def export_shows():
+  # the full calendar, or ?since= changes, as CSV streamed in chunks; the
+  # watermark header is the ?since= for the next request
+  query = export.shows_query(_time('since'))
+  return Response(
+    stream_with_context(export.csv_chunks(query, app.config['EXPORT_CHUNK'])),
+    mimetype='text/csv',
+    headers={
+      'Content-Disposition': 'attachment; filename=shows.csv',
+      'X-Export-Watermark': export.watermark().isoformat()
+    }
+  )
+
+
+@blueprint.errorhandler(400)
+def bad_request(error):
+  return jsonify({
+    'success': False,
+    'error': 400,
+    'message': error.description
+  }), 400
@@ -5,9 +5,11 @@
 import json
 import dateutil.parser
 import babel
+import babel.dates
+import functools
 from flask import Flask, render_template, request, Response, flash, redirect, url_for, jsonify, abort
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
+from routing import RoutingSQLAlchemy
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import Form
@@ -16,6 +18,8 @@ from forms import *
 from flask_migrate import Migrate
 from flask_cors import CORS
 import datetime
+import time
+from sqlalchemy import exc
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -24,7 +28,7 @@ app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
 csrf = CSRFProtect()
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 CORS(app)
 csrf.init_app(app)
@@ -43,21 +47,58 @@ def after_request(response):
 #----------------------------------------------------------------------------#
 
 from models import *
+import search
+import facets
+import suggest
+import matches
+import cache
+import resolver
+import versions
+import instrumentation
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
-def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+DATETIME_FORMATS = {
+  'full': "EEEE MMMM, d, y 'at' h:mma",
+  'medium': "EE MM, dd, y h:mma"
+}
+
+# parsed babel pattern and locale, built once per (format, locale)
+@functools.lru_cache(maxsize=64)
+def datetime_pattern(format, locale):
+  return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format)), babel.Locale.parse(locale)
+
+@functools.lru_cache(maxsize=256)
+def get_timezone(name):
+  return babel.dates.get_timezone(name)
+
+# Show times are stored as naive UTC datetimes; tz is the venue's IANA zone
+def format_datetime(value, format='medium', tz=None):
+  if isinstance(value, str):
+    value = dateutil.parser.parse(value)
+  if tz:
+    if value.tzinfo is None:
+      value = value.replace(tzinfo=babel.dates.UTC)
+    value = value.astimezone(get_timezone(tz))
+  pattern, locale = datetime_pattern(format, app.config['DATETIME_LOCALE'])
+  return pattern.apply(value, locale)
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+# The inverse, for form input: a naive wall-clock time in zone tz as naive UTC
+def to_utc(value, tz):
+  if not tz:
+    return value
+  zone = get_timezone(tz)
+  # pytz zones (older babel) need localize for the right offset
+  localize = getattr(zone, 'localize', None)
+  value = localize(value) if localize else value.replace(tzinfo=zone)
+  return value.astimezone(babel.dates.UTC).replace(tzinfo=None)
+
+import templating
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
@@ -67,78 +108,81 @@ def index():
   return render_template('pages/home.html')
 
 
+#  Batch create
+#  ----------------------------------------------------------------
+
+def json_records():
+  # JSON body of a create request as a list of records
+  body = request.get_json()
+  if isinstance(body, dict):
+    body = [body]
+  if not isinstance(body, list):
+    abort(400)
+  if len(body) > app.config['BATCH_MAX_RECORDS']:
+    abort(413)
+  return body
+
+def create_records(model, records, mapping):
+  # inserts the valid records together; responds with the new ids and one
+  # error per rejected record (by index in the payload)
+  try:
+    created, errors = importer.insert_records(model, records, mapping)
+  except exc.IntegrityError as error:
+    # rows the inserts refuse come back as errors; this is the commit failing
+    db.session.rollback()
+    abort(409 if conflicts.is_conflict(error) else 422)
+  except exc.SQLAlchemyError:
+    db.session.rollback()
+    abort(422)
+  cache.invalidate_rows(model, created)
+  resolver.invalidate_rows(model, created)
+  if model in (Venue, Artist):
+    matches.add_rows(model, created)
+    kind = 'venue' if model is Venue else 'artist'
+    for row in created:
+      suggest.index.add(kind, row['id'], row['name'])
+  return jsonify({
+    'success': not errors,
+    'created': [row['id'] for row in created],
+    'errors': errors
+  }), 422 if errors and not created else 200
+
 #  Venues
 #  ----------------------------------------------------------------
 
 @app.route('/venues', methods=['GET','POST'])
+@versions.conditional('venues', 'shows')
 def venues():
-  # print(body)
   if request.method == 'POST':
-    body = request.get_json()
-    if 'name' in body and 'city' in body and 'state' in body:
-      name=body['name']
-      city=body['city']
-      state=body['state']
-      address=body['address'] if 'address' in body else None
-      phone=body['phone'] if 'phone' in body else None
-      image_link=body['image_link'] if 'image_link' in body else None
-      facebook_link=body['facebook_link'] if 'facebook_link' in body else "https://facebook.com"
-      website=body['website'] if 'website' in body else "https://pydata.co"
-      seeking_talent=bool(body['seeking_talent']) if 'seeking_talent' in body else False
-      seeking_description=body['seeking_description'] if 'seeking_description' in body else None
-
-      # create venue item and insert into database
-      venue = Venue(name, city, state, address, phone, image_link, facebook_link, website, seeking_talent, seeking_description)
-      venue.insert()
-    else:
-      abort(422)
-  elif request.method == 'GET':
-    data = []
-    city_state = ''
-    # Group by city and state (and id of course)
-    for venue in Venue.query.group_by(Venue.id, Venue.state, Venue.city).all():
-      if city_state == venue.city + venue.state:
-        data[len(data)-1]['venues'].append({
-          'id': venue.id,
-          'name': venue.name,
-          'num_upcoming_shows': len(venue.shows.filter(Show.start_time > datetime.datetime.now()).all())
-        })
-      else:
-        city_state = venue.city + venue.state
-        data.append({
-          'city': venue.city,
-          'state': venue.state,
-          'venues': [{
-            'id': venue.id,
-            'name': venue.name,
-            'num_upcoming_shows': len(venue.shows.filter(Show.start_time > datetime.datetime.now()).all())
-            }]
-          })
-  return render_template('pages/venues.html', areas=data)
+    # one venue object or an array of them, inserted in a single transaction
+    return create_records(Venue, json_records(), importer.venue_mapping)
+  # Group by state and city in a single query, narrowed by the genre, city
+  # and state browse filters, with facet counts for the filtered set
+  filters = facets.filters_from(request.args)
+  data = Venue.areas(facets.criteria(Venue, filters))
+  return render_template('pages/venues.html', areas=data, facets=facets.facets(Venue, filters))
 
   # return jsonify({
   #   'success': True,
   #   'venues': data
   # })
 
-@app.route('/venues/search', methods=['POST'])
+@app.route('/venues/search', methods=['GET', 'POST'])
 def search_venues():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for Hop should return "The Musical Hop".
-  # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
-  venue_query = Venue.query.filter(Venue.name.ilike('%'+request.form['search_term']+'%'))
-  venues = [venue.format for venue in venue_query]
-  response = {
-    'count': len(venues),
-    'data': venues
-  }
-  return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+  # ranked search on name, city, state and genres, one page at a time
+  search_term = request.values.get('search_term', '')
+  page = max(request.values.get('page', 1, type=int), 1)
+  response = search.search_venues(search_term, page, app.config['SEARCH_PER_PAGE'])
+  return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 @app.route('/venues/<int:venue_id>')
+@versions.conditional('venue:{venue_id}')
 def show_venue(venue_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
-  data = Venue.query.get(venue_id).format_with_shows
+  data = cache.venue_detail(venue_id)
+  if data is None:
+    abort(404)
   # return jsonify({
   #   'success': True,
   #   'data': data
@@ -172,9 +216,10 @@ def create_venue_submission():
     website=body['website'] if 'website' in body else "https://pydata.co"
     seeking_talent=bool(body['seeking_talent']) if 'seeking_talent' in body else False
     seeking_description=body['seeking_description'] if 'seeking_description' in body else None
+    genres=body.genres.data
 
     # Create new venue from request data and insert into database
-    venue = Venue(name, city, state, address, phone, image_link, facebook_link, website, seeking_talent, seeking_description)
+    venue = Venue(name, city, state, address, phone, image_link, facebook_link, website, seeking_talent, seeking_description, genres=genres)
     venue.insert()
     # on successful db insert, flash success
     flash('Venue ' + request.form['name'] + ' was successfully listed!')
@@ -202,53 +247,32 @@ def delete_venue(venue_id):
 #  Artists
 #  ----------------------------------------------------------------
 @app.route('/artists', methods=['GET', 'POST'])
+@versions.conditional('artists')
 def artists():
-  # TODO: replace with real data returned from querying the database
   if request.method == 'POST':
-    body = request.get_json()
-    if 'name' in body and 'city' in body and 'state' in body:
-      artist = Artist(
-        name = body['name'],
-        city = body['city'],
-        state = body['state'],
-        phone = body['phone'] if 'phone' in body else None,
-        image_link = body['image_link'] if 'image_link' in body else None,
-        facebook_link = body['facebook_link'] if 'facebook_link' in body else None,
-        website = body['website'] if 'website' in body else None,
-        seeking_venue = bool(body['seeking_venue']) if 'seeking_venue' in body else None,
-        genres = body['genres'] if 'genres' in body else []
-      )
-      artist.insert()
-    return jsonify({
-      'success': True,
-      'artists': [artist.format for artist in Artist.query.all()]
-    })
-  elif request.method == 'GET':
-    data =  [artist.format for artist in Artist.query.all()]
-    return render_template('pages/artists.html', artists=data)
+    # one artist object or an array of them, inserted in a single transaction
+    return create_records(Artist, json_records(), importer.artist_mapping)
+  filters = facets.filters_from(request.args)
+  data =  [artist.format for artist in Artist.query.filter(*facets.criteria(Artist, filters)).all()]
+  return render_template('pages/artists.html', artists=data, facets=facets.facets(Artist, filters))
 
-@app.route('/artists/search', methods=['POST'])
+@app.route('/artists/search', methods=['GET', 'POST'])
 def search_artists():
-  # TODO: implement search on artists with partial string search. Ensure it is case-insensitive.
-  # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
-  # search for "band" should return "The Wild Sax Band".
-  search_results = Artist.query.filter(Artist.name.ilike('%' + request.form.get('search_term') + '%')).all()
-  data = [artist.format for artist in search_results]
-  response = {
-    'count': len(search_results),
-    'data': data
-  }
-  return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
+  # ranked search on name, city, state and genres, one page at a time
+  search_term = request.values.get('search_term', '')
+  page = max(request.values.get('page', 1, type=int), 1)
+  response = search.search_artists(search_term, page, app.config['SEARCH_PER_PAGE'])
+  return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
 @app.route('/artists/<int:artist_id>')
+@versions.conditional('artist:{artist_id}')
 def show_artist(artist_id):
   # shows the venue page with the given venue_id
   # TODO: replace with real venue data from the venues table, using venue_id
-  try:
-    data = Artist.query.get(artist_id).format_with_shows_venue
-    return render_template('pages/show_artist.html', artist=data)
-  except:
+  data = cache.artist_detail(artist_id)
+  if data is None:
     abort(404)
+  return render_template('pages/show_artist.html', artist=data)
 
 #  Update
 #  ----------------------------------------------------------------
@@ -281,7 +305,7 @@ def edit_artist_submission(artist_id):
         artist.facebook_link = body['facebook_link'] if 'facebook_link' in body and body['facebook_link'] != '' else artist.facebook_link
         artist.website = body['website'] if 'website' in body and body['website'] != '' else artist.website
         artist.seeking_venue = bool(body['seeking_venue']) if 'seeking_venue' in body and body['seeking_venue'] != '' else artist.seeking_venue
-        artist.genres = body['genres'] if 'genres' in body and body['genres'] != [] else artist.genres
+        artist.genres = body.getlist('genres') or artist.genres
       else:
         abort(422)
       try:
@@ -330,7 +354,7 @@ def edit_venue_submission(venue_id):
         venue.website = body['website'] if 'website' in body and body['website'] != '' else venue.website
         venue.seeking_talent = bool(body['seeking_venue']) if 'seeking_venue' in body and body['seeking_venue'] != '' else venue.seeking_talent
         venue.seeking_description = body['seeking_description'] if 'seeking_description' in body and body['seeking_description'] != '' else venue.seeking_description
-        venue.genres = body['genres'] if 'genres' in body and body['genres'] != [] else venue.genres
+        venue.genres = body.getlist('genres') or venue.genres
       else:
         abort(422)
       try:
@@ -374,7 +398,7 @@ def create_artist_submission():
     website=body['website'] if 'website' in body else "https://pydata.co"
     seeking_talent=bool(body['seeking_talent']) if 'seeking_talent' in body else False
     seeking_description=body['seeking_description'] if 'seeking_description' in body else None
-    genres = body['genres']
+    genres = body.getlist('genres')
 
     artist = Artist(name, city, state, phone, image_link, website, facebook_link, seeking_talent, seeking_description,  genres)
     artist.insert()
@@ -394,28 +418,24 @@ def create_artist_submission():
 #  ----------------------------------------------------------------
 
 @app.route('/shows', methods=['GET', 'POST'])
+@versions.conditional('shows', 'venues', 'artists')
 def shows():
   # displays list of shows at /shows
   # TODO: replace with real venues data.
   #       num_shows should be aggregated based on number of upcoming shows per venue.
   if request.method == 'POST':
-    body = request.get_json()
-    if 'artist_name' in body and 'venue_name' in body and 'start_time' in body:
-      show = Show(
-        artist_id = Artist.query.filter(Artist.name==body['artist_name']).one_or_none().id,
-        venue_id = Venue.query.filter(Venue.name==body['venue_name']).one_or_none().id,
-        start_time = body['start_time']
-      )
-      show.insert()
-  elif request.method == 'GET':  
-    shows = Show.query.order_by(Show.id).all()
-  # return jsonify({
-  #   'success': True,
-  #   'shows': [show.format for show in shows]
-  # })
+    # one show object or an array of them; artists and venues by id or name
+    records = json_records()
+    return create_records(Show, records, importer.show_mapping_for(records))
 
-  data = [show.format_with_artist_venue for show in shows]
-  return render_template('pages/shows.html', shows=data)
+  # keyset pagination over (start_time, id); cursors come from the previous page
+  per_page = request.args.get('per_page', app.config['SHOWS_PER_PAGE'], type=int)
+  per_page = max(1, min(per_page, app.config['SHOWS_MAX_PER_PAGE']))
+  try:
+    data = Show.page(after=request.args.get('after'), before=request.args.get('before'), per_page=per_page)
+  except ValueError:
+    abort(400)
+  return render_template('pages/shows.html', shows=data['shows'], prev_cursor=data['prev_cursor'], next_cursor=data['next_cursor'], per_page=per_page)
 
 @app.route('/shows/create')
 def create_shows():
@@ -427,14 +447,37 @@ def create_shows():
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
   # TODO: insert form data as a new Show record in the db, instead
+  # artist_id / venue_id fields take an id ('#12', or digits no name
+  # matches) or a unique name; times are wall-clock times at the venue
   body = request.form
-  if 'artist_name' in body and 'venue_name' in body and 'start_time' in body:
-    show = Show(
-      artist_id = Artist.query.filter(Artist.name==body['artist_name']).one_or_none().id,
-      venue_id = Venue.query.filter(Venue.name==body['venue_name']).one_or_none().id,
-      start_time = body['start_time']
-    )
-    show.insert()
+  if body.get('artist_id') and body.get('venue_id') and body.get('start_time'):
+    try:
+      artist_id = resolver.resolve('artist', body['artist_id'])
+      venue_id = resolver.resolve('venue', body['venue_id'])
+      timezone = db.session.query(Venue.timezone).filter(Venue.id == venue_id).scalar()
+      show = Show(
+        artist_id = artist_id,
+        venue_id = venue_id,
+        start_time = to_utc(Show.parse_start_time(body['start_time']), timezone),
+        end_time = to_utc(Show.parse_start_time(body['end_time']), timezone) if body.get('end_time') else None
+      )
+    except resolver.ResolveError as error:
+      flash('An error occurred. Show could not be listed: %s.' % error)
+      abort(error.status)
+    except ValueError as error:
+      flash('An error occurred. Show could not be listed: %s.' % error)
+      abort(400)
+    # a double booking is a 409, whether found up front or by the constraint
+    clashes = conflicts.find_conflicts([show.format])
+    if clashes:
+      flash('An error occurred. Show could not be listed: %s.' % clashes[0])
+      abort(409)
+    try:
+      show.insert()
+    except exc.IntegrityError as error:
+      db.session.rollback()
+      flash('An error occurred. Show could not be listed.')
+      abort(409 if conflicts.is_conflict(error) else 422)
     # on successful db insert, flash success
     flash('Show was successfully listed!')
   else:
@@ -444,6 +487,92 @@ def create_show_submission():
   # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
   return render_template('pages/home.html')
 
+#  Matches
+#  ----------------------------------------------------------------
+
+def match_limit():
+  return max(1, min(request.args.get('limit', 10, type=int), app.config['MATCH_MAX_LIMIT']))
+
+@app.route('/venues/<int:venue_id>/matches')
+def venue_matches(venue_id):
+  # artists seeking a venue, ranked by genres, place and shows played here
+  data = matches.venue_matches(venue_id, match_limit())
+  if data is None:
+    abort(404)
+  return jsonify({
+    'success': True,
+    'matches': data
+  })
+
+@app.route('/artists/<int:artist_id>/matches')
+def artist_matches(artist_id):
+  # venues seeking talent, ranked by genres, place and shows played there
+  data = matches.artist_matches(artist_id, match_limit())
+  if data is None:
+    abort(404)
+  return jsonify({
+    'success': True,
+    'matches': data
+  })
+
+#  Suggest
+#  ----------------------------------------------------------------
+
+@app.route('/api/search/suggest')
+def search_suggest():
+  # type-ahead: venue and artist names starting with q, served from memory
+  limit = max(1, min(request.args.get('limit', 10, type=int), app.config['SUGGEST_MAX_LIMIT']))
+  return jsonify({
+    'success': True,
+    'suggestions': suggest.suggest(request.args.get('q', ''), limit)
+  })
+
+#  Health
+#  ----------------------------------------------------------------
+
+@app.route('/healthz/db')
+def db_health():
+  # live pool statistics plus the time this probe waited for a connection
+  pool = db.engine.pool
+  started = time.perf_counter()
+  try:
+    with db.engine.connect() as connection:
+      acquired = time.perf_counter()
+      connection.execute(db.text('SELECT 1'))
+  except exc.SQLAlchemyError:
+    return jsonify({
+      'success': False,
+      'pool': pool.status()
+    }), 503
+  finished = time.perf_counter()
+  stats = {
+    'class': pool.__class__.__name__,
+    'status': pool.status(),
+    'wait_ms': round((acquired - started) * 1000, 3),
+    'ping_ms': round((finished - acquired) * 1000, 3)
+  }
+  if hasattr(pool, 'checkedout'):
+    stats.update({
+      'size': pool.size(),
+      'checked_in': pool.checkedin(),
+      'checked_out': pool.checkedout(),
+      'overflow': pool.overflow(),
+      'max_overflow': app.config['DB_MAX_OVERFLOW'],
+      'timeout': app.config['DB_POOL_TIMEOUT']
+    })
+  return jsonify({
+    'success': True,
+    'pool': stats,
+    'replicas': db.replicas.status()
+  })
+
+@app.route('/healthz/cache')
+def cache_health():
+  return jsonify({
+    'success': True,
+    'cache': cache.detail_cache.stats()
+  })
+
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
@@ -463,17 +592,42 @@ if not app.debug:
     app.logger.addHandler(file_handler)
     app.logger.info('errors')
 
+#----------------------------------------------------------------------------#
+# Commands.
+#----------------------------------------------------------------------------#
+
+import importer
+import conflicts
+import export
+import counters
+
+#----------------------------------------------------------------------------#
+# API.
+#----------------------------------------------------------------------------#
+
+import api
+app.register_blueprint(api.blueprint)
+
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
+# Builds the in-memory indexes and starts their refresh threads; run in each
+# serving process before it takes requests (gunicorn.conf.py, app.run below)
+def start_worker():
+  with app.app_context():
+    suggest.start()
+    matches.start()
+
 # Default port:
 if __name__ == '__main__':
+    start_worker()
     app.run(debug=True)
 
 # Or specify port manually:
 '''
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
+    start_worker()
     app.run(host='0.0.0.0', port=port)
 '''
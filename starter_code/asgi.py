@@ -0,0 +1,183 @@
+from app import db, format_datetime
+from models import Venue, Artist, Show
+from quart import Quart, render_template, request, abort
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.pool import NullPool
+import asyncio
+import datetime
+import cache
+import facets
+from templating import FragmentCacheExtension, bytecode_cache
+
+#----------------------------------------------------------------------------#
+# Async serving mode.
+#----------------------------------------------------------------------------#
+
+# The read pages (/, /venues, /artists, /shows and the venue and artist
+# detail pages) served by Quart on SQLAlchemy's asyncio extension over
+# asyncpg, rendering the same templates as app.py:
+#
+#   hypercorn --workers 4 --bind 0.0.0.0:8000 asgi:app
+#
+# Queries a page needs independently of each other run concurrently with
+# asyncio.gather, each on its own pooled connection: the listing and its
+# facet counts, or a venue or artist and its past and upcoming shows. SQL
+# comes from the same query builders as the sync routes; the ORM queries
+# only compile here, nothing executes on the sync session. Writes, search,
+# the JSON API and the ETag checks stay in the WSGI app; route them there.
+# The detail cache is shared with app.py through cache.detail_cache, so
+# with the lru backend pages may lag writes by up to CACHE_TTL seconds, as
+# with several WSGI workers. entity_version() needs the sync session, so
+# the fragment cache is off and {% cache %} blocks render every time.
+
+app = Quart(__name__)
+app.config.from_object('config')
+app.jinja_env.filters['datetime'] = format_datetime
+app.jinja_env.add_extension(FragmentCacheExtension)
+app.jinja_env.globals['entity_version'] = lambda *keys: None
+# templates compiled for async rendering differ from app.py's; keep them apart
+app.jinja_env.bytecode_cache = bytecode_cache(app.config['JINJA_BYTECODE_CACHE_DIR'], '__jinja2_async_%s.cache')
+
+engine = None
+
+
+def engine_options(config):
+  # DB_* pool settings from config.py; size DB_POOL_SIZE for up to three
+  # connections per request in flight
+  options = {'pool_pre_ping': config['DB_POOL_PRE_PING']}
+  if config['DB_NULL_POOL']:
+    options['poolclass'] = NullPool
+  else:
+    options.update({
+      'pool_size': config['DB_POOL_SIZE'],
+      'max_overflow': config['DB_MAX_OVERFLOW'],
+      'pool_timeout': config['DB_POOL_TIMEOUT'],
+      'pool_recycle': config['DB_POOL_RECYCLE']
+    })
+  if config['DB_STATEMENT_TIMEOUT_MS']:
+    options['connect_args'] = {'server_settings': {'statement_timeout': str(config['DB_STATEMENT_TIMEOUT_MS'])}}
+  return options
+
+
+@app.before_serving
+async def connect():
+  # asyncpg connections belong to one event loop; create the engine on it
+  global engine
+  url = make_url(app.config['SQLALCHEMY_DATABASE_URI']).set(drivername='postgresql+asyncpg')
+  engine = create_async_engine(url, **engine_options(app.config))
+
+
+@app.after_serving
+async def disconnect():
+  await engine.dispose()
+
+
+async def fetch(statement):
+  # a pooled connection per statement, so gathered statements run concurrently
+  async with engine.connect() as connection:
+    result = await connection.execute(statement)
+    return result.all()
+
+
+async def fetch_entity(model, entity_id):
+  async with AsyncSession(engine) as session:
+    return await session.get(model, entity_id)
+
+
+async def with_facets(model, filters, statement):
+  # rows of statement and the facet links; on a facet cache miss the facet
+  # query runs alongside the listing
+  key = facets.cache_key(model, filters)
+  counts = facets.facet_cache.get(key)
+  if counts is not None:
+    return await fetch(statement), facets.facets(model, filters, counts)
+  rows, facet_rows = await asyncio.gather(fetch(statement), fetch(facets.facet_query(model, filters).statement))
+  counts = facets.tally(facet_rows)
+  facets.facet_cache.set(key, counts)
+  return rows, facets.facets(model, filters, counts)
+
+
+async def detail(model, entity_id, tags):
+  # Venue.format_with_shows / Artist.format_with_shows_venue, with the
+  # entity, its past shows and its upcoming shows fetched concurrently
+  key = '%s:%d' % (model.__name__.lower(), entity_id)
+  data = cache.detail_cache.get(key)
+  if data is None:
+    now = datetime.datetime.utcnow()
+    shows = model.shows_query(entity_id)
+    entity, past_rows, upcoming_rows = await asyncio.gather(
+      fetch_entity(model, entity_id),
+      fetch(shows.filter(Show.start_time <= now).statement),
+      fetch(shows.filter(Show.start_time > now).statement)
+    )
+    if entity is None:
+      return None
+    data = entity.format_detail([model.format_show(row) for row in past_rows],
+                                [model.format_show(row) for row in upcoming_rows])
+    cache.detail_cache.set(key, data, tags(data))
+  return data
+
+#----------------------------------------------------------------------------#
+# Controllers.
+#----------------------------------------------------------------------------#
+
+@app.route('/')
+async def index():
+  return await render_template('pages/home.html')
+
+
+@app.route('/venues')
+async def venues():
+  filters = facets.filters_from(request.args)
+  rows, links = await with_facets(Venue, filters, Venue.areas_query(facets.criteria(Venue, filters)).statement)
+  return await render_template('pages/venues.html', areas=Venue.group_areas(rows), facets=links)
+
+
+@app.route('/venues/<int:venue_id>')
+async def show_venue(venue_id):
+  data = await detail(Venue, venue_id, cache.venue_tags)
+  if data is None:
+    abort(404)
+  return await render_template('pages/show_venue.html', venue=data)
+
+
+@app.route('/artists')
+async def artists():
+  filters = facets.filters_from(request.args)
+  statement = db.session.query(Artist.id, Artist.name).filter(*facets.criteria(Artist, filters)).statement
+  rows, links = await with_facets(Artist, filters, statement)
+  data = [{'id': row.id, 'name': row.name} for row in rows]
+  return await render_template('pages/artists.html', artists=data, facets=links)
+
+
+@app.route('/artists/<int:artist_id>')
+async def show_artist(artist_id):
+  data = await detail(Artist, artist_id, cache.artist_tags)
+  if data is None:
+    abort(404)
+  return await render_template('pages/show_artist.html', artist=data)
+
+
+@app.route('/shows')
+async def shows():
+  # keyset pagination over (start_time, id), as in app.py
+  per_page = request.args.get('per_page', app.config['SHOWS_PER_PAGE'], type=int)
+  per_page = max(1, min(per_page, app.config['SHOWS_MAX_PER_PAGE']))
+  after, before = request.args.get('after'), request.args.get('before')
+  try:
+    statement = Show.keyset_query(after, before, per_page).statement
+  except ValueError:
+    abort(400)
+  data = Show.format_page(await fetch(statement), after, before, per_page)
+  return await render_template('pages/shows.html', shows=data['shows'], prev_cursor=data['prev_cursor'], next_cursor=data['next_cursor'], per_page=per_page)
+
+
+@app.errorhandler(404)
+async def not_found_error(error):
+  return await render_template('errors/404.html'), 404
+
+
+@app.errorhandler(500)
+async def server_error(error):
+  return await render_template('errors/500.html'), 500
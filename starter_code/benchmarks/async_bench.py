@@ -0,0 +1,160 @@
+#----------------------------------------------------------------------------#
+# Sync WSGI vs async ASGI serving benchmark.
+#
+#   python -m benchmarks.async_bench --seed 10000 --workers 4 --concurrency 64
+#
+# Starts app:app under gunicorn (sync workers) and asgi:app under hypercorn
+# with the same number of worker processes, both against
+# FYYUR_BENCH_DATABASE_URL, then drives every read page through each of them
+# for --duration seconds from --concurrency keep-alive client threads and
+# prints requests per second and p50/p99 latency. --seed generates that many
+# venues first (two artists and ten shows per venue, as in harness.py). The
+# detail page and fragment caches are off in both servers unless --cache. Run the client on
+# another machine (--no-servers, --sync-url, --async-url) when the servers
+# and the client would compete for the same cores.
+#----------------------------------------------------------------------------#
+
+import argparse
+import concurrent.futures
+import http.client
+import os
+import subprocess
+import sys
+import time
+import urllib.parse
+from app import app, db
+from models import Venue, Artist, Show
+from benchmarks import datagen
+from benchmarks.stats import summarize
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, path) of the pages both modes serve
+PAGES = [
+  ('venues', '/venues'),
+  ('venues by genre', '/venues?genre=Jazz'),
+  ('artists', '/artists'),
+  ('shows', '/shows'),
+  ('shows next page', '/shows?after={cursor}'),
+  ('venue detail', '/venues/{venue_id}'),
+  ('artist detail', '/artists/{artist_id}'),
+]
+
+
+def page_params():
+  # the busiest venue and artist and the cursor of the second /shows page
+  return {
+    'venue_id': db.session.query(db.func.min(Venue.id)).scalar(),
+    'artist_id': db.session.query(db.func.min(Artist.id)).scalar(),
+    'cursor': Show.page(per_page=app.config['SHOWS_PER_PAGE'])['next_cursor'] or ''
+  }
+
+
+def start_servers(workers, use_cache, sync_port, async_port):
+  env = dict(os.environ, DATABASE_URL=os.environ['FYYUR_BENCH_DATABASE_URL'])
+  if not use_cache:
+    env['FYYUR_CACHE_MAXSIZE'] = env['FYYUR_FRAGMENT_CACHE_MAXSIZE'] = '0'
+  commands = [
+    [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', '127.0.0.1:%d' % sync_port, 'app:app'],
+    [sys.executable, '-m', 'hypercorn', '--workers', str(workers), '--bind', '127.0.0.1:%d' % async_port, 'asgi:app'],
+  ]
+  return [subprocess.Popen(command, cwd=BASE_DIR, env=env) for command in commands]
+
+
+def wait_ready(url, timeout=30):
+  target = urllib.parse.urlsplit(url)
+  deadline = time.time() + timeout
+  while time.time() < deadline:
+    try:
+      connection = http.client.HTTPConnection(target.hostname, target.port, timeout=5)
+      connection.request('GET', '/')
+      if connection.getresponse().status == 200:
+        return
+    except OSError:
+      pass
+    time.sleep(0.2)
+  raise SystemExit('%s did not come up within %ds' % (url, timeout))
+
+
+def client(url, path, deadline):
+  # one keep-alive connection issuing requests back to back until deadline
+  target = urllib.parse.urlsplit(url)
+  connection = http.client.HTTPConnection(target.hostname, target.port, timeout=60)
+  samples, errors = [], 0
+  while time.perf_counter() < deadline:
+    started = time.perf_counter()
+    try:
+      connection.request('GET', path)
+      response = connection.getresponse()
+      response.read()
+      ok = response.status < 400
+    except (OSError, http.client.HTTPException):
+      connection.close()
+      ok = False
+    if ok:
+      samples.append((time.perf_counter() - started) * 1000)
+    else:
+      errors += 1
+  connection.close()
+  return samples, errors
+
+
+def measure(url, path, concurrency, duration, warmup):
+  client(url, path, time.perf_counter() + warmup)
+  samples, errors = [], 0
+  started = time.perf_counter()
+  with concurrent.futures.ThreadPoolExecutor(concurrency) as pool:
+    deadline = started + duration
+    for client_samples, client_errors in pool.map(lambda _: client(url, path, deadline), range(concurrency)):
+      samples.extend(client_samples)
+      errors += client_errors
+  result = summarize(samples)
+  result['throughput'] = len(samples) / (time.perf_counter() - started)
+  result['errors'] = errors
+  return result
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Compare sync WSGI and async ASGI serving of the read pages.')
+  parser.add_argument('--seed', type=int, default=0, help='synthetic venues to generate first')
+  parser.add_argument('--workers', type=int, default=4, help='worker processes per server')
+  parser.add_argument('--concurrency', type=int, default=64, help='client connections')
+  parser.add_argument('--duration', type=float, default=10, help='seconds per page and mode')
+  parser.add_argument('--warmup', type=float, default=1, help='seconds of single-client warmup per page and mode')
+  parser.add_argument('--cache', action='store_true', help='keep the detail page and fragment caches enabled')
+  parser.add_argument('--sync-url', default='http://127.0.0.1:8001')
+  parser.add_argument('--async-url', default='http://127.0.0.1:8002')
+  parser.add_argument('--no-servers', action='store_true', help='use servers already running at the urls')
+  args = parser.parse_args()
+
+  datagen.use_bench_database()
+  with app.app_context():
+    if args.seed:
+      datagen.generate(args.seed, args.seed * 2, args.seed * 10, seed=0.42, clear=True)
+    params = page_params()
+    db.session.remove()
+
+  servers = []
+  if not args.no_servers:
+    servers = start_servers(args.workers, args.cache,
+                            urllib.parse.urlsplit(args.sync_url).port, urllib.parse.urlsplit(args.async_url).port)
+  try:
+    wait_ready(args.sync_url)
+    wait_ready(args.async_url)
+    print('%d workers per server, %d client connections, %gs per page' % (args.workers, args.concurrency, args.duration))
+    for name, path in PAGES:
+      path = path.format(**params)
+      results = {}
+      for mode, url in (('sync', args.sync_url), ('async', args.async_url)):
+        row = results[mode] = measure(url, path, args.concurrency, args.duration, args.warmup)
+        print('%-16s %-5s %8.1f req/s  p50 %7.2fms  p99 %7.2fms  %d errors' % (
+          name, mode, row['throughput'], row['p50'], row['p99'], row['errors']))
+      if results['sync']['throughput'] and results['sync']['p99']:
+        print('%-16s async/sync: %.2fx req/s, %.2fx p99' % (
+          name, results['async']['throughput'] / results['sync']['throughput'],
+          results['async']['p99'] / results['sync']['p99']))
+  finally:
+    for server in servers:
+      server.terminate()
+    for server in servers:
+      server.wait()
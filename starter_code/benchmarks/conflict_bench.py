@@ -0,0 +1,83 @@
+#----------------------------------------------------------------------------#
+# Booking conflict check benchmark.
+#
+#   python -m benchmarks.conflict_bench --seed 1000000
+#
+# --seed generates that many shows (plus one venue per 100 and one artist
+# per 50 shows) into FYYUR_BENCH_DATABASE_URL first; run `flask db upgrade`
+# against it so the exclusion constraints and their GiST indexes exist.
+# Measures single-booking checks against the database (the show form path),
+# batched checks (the import and POST /shows path) and the in-process
+# IntervalIndex used to check a batch against itself.
+#----------------------------------------------------------------------------#
+
+import argparse
+import datetime
+import random
+import time
+from app import app, db
+import conflicts
+from benchmarks import datagen
+from benchmarks.stats import summarize
+
+
+def candidates(count, venues, artists, rng):
+  # random two-hour bookings on the generator's grid, a year either side of now
+  base = datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - datetime.timedelta(days=365)
+  rows = []
+  for _ in range(count):
+    start_time = base + datetime.timedelta(hours=2 * rng.randrange(365 * 12))
+    rows.append({
+      'venue_id': rng.randint(*venues),
+      'artist_id': rng.randint(*artists),
+      'start_time': start_time,
+      'end_time': start_time + datetime.timedelta(hours=2)
+    })
+  return rows
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Measure booking conflict checks.')
+  parser.add_argument('--seed', type=int, default=0, help='synthetic shows to generate first')
+  parser.add_argument('--skew', type=float, default=1.0, help='show ownership skew for --seed')
+  parser.add_argument('--checks', type=int, default=2000, help='single-booking checks to time')
+  parser.add_argument('--batch', type=int, default=1000, help='rows per batched check')
+  parser.add_argument('--batches', type=int, default=20)
+  parser.add_argument('--index-rows', type=int, default=100000, help='rows for the in-process index')
+  args = parser.parse_args()
+
+  datagen.use_bench_database()
+  rng = random.Random(42)
+  with app.app_context():
+    if args.seed:
+      datagen.generate(max(args.seed // 100, 1), max(args.seed // 50, 1), args.seed, args.skew, seed=0.42, clear=True)
+    shows = db.session.execute(db.text('SELECT count(*) FROM shows')).scalar()
+    venues = db.session.execute(db.text('SELECT min(id), max(id) FROM venues')).fetchone()
+    artists = db.session.execute(db.text('SELECT min(id), max(id) FROM artists')).fetchone()
+    print('shows: %d' % shows)
+
+    samples, found = [], 0
+    for row in candidates(args.checks, venues, artists, rng):
+      started = time.perf_counter()
+      found += bool(conflicts.find_conflicts([row]))
+      samples.append((time.perf_counter() - started) * 1000)
+    result = summarize(samples)
+    print('single check:  %8.0f checks/s  p50=%.2fms p99=%.2fms  (%d%% conflicting)' % (
+      result['count'] / (sum(samples) / 1000), result['p50'], result['p99'], 100 * found // max(args.checks, 1)))
+
+    samples = []
+    for _ in range(args.batches):
+      rows = candidates(args.batch, venues, artists, rng)
+      started = time.perf_counter()
+      conflicts.find_conflicts(rows)
+      samples.append((time.perf_counter() - started) * 1000)
+    result = summarize(samples)
+    print('batched check: %8.0f rows/s    p50=%.2fms p99=%.2fms per %d rows' % (
+      args.batch * result['count'] / (sum(samples) / 1000), result['p50'], result['p99'], args.batch))
+
+    rows = candidates(args.index_rows, venues, artists, rng)
+    started = time.perf_counter()
+    clashes = conflicts.batch_conflicts(rows)
+    elapsed = time.perf_counter() - started
+    print('interval index: %7.0f rows/s    %d rows, %d clashing within the batch' % (
+      len(rows) / elapsed, len(rows), len(clashes)))
@@ -0,0 +1,150 @@
+#----------------------------------------------------------------------------#
+# Synthetic dataset generator.
+#
+#   FYYUR_BENCH_DATABASE_URL=postgresql://localhost/fyyur_bench \
+#     python -m benchmarks.datagen --venues 10000 --artists 20000 --shows 100000 --reset
+#
+# Rows are generated inside PostgreSQL with generate_series, so millions of
+# rows take seconds. Show ownership is skewed: with the default skew of 3 a
+# few low-id venues and artists get most of the shows, like real popularity.
+# Every benchmark writes to the database named by FYYUR_BENCH_DATABASE_URL and
+# refuses to run without it; run `flask db upgrade` against it first.
+#----------------------------------------------------------------------------#
+
+import argparse
+import os
+from app import app, db
+from forms import genres
+import cache
+import counters
+import matches
+import suggest
+
+WORDS = ['The', 'Wild', 'Sax', 'Band', 'Guns', 'Petals', 'Musical', 'Hop', 'Park',
+         'Square', 'Live', 'Music', 'Coffee', 'Dueling', 'Pianos', 'Bar', 'Blue',
+         'Note', 'Velvet', 'Echo', 'Quartet', 'Collective', 'Sound', 'Garage']
+CITIES = ['San Francisco', 'New York', 'Austin', 'Chicago', 'Seattle', 'Nashville']
+STATES = ['CA', 'NY', 'TX', 'IL', 'WA', 'TN']
+TIMEZONES = ['America/Los_Angeles', 'America/New_York', 'America/Chicago', 'America/Chicago',
+             'America/Los_Angeles', 'America/Chicago']
+GENRES = [genre for genre, _ in genres]
+
+
+def use_bench_database():
+  url = os.environ.get('FYYUR_BENCH_DATABASE_URL')
+  if not url:
+    raise SystemExit('Set FYYUR_BENCH_DATABASE_URL to a scratch PostgreSQL database; benchmarks write to it.')
+  app.config['SQLALCHEMY_DATABASE_URI'] = url
+
+
+def _array(values):
+  return 'ARRAY[' + ', '.join("'%s'" % value for value in values) + ']'
+
+
+# three random words; i is referenced so PostgreSQL evaluates per row
+NAME_SQL = ' || \' \' || '.join(['w[1 + floor(random() * array_length(w, 1))::int]'] * 3)
+GENRES_SQL = 'ARRAY(SELECT g[1 + floor(random() * array_length(g, 1))::int] ' \
+  'FROM generate_series(1, 1 + floor(random() * 3)::int) WHERE i IS NOT NULL)'
+FROM_SQL = """
+  FROM generate_series(1, :count) AS i,
+       LATERAL (SELECT {words} AS w, {genres} AS g) AS lists,
+       LATERAL (SELECT floor(power(random(), 2) * {cities})::int + 0 * i AS k) AS pick,
+       LATERAL (SELECT ({city_list})[k + 1] AS city, ({state_list})[k + 1] AS state,
+                       ({timezone_list})[k + 1] AS timezone) AS c
+""".format(
+  words=_array(WORDS),
+  genres=_array(GENRES),
+  cities=len(CITIES),
+  city_list=_array(CITIES),
+  state_list=_array(STATES),
+  timezone_list=_array(TIMEZONES)
+)
+
+
+def insert_venues(count):
+  db.session.execute(db.text("""
+    INSERT INTO venues (name, city, state, address, phone, genres, image_link, facebook_link,
+                        website, seeking_talent, seeking_description, timezone)
+    SELECT {name}, c.city, c.state, i || ' Main Street', '555-555-0100', {genres},
+           'https://picsum.photos/seed/venue' || i || '/300', 'https://facebook.com',
+           'https://pydata.co', random() < 0.3, 'Looking for local acts', c.timezone
+  """.format(name=NAME_SQL, genres=GENRES_SQL) + FROM_SQL), {'count': count})
+
+
+def insert_artists(count):
+  db.session.execute(db.text("""
+    INSERT INTO artists (name, city, state, phone, genres, image_link, website, facebook_link,
+                         seeking_venue, seeking_description)
+    SELECT {name}, c.city, c.state, '555-555-0199', {genres},
+           'https://picsum.photos/seed/artist' || i || '/300', NULL, NULL,
+           random() < 0.3, 'Looking for venues'
+  """.format(name=NAME_SQL, genres=GENRES_SQL) + FROM_SQL), {'count': count})
+
+
+def insert_shows(count, skew=3.0):
+  # power(random(), skew) piles show ownership onto the lowest ids; shows
+  # start on a two-hour grid within a year either side of now and last two
+  # hours, and draws that would double-book a venue or an artist are
+  # skipped by the exclusion constraints (ON CONFLICT DO NOTHING), so
+  # insertion is retried for the shortfall a few times. Returns the number
+  # of shows inserted. Assumes contiguous ids (--reset).
+  inserted = 0
+  for _ in range(5):
+    inserted += db.session.execute(db.text("""
+      INSERT INTO shows (artist_id, venue_id, start_time, end_time)
+      SELECT artist_id, venue_id, start_time, start_time + interval '2 hours'
+      FROM (
+        SELECT a.low + floor(power(random(), :skew) * (a.high - a.low + 1))::int AS artist_id,
+               v.low + floor(power(random(), :skew) * (v.high - v.low + 1))::int AS venue_id,
+               date_trunc('day', now() at time zone 'utc') - interval '365 days'
+                 + floor(random() * 365 * 24)::int * interval '2 hours' AS start_time
+        FROM generate_series(1, :count) AS i,
+             (SELECT min(id) AS low, max(id) AS high FROM artists) AS a,
+             (SELECT min(id) AS low, max(id) AS high FROM venues) AS v
+      ) AS drawn
+      ON CONFLICT DO NOTHING
+    """), {'count': count - inserted, 'skew': skew}).rowcount
+    if inserted >= count:
+      break
+  return inserted
+
+
+def reset():
+  db.session.execute(db.text('TRUNCATE shows, venues, artists, entity_versions RESTART IDENTITY CASCADE'))
+
+
+def generate(venues, artists, shows, skew=3.0, seed=None, clear=False):
+  if seed is not None:
+    db.session.execute(db.text('SELECT setseed(:seed)'), {'seed': seed})
+  if clear:
+    reset()
+  insert_venues(venues)
+  insert_artists(artists)
+  inserted = insert_shows(shows, skew)
+  db.session.commit()
+  # generated shows span the watermark; recount against now
+  counters.rebuild()
+  for table in ('venues', 'artists', 'shows'):
+    db.session.execute(db.text('ANALYZE ' + table))
+  db.session.commit()
+  # the data changed under the in-process caches
+  cache.detail_cache.clear()
+  suggest.load_index()
+  matches.load_indexes()
+  return inserted
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Generate a synthetic Fyyur dataset.')
+  parser.add_argument('--venues', type=int, default=1000)
+  parser.add_argument('--artists', type=int, default=2000)
+  parser.add_argument('--shows', type=int, default=10000)
+  parser.add_argument('--skew', type=float, default=3.0, help='higher piles more shows onto fewer venues/artists')
+  parser.add_argument('--seed', type=float, help='random seed in [-1, 1] for repeatable data')
+  parser.add_argument('--reset', action='store_true', help='truncate all tables first')
+  args = parser.parse_args()
+
+  use_bench_database()
+  with app.app_context():
+    shows = generate(args.venues, args.artists, args.shows, args.skew, args.seed, args.reset)
+    print('generated %d venues, %d artists, %d shows' % (args.venues, args.artists, shows))
@@ -0,0 +1,43 @@
+#----------------------------------------------------------------------------#
+# Datetime filter benchmark: rows formatted per second.
+#
+#   python -m benchmarks.datetime_bench --rows 5000
+#
+# "legacy" is the old pipeline: strftime in the model, dateutil re-parse and
+# babel.dates.format_datetime in the filter. "filter" is the current
+# format_datetime filter fed datetime objects, with and without a venue
+# timezone.
+#----------------------------------------------------------------------------#
+
+import argparse
+import datetime
+import time
+import babel.dates
+import dateutil.parser
+from app import app, format_datetime, DATETIME_FORMATS
+
+
+def legacy(value, format='full'):
+  value = datetime.datetime.strftime(value, "%d-%m-%Y %H:%M:%S")
+  return babel.dates.format_datetime(dateutil.parser.parse(value), DATETIME_FORMATS[format], locale=app.config['DATETIME_LOCALE'])
+
+
+def rate(fn, values, **kwargs):
+  started = time.perf_counter()
+  for value in values:
+    fn(value, 'full', **kwargs)
+  return len(values) / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Measure the datetime template filter.')
+  parser.add_argument('--rows', type=int, default=5000)
+  args = parser.parse_args()
+
+  start = datetime.datetime(2021, 1, 1, 20, 0)
+  values = [start + datetime.timedelta(hours=7 * i) for i in range(args.rows)]
+  format_datetime(values[0], 'full')
+
+  print('legacy:        %10.0f rows/s' % rate(legacy, values))
+  print('filter:        %10.0f rows/s' % rate(format_datetime, values))
+  print('filter + tz:   %10.0f rows/s' % rate(format_datetime, values, tz='America/Los_Angeles'))
@@ -0,0 +1,203 @@
+#----------------------------------------------------------------------------#
+# Route benchmark harness.
+#
+#   FYYUR_BENCH_DATABASE_URL=postgresql://localhost/fyyur_bench \
+#     python -m benchmarks.harness --sizes 1000,10000 --baseline benchmarks/baseline.json
+#
+# For every dataset size (number of venues; artists and shows scale with it)
+# the harness regenerates the data with benchmarks.datagen, then drives every
+# route in app.py through the Flask test client and records throughput,
+# p50/p95/p99 latency and SQL queries per request (from the Server-Timing
+# header). Results are written as JSON. The run fails when
+#   - a route marked constant issues more queries at a larger size, or
+#   - a route regresses against --baseline (p95 beyond --tolerance, or more
+#     queries per request than recorded).
+# --save-baseline stores the current results as the new baseline. A
+# --baseline that does not exist, or lacks a measured route or size, fails
+# the run instead of passing it unchecked. The detail page and fragment
+# caches are off unless --cache.
+#----------------------------------------------------------------------------#
+
+import argparse
+import datetime
+import json
+import os
+import re
+import sys
+import time
+from app import app, db
+from models import Venue, Artist, Show
+import cache
+from benchmarks import datagen
+from benchmarks.stats import summarize
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+# (name, method, path, constant queries per request across sizes)
+ROUTES = [
+  ('home', 'GET', '/', True),
+  ('venues', 'GET', '/venues', True),
+  ('artists', 'GET', '/artists', True),
+  ('shows', 'GET', '/shows', True),
+  ('shows next page', 'GET', '/shows?after={cursor}', True),
+  ('venue detail', 'GET', '/venues/{venue_id}', True),
+  ('artist detail', 'GET', '/artists/{artist_id}', True),
+  ('venue search', 'GET', '/venues/search?search_term=band', True),
+  ('artist search', 'GET', '/artists/search?search_term=the', True),
+  ('suggest', 'GET', '/api/search/suggest?q=th', True),
+  ('venue form', 'GET', '/venues/create', True),
+  ('artist form', 'GET', '/artists/create', True),
+  ('show form', 'GET', '/shows/create', True),
+  ('edit venue form', 'GET', '/venues/{venue_id}/edit', True),
+  ('edit artist form', 'GET', '/artists/{artist_id}/edit', True),
+  ('venue matches', 'GET', '/venues/{venue_id}/matches', True),
+  ('artist matches', 'GET', '/artists/{artist_id}/matches', True),
+  ('api venues', 'GET', '/api/v1/venues', True),
+  ('api artists', 'GET', '/api/v1/artists?genre=Jazz', True),
+  ('api shows', 'GET', '/api/v1/shows', True),
+  ('api shows by venue', 'GET', '/api/v1/shows?venue_id={venue_id}', True),
+  ('api export since', 'GET', '/api/v1/export/shows.csv?since={since}', True),
+  ('db health', 'GET', '/healthz/db', True),
+  ('cache health', 'GET', '/healthz/cache', True),
+  ('create venue', 'POST', '/venues', True),
+  ('create artist', 'POST', '/artists', True),
+  ('create show', 'POST', '/shows', True),
+]
+
+NEW_VENUE = {'name': 'Benchmark Hall', 'city': 'Austin', 'state': 'TX', 'address': '1 Main Street', 'genres': ['Jazz']}
+NEW_ARTIST = {'name': 'Benchmark Band', 'city': 'Austin', 'state': 'TX', 'genres': ['Jazz']}
+# after every generated show; each request books the next free slot
+FIRST_NEW_SHOW = datetime.datetime(2100, 1, 1, 20)
+
+
+def new_show(params, position):
+  start_time = FIRST_NEW_SHOW + position * datetime.timedelta(hours=3)
+  return {'venue_id': params['venue_id'], 'artist_id': params['artist_id'], 'start_time': start_time.isoformat()}
+
+
+# body of the n-th request to each POST route
+BODIES = {
+  'create venue': lambda params, position: NEW_VENUE,
+  'create artist': lambda params, position: NEW_ARTIST,
+  'create show': new_show,
+}
+
+
+def route_params():
+  # the busiest venue and artist (lowest ids under skewed generation), the
+  # cursor of the second /shows page and the end of data generation
+  return {
+    'venue_id': db.session.query(db.func.min(Venue.id)).scalar(),
+    'artist_id': db.session.query(db.func.min(Artist.id)).scalar(),
+    'cursor': Show.page(per_page=app.config['SHOWS_PER_PAGE'])['next_cursor'] or '',
+    'since': datetime.datetime.utcnow().isoformat()
+  }
+
+
+def measure(client, method, path, requests, warmup, body=None):
+  samples, queries = [], []
+  for position in range(warmup + requests):
+    started = time.perf_counter()
+    if method == 'POST':
+      response = client.post(path, json=body(position))
+    else:
+      response = client.get(path)
+    elapsed = (time.perf_counter() - started) * 1000
+    if response.status_code >= 400:
+      raise SystemExit('%s %s returned %d' % (method, path, response.status_code))
+    if position >= warmup:
+      samples.append(elapsed)
+      match = SERVER_TIMING_QUERIES.search(response.headers.get('Server-Timing', ''))
+      queries.append(int(match.group(1)) if match else 0)
+  result = summarize(samples)
+  result['throughput'] = len(samples) / (sum(samples) / 1000.0) if samples else 0.0
+  result['queries'] = max(queries) if queries else 0
+  return result
+
+
+def run(sizes, requests, warmup, artists_per_venue, shows_per_venue, use_cache):
+  app.config['WTF_CSRF_ENABLED'] = False
+  app.config['SERVER_TIMING'] = True
+  if not use_cache:
+    cache.detail_cache.maxsize = 0
+    app.jinja_env.fragment_cache = None
+  results = {}
+  with app.app_context():
+    for size in sizes:
+      datagen.generate(size, size * artists_per_venue, size * shows_per_venue, seed=0.42, clear=True)
+      params = route_params()
+      db.session.remove()
+      client = app.test_client()
+      results[str(size)] = {}
+      for name, method, path, _ in ROUTES:
+        body = BODIES.get(name)
+        results[str(size)][name] = measure(client, method, path.format(**params), requests, warmup,
+                                           body and (lambda position: body(params, position)))
+        row = results[str(size)][name]
+        print('%8d  %-18s %8.1f req/s  p50 %7.2fms  p95 %7.2fms  p99 %7.2fms  %3d queries' % (
+          size, name, row['throughput'], row['p50'], row['p95'], row['p99'], row['queries']))
+  return results
+
+
+def check(results, baseline, tolerance):
+  # baseline None skips the comparison
+  failures = []
+  sizes = sorted(results, key=int)
+  for name, _, _, constant in ROUTES:
+    if constant:
+      counts = [results[size][name]['queries'] for size in sizes]
+      if max(counts) > counts[0]:
+        failures.append('%s: queries per request grow with dataset size %s' % (name, counts))
+  if baseline is None:
+    return failures
+  for size in sizes:
+    for name, row in results[size].items():
+      expected = baseline.get(size, {}).get(name)
+      if expected is None:
+        failures.append('%s @%s: not in the baseline, record it again with --save-baseline' % (name, size))
+        continue
+      if row['queries'] > expected['queries']:
+        failures.append('%s @%s: %d queries per request, baseline %d' % (name, size, row['queries'], expected['queries']))
+      if row['p95'] > expected['p95'] * (1 + tolerance):
+        failures.append('%s @%s: p95 %.2fms, baseline %.2fms' % (name, size, row['p95'], expected['p95']))
+  return failures
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark every route at several dataset sizes.')
+  parser.add_argument('--sizes', default='1000,10000', help='comma separated venue counts')
+  parser.add_argument('--artists-per-venue', type=int, default=2)
+  parser.add_argument('--shows-per-venue', type=int, default=10)
+  parser.add_argument('--requests', type=int, default=50)
+  parser.add_argument('--warmup', type=int, default=5)
+  parser.add_argument('--cache', action='store_true', help='keep the detail page and fragment caches enabled')
+  parser.add_argument('--output', default=os.path.join('benchmarks', 'results', 'latest.json'))
+  parser.add_argument('--baseline', help='JSON results to compare against')
+  parser.add_argument('--tolerance', type=float, default=0.25, help='allowed p95 slowdown against the baseline')
+  parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline')
+  args = parser.parse_args()
+
+  if args.baseline and not args.save_baseline and not os.path.exists(args.baseline):
+    raise SystemExit('Baseline %s does not exist; record one on this machine with --save-baseline.' % args.baseline)
+  datagen.use_bench_database()
+  sizes = [int(size) for size in args.sizes.split(',')]
+  results = run(sizes, args.requests, args.warmup, args.artists_per_venue, args.shows_per_venue, args.cache)
+
+  os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+  with open(args.output, 'w') as output:
+    json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, output, indent=2, sort_keys=True)
+  print('results written to %s' % args.output)
+
+  if args.save_baseline and args.baseline:
+    with open(args.baseline, 'w') as output:
+      json.dump(results, output, indent=2, sort_keys=True)
+    print('baseline written to %s' % args.baseline)
+
+  baseline = None
+  if args.baseline and not args.save_baseline:
+    with open(args.baseline) as source:
+      baseline = json.load(source)
+  failures = check(results, baseline, args.tolerance)
+  for failure in failures:
+    print('FAIL ' + failure)
+  sys.exit(1 if failures else 0)
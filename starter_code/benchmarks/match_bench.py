@@ -0,0 +1,98 @@
+#----------------------------------------------------------------------------#
+# Matchmaking benchmark: top-k latency against N counterparts.
+#
+#   python -m benchmarks.match_bench --counterparts 100000
+#   python -m benchmarks.match_bench --seed 50000
+#
+# Works on synthetic rows first; no database is touched. Each ranking gets a
+# random past-shows history like the one matches.py reads from the shows
+# table. --seed then generates that many venues in FYYUR_BENCH_DATABASE_URL
+# (two artists and ten shows per venue, skewed onto the busiest ones) and
+# times venue_matches() end to end, past-shows query included, for random
+# venues, with the query's own share. The target is a p99 under 20ms for
+# 100k counterparts, end to end.
+#----------------------------------------------------------------------------#
+
+import argparse
+import random
+import time
+from app import app, db
+from models import Venue, Show
+import matches
+from matches import MatchIndex, genre_bits
+from benchmarks import datagen
+from benchmarks.stats import summarize
+from benchmarks.datagen import CITIES, STATES, GENRES, WORDS
+
+
+def rows(count, rng):
+  for entity_id in range(1, count + 1):
+    place = rng.randrange(len(CITIES))
+    yield (entity_id, ' '.join(rng.choice(WORDS) for _ in range(3)), rng.sample(GENRES, rng.randint(1, 3)),
+           CITIES[place], STATES[place], rng.random() < 0.3)
+
+
+def timed(call, lookups, ids, rng):
+  samples = []
+  for _ in range(lookups):
+    entity_id = rng.choice(ids)
+    started = time.perf_counter()
+    call(entity_id)
+    samples.append((time.perf_counter() - started) * 1000)
+  return summarize(samples)
+
+
+def database_matches(args, rng):
+  # (venue_matches, history query) timings against generated data
+  datagen.use_bench_database()
+  with app.app_context():
+    datagen.generate(args.seed, args.seed * 2, args.seed * 10, seed=0.42, clear=True)
+    # as in a worker, so no rebuild starts during the timings
+    matches.start()
+    venue_ids = [venue_id for venue_id, in db.session.query(Venue.id)]
+    history = timed(lambda venue_id: matches._history(Show.venue_id, Show.artist_id, venue_id), args.lookups, venue_ids, rng)
+    end_to_end = timed(lambda venue_id: matches.venue_matches(venue_id, args.limit), args.lookups, venue_ids, rng)
+    db.session.remove()
+  return end_to_end, history
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Measure /venues/<id>/matches ranking cost.')
+  parser.add_argument('--counterparts', type=int, default=100000)
+  parser.add_argument('--lookups', type=int, default=1000)
+  parser.add_argument('--limit', type=int, default=10)
+  parser.add_argument('--history', type=int, default=50, help='past-show partners per ranked entity')
+  parser.add_argument('--seed', type=int, default=0, help='venues to generate for the end-to-end run, 0 to skip it')
+  args = parser.parse_args()
+
+  rng = random.Random(42)
+  index = MatchIndex()
+  started = time.perf_counter()
+  index.load(rows(args.counterparts, rng))
+  load_ms = (time.perf_counter() - started) * 1000
+
+  samples = []
+  for _ in range(args.lookups):
+    place = rng.randrange(len(CITIES))
+    entity = {'bits': genre_bits(rng.sample(GENRES, rng.randint(1, 3))), 'city': CITIES[place], 'state': STATES[place]}
+    history = dict((rng.randint(1, args.counterparts), rng.randint(1, 20)) for _ in range(args.history))
+    started = time.perf_counter()
+    index.top(entity, history, args.limit)
+    samples.append((time.perf_counter() - started) * 1000)
+  result = summarize(samples)
+
+  started = time.perf_counter()
+  for entity_id in range(1, 1001):
+    index.upsert(entity_id, 'renamed', ['Jazz'], 'Austin', 'TX', True)
+  upsert_us = (time.perf_counter() - started) * 1000
+
+  print('counterparts: %d  load: %.0fms  upsert: %.1fus' % (args.counterparts, load_ms, upsert_us))
+  print('top-%d: n=%d mean=%.2fms p50=%.2fms p95=%.2fms p99=%.2fms (%s 20ms)' % (
+    args.limit, result['count'], result['mean'], result['p50'], result['p95'], result['p99'],
+    'under' if result['p99'] < 20 else 'OVER'))
+
+  if args.seed:
+    end_to_end, history = database_matches(args, rng)
+    print('venue_matches (%d venues, %d artists): n=%d p50=%.2fms p99=%.2fms (%s 20ms)  history query p50=%.2fms p99=%.2fms' % (
+      args.seed, args.seed * 2, end_to_end['count'], end_to_end['p50'], end_to_end['p99'],
+      'under' if end_to_end['p99'] < 20 else 'OVER', history['p50'], history['p99']))
@@ -0,0 +1,142 @@
+#----------------------------------------------------------------------------#
+# Template rendering benchmark.
+#
+#   python -m benchmarks.render_bench --renders 500
+#
+# Works on synthetic page data; no database is touched (the listing versions
+# entity_version() reads are preset on flask.g). Measures
+#   - loading every template in a fresh environment, compiling each one
+#     versus reading it from a warm bytecode cache, as a new worker does;
+#   - p50/p99 render time of the venues, shows and detail pages with the
+#     fragment cache off, then warm.
+#----------------------------------------------------------------------------#
+
+import argparse
+import datetime
+import random
+import shutil
+import tempfile
+import time
+from flask import g, render_template
+from app import app
+import cache
+import templating
+from benchmarks.stats import summarize
+from benchmarks.datagen import CITIES, STATES, TIMEZONES, GENRES, WORDS
+
+NO_FACETS = {'total': 0, 'genres': [], 'states': [], 'match': 'all', 'match_args': {}, 'filtered': False}
+
+
+def name(rng):
+  return ' '.join(rng.choice(WORDS) for _ in range(3))
+
+
+def show_rows(count, venues, artists, rng):
+  # every field any show tile renders
+  start = datetime.datetime(2026, 1, 1, 20)
+  rows = []
+  for position in range(count):
+    venue_id, artist_id = rng.randint(1, venues), rng.randint(1, artists)
+    rows.append({
+      'venue_id': venue_id,
+      'venue_name': name(rng),
+      'venue_image_link': 'https://example.com/venues/%d.jpg' % venue_id,
+      'venue_timezone': rng.choice(TIMEZONES),
+      'venue_version': 1,
+      'artist_id': artist_id,
+      'artist_name': name(rng),
+      'artist_image_link': 'https://example.com/artists/%d.jpg' % artist_id,
+      'artist_version': 1,
+      'start_time': start + datetime.timedelta(hours=2 * position)
+    })
+  return rows
+
+
+def entity(entity_id, shows, rng):
+  past, upcoming = shows[:len(shows) // 2], shows[len(shows) // 2:]
+  place = rng.randrange(len(CITIES))
+  return {
+    'id': entity_id, 'name': name(rng), 'genres': rng.sample(GENRES, 2), 'city': CITIES[place],
+    'state': STATES[place], 'address': '1015 Folsom Street', 'phone': '123-123-1234',
+    'website': None, 'facebook_link': None, 'image_link': None, 'seeking_talent': False,
+    'seeking_venue': False, 'seeking_description': None, 'timezone': TIMEZONES[place],
+    'past_shows': past, 'past_shows_count': len(past),
+    'upcoming_shows': upcoming, 'upcoming_shows_count': len(upcoming)
+  }
+
+
+def pages(args, rng):
+  # (name, path, template, context)
+  venues, artists = args.venues, args.venues * 2
+  areas = [{
+    'city': city,
+    'state': state,
+    'venues': [{'id': venue_id, 'name': name(rng), 'num_upcoming_shows': rng.randint(0, 10)}
+               for venue_id in range(index + 1, venues + 1, len(CITIES))]
+  } for index, (city, state) in enumerate(zip(CITIES, STATES))]
+  return [
+    ('venues', '/venues', 'pages/venues.html', {'areas': areas, 'facets': NO_FACETS}),
+    ('shows', '/shows', 'pages/shows.html', {
+      'shows': show_rows(app.config['SHOWS_PER_PAGE'], venues, artists, rng),
+      'prev_cursor': None, 'next_cursor': 'next', 'per_page': app.config['SHOWS_PER_PAGE']}),
+    ('venue detail', '/venues/1', 'pages/show_venue.html', {
+      'venue': entity(1, show_rows(args.detail_shows, 1, artists, rng), rng)}),
+    ('artist detail', '/artists/1', 'pages/show_artist.html', {
+      'artist': entity(1, show_rows(args.detail_shows, venues, 1, rng), rng)}),
+  ]
+
+
+def preset_versions():
+  return {'venues': 1, 'artists': 1, 'shows': 1}
+
+
+def load_templates(bytecode_cache):
+  # a fresh template cache, as in a newly started worker
+  environment = app.jinja_env.overlay(cache_size=1000, bytecode_cache=bytecode_cache)
+  started = time.perf_counter()
+  templates = [template for template in environment.list_templates() if template.endswith('.html')]
+  for template in templates:
+    environment.get_template(template)
+  return len(templates), (time.perf_counter() - started) * 1000
+
+
+def render(path, template, context, versions, renders):
+  samples = []
+  with app.test_request_context(path):
+    g.entity_versions = dict(versions)
+    for _ in range(renders):
+      started = time.perf_counter()
+      render_template(template, **context)
+      samples.append((time.perf_counter() - started) * 1000)
+  return summarize(samples)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Measure template load and render times.')
+  parser.add_argument('--renders', type=int, default=500, help='renders per page and mode')
+  parser.add_argument('--venues', type=int, default=1000, help='venues listed on /venues')
+  parser.add_argument('--detail-shows', type=int, default=60, help='shows on each detail page')
+  parser.add_argument('--loads', type=int, default=5, help='fresh environments to time')
+  args = parser.parse_args()
+
+  rng = random.Random(42)
+  directory = tempfile.mkdtemp(prefix='fyyur-jinja-')
+  try:
+    bytecode_cache = templating.bytecode_cache(directory)
+    load_templates(bytecode_cache)
+    for label, cache_backend in (('compile', None), ('bytecode cache', bytecode_cache)):
+      times = [load_templates(cache_backend) for _ in range(args.loads)]
+      print('load %-14s %d templates  p50 %7.2fms  max %7.2fms' % (
+        label, times[0][0], summarize([ms for _, ms in times])['p50'], max(ms for _, ms in times)))
+  finally:
+    shutil.rmtree(directory)
+
+  versions = preset_versions()
+  for page, path, template, context in pages(args, rng):
+    app.jinja_env.fragment_cache = None
+    before = render(path, template, context, versions, args.renders)
+    app.jinja_env.fragment_cache = cache.LRUCache(app.config['FRAGMENT_CACHE_MAXSIZE'], app.config['FRAGMENT_CACHE_TTL'])
+    render(path, template, context, versions, 1)
+    after = render(path, template, context, versions, args.renders)
+    print('render %-14s no fragments p50 %7.2fms p99 %7.2fms   fragment cache p50 %7.2fms p99 %7.2fms  (%.1fx)' % (
+      page, before['p50'], before['p99'], after['p50'], after['p99'], before['p50'] / after['p50'] if after['p50'] else 0))
@@ -0,0 +1,51 @@
+#----------------------------------------------------------------------------#
+# Search latency benchmark.
+#
+#   python -m benchmarks.search_bench --seed 1000000
+#
+# --seed inserts that many synthetic artists (and one venue per 10 artists)
+# into FYYUR_BENCH_DATABASE_URL before measuring (see benchmarks/datagen.py).
+# Run `flask db upgrade` against it first so the trigram and genre indexes
+# exist.
+#----------------------------------------------------------------------------#
+
+import argparse
+import time
+from app import app, db
+import search
+from benchmarks import datagen
+from benchmarks.stats import summarize
+
+TERMS = ['band', 'Musical Hop', 'sax', 'jazz', 'CA', 'Nashville', 'velvet echo', 'xyzzy']
+
+
+def run(fn, terms, rounds):
+  samples = []
+  for _ in range(rounds):
+    for term in terms:
+      started = time.perf_counter()
+      fn(term)
+      samples.append((time.perf_counter() - started) * 1000)
+  return summarize(samples)
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Measure /venues/search and /artists/search latency.')
+  parser.add_argument('--seed', type=int, default=0, help='synthetic artists to insert first')
+  parser.add_argument('--rounds', type=int, default=20)
+  args = parser.parse_args()
+
+  datagen.use_bench_database()
+  with app.app_context():
+    if args.seed:
+      datagen.insert_artists(args.seed)
+      datagen.insert_venues(max(args.seed // 10, 1))
+      db.session.commit()
+      db.session.execute(db.text('ANALYZE artists; ANALYZE venues'))
+      db.session.commit()
+    artists = db.session.execute(db.text('SELECT count(*) FROM artists')).scalar()
+    print('artists: %d' % artists)
+    for name, fn in (('search_artists', search.search_artists), ('search_venues', search.search_venues)):
+      result = run(fn, TERMS, args.rounds)
+      print('%-15s n=%-5d mean=%.2fms p50=%.2fms p95=%.2fms p99=%.2fms' % (
+        name, result['count'], result['mean'], result['p50'], result['p95'], result['p99']))
@@ -0,0 +1,21 @@
+import math
+
+
+def percentile(samples, pct):
+  # nearest-rank percentile of an unsorted list of samples
+  if not samples:
+    return 0.0
+  ordered = sorted(samples)
+  rank = max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)
+  return ordered[rank]
+
+
+def summarize(samples_ms):
+  # latency summary in milliseconds
+  return {
+    'count': len(samples_ms),
+    'mean': sum(samples_ms) / len(samples_ms) if samples_ms else 0.0,
+    'p50': percentile(samples_ms, 50),
+    'p95': percentile(samples_ms, 95),
+    'p99': percentile(samples_ms, 99),
+  }
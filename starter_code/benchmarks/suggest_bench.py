@@ -0,0 +1,55 @@
+#----------------------------------------------------------------------------#
+# Prefix index benchmark: memory per 100k names and lookup latency.
+#
+#   python -m benchmarks.suggest_bench --names 100000
+#
+# Works on synthetic names only; no database is touched.
+#----------------------------------------------------------------------------#
+
+import argparse
+import random
+import time
+import tracemalloc
+from suggest import PrefixIndex
+from benchmarks.stats import summarize
+from benchmarks.datagen import WORDS
+
+
+def names(count, rng):
+  for entity_id in range(1, count + 1):
+    kind = 'venue' if entity_id % 4 == 0 else 'artist'
+    yield kind, entity_id, ' '.join(rng.choice(WORDS) for _ in range(3)) + ' %d' % entity_id
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Measure /api/search/suggest index cost.')
+  parser.add_argument('--names', type=int, default=100000)
+  parser.add_argument('--lookups', type=int, default=10000)
+  args = parser.parse_args()
+
+  rng = random.Random(42)
+  entries = list(names(args.names, rng))
+
+  tracemalloc.start()
+  before = tracemalloc.get_traced_memory()[0]
+  started = time.perf_counter()
+  index = PrefixIndex()
+  index.load(entries)
+  load_ms = (time.perf_counter() - started) * 1000
+  traced = tracemalloc.get_traced_memory()[0] - before
+  tracemalloc.stop()
+
+  prefixes = [name[:rng.randint(1, 6)] for _, _, name in rng.sample(entries, min(args.lookups, len(entries)))]
+  samples = []
+  for prefix in prefixes:
+    started = time.perf_counter()
+    index.suggest(prefix, 10)
+    samples.append((time.perf_counter() - started) * 1000)
+  result = summarize(samples)
+
+  per_100k = 100000.0 / args.names
+  print('names: %d  load: %.0fms' % (args.names, load_ms))
+  print('memory: %.1f MiB traced (%.1f MiB per 100k names), %.1f MiB estimated by memory_usage()' % (
+    traced / 2.0 ** 20, traced / 2.0 ** 20 * per_100k, index.memory_usage() / 2.0 ** 20))
+  print('suggest: n=%d mean=%.3fms p50=%.3fms p95=%.3fms p99=%.3fms' % (
+    result['count'], result['mean'], result['p50'], result['p95'], result['p99']))
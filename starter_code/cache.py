@@ -0,0 +1,231 @@
+from app import app, db
+from models import Venue, Artist, Show
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import collections
+import pickle
+import threading
+import time
+
+#----------------------------------------------------------------------------#
+# Cache.
+#----------------------------------------------------------------------------#
+
+# Response data cache for the venue and artist detail pages. Entries carry
+# tags naming the rows they were built from ('venue:1', 'artist:4'), and a
+# committed insert, update or delete of a Venue, Artist or Show invalidates
+# every entry tagged with the rows it touched. The in-process LRU backend is
+# per worker; use the redis backend when several workers serve the app.
+
+class LRUCache(object):
+
+  def __init__(self, maxsize=1024, ttl=60):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.hits = self.misses = self.invalidations = 0
+    self._entries = collections.OrderedDict()
+    self._tags = collections.defaultdict(set)
+    self._lock = threading.Lock()
+
+  def get(self, key):
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is None or entry[0] < time.time():
+        if entry is not None:
+          self._remove(key)
+        self.misses += 1
+        return None
+      self._entries.move_to_end(key)
+      self.hits += 1
+      return entry[1]
+
+  def set(self, key, value, tags=()):
+    with self._lock:
+      self._remove(key)
+      self._entries[key] = (time.time() + self.ttl, value, tuple(tags))
+      for tag in tags:
+        self._tags[tag].add(key)
+      while len(self._entries) > self.maxsize:
+        self._remove(next(iter(self._entries)))
+
+  def invalidate(self, tags):
+    with self._lock:
+      for tag in tags:
+        for key in list(self._tags.get(tag, ())):
+          self._remove(key)
+          self.invalidations += 1
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._tags.clear()
+
+  def _remove(self, key):
+    entry = self._entries.pop(key, None)
+    if entry is None:
+      return
+    for tag in entry[2]:
+      keys = self._tags.get(tag)
+      if keys is not None:
+        keys.discard(key)
+        if not keys:
+          del self._tags[tag]
+
+  def stats(self):
+    return {
+      'backend': 'lru',
+      'hits': self.hits,
+      'misses': self.misses,
+      'invalidations': self.invalidations,
+      'size': len(self._entries),
+      'maxsize': self.maxsize
+    }
+
+
+class RedisCache(object):
+
+  def __init__(self, url, ttl=60, prefix='fyyur:cache:'):
+    import redis
+    self.ttl = ttl
+    self.prefix = prefix
+    self.hits = self.misses = self.invalidations = 0
+    self._redis = redis.StrictRedis.from_url(url)
+
+  def get(self, key):
+    value = self._redis.get(self.prefix + key)
+    if value is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    return pickle.loads(value)
+
+  def set(self, key, value, tags=()):
+    pipe = self._redis.pipeline()
+    pipe.set(self.prefix + key, pickle.dumps(value), ex=self.ttl)
+    for tag in tags:
+      pipe.sadd(self.prefix + 'tag:' + tag, key)
+      pipe.expire(self.prefix + 'tag:' + tag, self.ttl)
+    pipe.execute()
+
+  def invalidate(self, tags):
+    tag_keys = [self.prefix + 'tag:' + tag for tag in tags]
+    if not tag_keys:
+      return
+    keys = self._redis.sunion(tag_keys)
+    pipe = self._redis.pipeline()
+    for key in keys:
+      pipe.delete(self.prefix + key.decode())
+    pipe.delete(*tag_keys)
+    pipe.execute()
+    self.invalidations += len(keys)
+
+  def clear(self):
+    for key in self._redis.scan_iter(self.prefix + '*'):
+      self._redis.delete(key)
+
+  def stats(self):
+    return {
+      'backend': 'redis',
+      'hits': self.hits,
+      'misses': self.misses,
+      'invalidations': self.invalidations
+    }
+
+
+def create_cache(config):
+  if config['CACHE_BACKEND'] == 'redis':
+    return RedisCache(config['CACHE_REDIS_URL'], config['CACHE_TTL'])
+  return LRUCache(config['CACHE_MAXSIZE'], config['CACHE_TTL'])
+
+
+detail_cache = create_cache(app.config)
+
+
+def _get_or_set(key, load, tags):
+  data = detail_cache.get(key)
+  if data is None:
+    data = load()
+    if data is not None:
+      detail_cache.set(key, data, tags(data))
+  return data
+
+
+# tags of a venue page: the venue and every artist it lists
+def venue_tags(data):
+  return set(
+    ['venue:%d' % data['id']] +
+    ['artist:%d' % show['artist_id'] for show in data['past_shows'] + data['upcoming_shows']]
+  )
+
+
+# tags of an artist page: the artist and every venue it lists
+def artist_tags(data):
+  return set(
+    ['artist:%d' % data['id']] +
+    ['venue:%d' % show['venue_id'] for show in data['past_shows'] + data['upcoming_shows']]
+  )
+
+
+# Venue.format_with_shows
+def venue_detail(venue_id):
+  return _get_or_set('venue:%d' % venue_id, lambda: Venue.get_with_shows(venue_id), venue_tags)
+
+
+# Artist.format_with_shows_venue
+def artist_detail(artist_id):
+  return _get_or_set('artist:%d' % artist_id, lambda: Artist.get_with_shows_venue(artist_id), artist_tags)
+
+
+#----------------------------------------------------------------------------#
+# Invalidation.
+#----------------------------------------------------------------------------#
+
+def tags_for_row(model, row):
+  # tags touched by a written row; row is a model instance or a column mapping
+  get = row.get if isinstance(row, dict) else lambda name: getattr(row, name, None)
+  if model is Venue:
+    return set(['venue:%s' % get('id')])
+  if model is Artist:
+    return set(['artist:%s' % get('id')])
+  return set(['venue:%s' % get('venue_id'), 'artist:%s' % get('artist_id')])
+
+
+def _tags_for_instance(target):
+  tags = set()
+  for model in (Venue, Artist, Show):
+    if isinstance(target, model):
+      tags |= tags_for_row(model, target)
+  if isinstance(target, Show):
+    # a show moved to another venue or artist leaves the old page stale too
+    state = db.inspect(target)
+    tags.update('venue:%s' % value for value in state.attrs.venue_id.history.deleted)
+    tags.update('artist:%s' % value for value in state.attrs.artist_id.history.deleted)
+  return tags
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_tags(session, flush_context):
+  tags = session.info.setdefault('cache_tags', set())
+  for target in list(session.new) + list(session.dirty) + list(session.deleted):
+    tags |= _tags_for_instance(target)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+  tags = session.info.pop('cache_tags', None)
+  if tags:
+    detail_cache.invalidate(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_tags(session):
+  session.info.pop('cache_tags', None)
+
+
+def invalidate_rows(model, rows):
+  # writes that skip the unit of work (core inserts, bulk mappings)
+  tags = set()
+  for row in rows:
+    tags |= tags_for_row(model, row)
+  if tags:
+    detail_cache.invalidate(tags)
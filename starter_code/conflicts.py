@@ -0,0 +1,117 @@
+from app import db
+import bisect
+import collections
+
+#----------------------------------------------------------------------------#
+# Booking conflicts.
+#----------------------------------------------------------------------------#
+
+# A show books its venue and its artist for [start_time, end_time). The
+# exclusion constraints ex_shows_venue_overlap / ex_shows_artist_overlap
+# (GiST over (venue_id, tsrange) and (artist_id, tsrange)) make double
+# bookings impossible; this module finds them before the insert so callers
+# can report which record clashes with which show instead of failing a
+# whole batch. find_conflicts() checks any number of candidate bookings
+# against the database in one query using those GiST indexes, and
+# IntervalIndex checks a batch against itself in memory.
+
+EXCLUSION_VIOLATION = '23P01'
+
+
+def is_conflict(error):
+  # an IntegrityError raised by one of the exclusion constraints
+  return getattr(error.orig, 'pgcode', None) == EXCLUSION_VIOLATION
+
+
+class IntervalIndex(object):
+  # Non-overlapping half-open intervals per key (('venue', 3), ...), kept
+  # sorted by start. Because stored intervals never overlap, their ends are
+  # sorted too, so the only stored interval that can overlap [start, end) is
+  # the last one starting before end: one bisect per lookup.
+
+  def __init__(self):
+    self._starts = collections.defaultdict(list)
+    self._entries = collections.defaultdict(list)
+
+  def conflict(self, key, start, end):
+    # the value stored with the interval overlapping [start, end), or None
+    position = bisect.bisect_left(self._starts[key], end)
+    if position:
+      other_start, other_end, value = self._entries[key][position - 1]
+      if other_end > start:
+        return value
+    return None
+
+  def add(self, key, start, end, value=None):
+    # callers check conflict() first; overlapping adds break the invariant
+    position = bisect.bisect_left(self._starts[key], end)
+    self._starts[key].insert(position, start)
+    self._entries[key].insert(position, (start, end, value))
+
+  def __len__(self):
+    return sum(len(starts) for starts in self._starts.values())
+
+
+def batch_conflicts(rows, labels=None):
+  # {position: reason} for rows overlapping an earlier row of the same
+  # batch; labels name the rows in messages (default: 'record N')
+  labels = labels or ['record %d' % position for position in range(len(rows))]
+  index = IntervalIndex()
+  errors = {}
+  for position, row in enumerate(rows):
+    keys = [('venue', row['venue_id']), ('artist', row['artist_id'])]
+    for key in keys:
+      other = index.conflict(key, row['start_time'], row['end_time'])
+      if other is not None:
+        errors[position] = '%s %s is already booked by %s' % (key[0], key[1], other)
+        break
+    else:
+      for key in keys:
+        index.add(key, row['start_time'], row['end_time'], labels[position])
+  return errors
+
+
+CONFLICTS_SQL = """
+  WITH candidates AS (
+    SELECT * FROM unnest(CAST(:positions AS int[]), CAST(:venue_ids AS int[]), CAST(:artist_ids AS int[]),
+                         CAST(:starts AS timestamp[]), CAST(:ends AS timestamp[]))
+      AS c(position, venue_id, artist_id, start_time, end_time)
+  )
+  SELECT c.position, 'venue' AS kind, s.id AS show_id
+    FROM candidates c JOIN shows s ON s.venue_id = c.venue_id
+     AND tsrange(s.start_time, s.end_time) && tsrange(c.start_time, c.end_time)
+  UNION ALL
+  SELECT c.position, 'artist' AS kind, s.id AS show_id
+    FROM candidates c JOIN shows s ON s.artist_id = c.artist_id
+     AND tsrange(s.start_time, s.end_time) && tsrange(c.start_time, c.end_time)
+"""
+
+
+def find_conflicts(rows):
+  # {position: reason} for rows overlapping a show already in the database
+  if not rows:
+    return {}
+  result = db.session.execute(db.text(CONFLICTS_SQL), {
+    'positions': list(range(len(rows))),
+    'venue_ids': [row['venue_id'] for row in rows],
+    'artist_ids': [row['artist_id'] for row in rows],
+    'starts': [row['start_time'] for row in rows],
+    'ends': [row['end_time'] for row in rows]
+  })
+  errors = {}
+  for position, kind, show_id in result:
+    if position not in errors:
+      errors[position] = '%s %s is already booked by show %d' % (kind, rows[position][kind + '_id'], show_id)
+  return errors
+
+
+def check(rows, labels=None):
+  # {position: reason} for every row that cannot be booked: against the
+  # database first, then the remaining rows against each other
+  labels = labels or ['record %d' % position for position in range(len(rows))]
+  errors = find_conflicts(rows)
+  remaining = [position for position in range(len(rows)) if position not in errors]
+  clashes = batch_conflicts([rows[position] for position in remaining], [labels[position] for position in remaining])
+  for index, reason in clashes.items():
+    errors[remaining[index]] = reason
+  return errors
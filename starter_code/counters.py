@@ -0,0 +1,106 @@
+from app import app, db
+from models import Venue, Artist, Show, ShowCounterWatermark
+import versions
+import click
+import datetime
+import time
+
+#----------------------------------------------------------------------------#
+# Show counters.
+#----------------------------------------------------------------------------#
+
+# venues and artists carry upcoming_shows_count and past_shows_count so the
+# /venues listing and search read them instead of counting shows. Triggers
+# on shows (migration f3c7a1d9b265) keep them in step with every insert,
+# update and delete, classifying shows against the watermark in
+# show_counter_watermark. `flask counters roll`, run every minute or so from
+# cron, moves shows that started since the last roll from upcoming to past
+# and advances the watermark. `flask counters rebuild` recounts everything,
+# for use after TRUNCATE or other writes that bypass the triggers.
+
+OWNERS = ((Venue, Show.venue_id), (Artist, Show.artist_id))
+
+
+def _lock_watermark():
+  # serializes against the triggers, which read the watermark FOR SHARE
+  return db.session.query(ShowCounterWatermark.rolled_at) \
+    .filter(ShowCounterWatermark.id == 1) \
+    .with_for_update() \
+    .scalar()
+
+
+def _set_watermark(now):
+  db.session.query(ShowCounterWatermark).filter(ShowCounterWatermark.id == 1) \
+    .update({'rolled_at': now}, synchronize_session=False)
+
+
+def roll(now=None):
+  # shows with start_time in (watermark, now] become past; returns how many
+  now = now or datetime.datetime.utcnow()
+  mark = _lock_watermark()
+  if mark is None or now <= mark:
+    db.session.rollback()
+    return 0
+  moved = 0
+  for model, column in OWNERS:
+    started = db.session.query(column.label('owner_id'), db.func.count().label('n')) \
+      .filter(Show.start_time > mark, Show.start_time <= now) \
+      .group_by(column) \
+      .subquery()
+    moved += db.session.execute(
+      model.__table__.update()
+        .where(model.__table__.c.id == started.c.owner_id)
+        .values(
+          upcoming_shows_count=model.__table__.c.upcoming_shows_count - started.c.n,
+          past_shows_count=model.__table__.c.past_shows_count + started.c.n
+        )
+    ).rowcount
+  _set_watermark(now)
+  if moved:
+    versions.bump(db.session, set(['venues', 'artists']))
+  db.session.commit()
+  return moved
+
+
+def rebuild(now=None):
+  # recount every venue and artist from the shows table
+  now = now or datetime.datetime.utcnow()
+  _lock_watermark()
+  for model, column in OWNERS:
+    table = model.__table__
+    counts = db.session.query(
+      model.id.label('owner_id'),
+      db.func.count(Show.id).filter(Show.start_time > now).label('upcoming'),
+      db.func.count(Show.id).filter(Show.start_time <= now).label('past')
+    ).outerjoin(Show, column == model.id) \
+      .group_by(model.id) \
+      .subquery()
+    db.session.execute(
+      table.update()
+        .where(table.c.id == counts.c.owner_id)
+        .values(upcoming_shows_count=counts.c.upcoming, past_shows_count=counts.c.past)
+    )
+  _set_watermark(now)
+  versions.bump(db.session, set(['venues', 'artists']))
+  db.session.commit()
+
+
+@app.cli.group('counters')
+def counters_group():
+  """Maintain the upcoming/past show counters."""
+
+
+@counters_group.command('roll')
+def roll_command():
+  """Move shows that have started since the last roll to past."""
+  started = time.time()
+  moved = roll()
+  click.echo('rolled %d venues and artists in %.2fs' % (moved, time.time() - started))
+
+
+@counters_group.command('rebuild')
+def rebuild_command():
+  """Recount upcoming and past shows for every venue and artist."""
+  started = time.time()
+  rebuild()
+  click.echo('rebuilt show counters in %.1fs' % (time.time() - started))
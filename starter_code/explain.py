@@ -0,0 +1,60 @@
+#----------------------------------------------------------------------------#
+# Prints the PostgreSQL plan of every hot query the pages run, so index use
+# can be compared before and after `flask db upgrade`. Statements come from
+# the same builders the routes use (models.py, search.py, facets.py).
+#
+#   python explain.py             EXPLAIN
+#   python explain.py --analyze   EXPLAIN (ANALYZE, BUFFERS)
+#----------------------------------------------------------------------------#
+
+import sys
+import datetime
+from app import app, db
+from models import Venue, Artist, Show
+import facets
+import search
+
+
+def hot_queries(now):
+  venue_id = db.session.query(db.func.min(Venue.id)).scalar() or 1
+  artist_id = db.session.query(db.func.min(Artist.id)).scalar() or 1
+  cursor = Show.encode_cursor(now, 0)
+  per_page, search_per_page = app.config['SHOWS_PER_PAGE'], app.config['SEARCH_PER_PAGE']
+  jazz = {'genres': ['Jazz'], 'match': 'all', 'city': None, 'state': None}
+  return [
+    ('/venues areas', Venue.areas_query()),
+    ('/venues/<id>', Venue.detail_query(venue_id)),
+    ('/artists/<id> shows', Artist.shows_query(artist_id)),
+    ('/shows first page', Show.keyset_query(per_page=per_page)),
+    ('/shows next page', Show.keyset_query(after=cursor, per_page=per_page)),
+    ('/shows previous page', Show.keyset_query(before=cursor, per_page=per_page)),
+    ('/venues/search', search.page_query(Venue, 'music', per_page=search_per_page)),
+    ('/venues/search by genre', search.page_query(Venue, 'jazz', per_page=search_per_page)),
+    ('/venues/search past the end', search.count_query(Venue, 'music')),
+    ('/artists/search', search.page_query(Artist, 'band', per_page=search_per_page)),
+    ('/venues?genre=Jazz', Venue.areas_query(facets.criteria(Venue, jazz))),
+    ('/venues?genre=Jazz facets', facets.facet_query(Venue, jazz)),
+    ('/artists?genre=Jazz', Artist.query.filter(*facets.criteria(Artist, jazz))),
+  ]
+
+
+def explain(query, analyze=False):
+  statement = query.statement.compile(dialect=db.engine.dialect)
+  prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN '
+  connection = db.engine.raw_connection()
+  try:
+    cursor = connection.cursor()
+    cursor.execute(prefix + str(statement), statement.params)
+    return [row[0] for row in cursor.fetchall()]
+  finally:
+    connection.close()
+
+
+if __name__ == '__main__':
+  analyze = '--analyze' in sys.argv[1:]
+  with app.app_context():
+    for name, query in hot_queries(datetime.datetime.utcnow()):
+      print('-- ' + name)
+      for line in explain(query, analyze):
+        print(line)
+      print()
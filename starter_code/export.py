@@ -0,0 +1,197 @@
+from app import app, db
+from models import Venue, Artist, Show, utc_now
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import click
+import csv
+import datetime
+import io
+import sys
+import time
+
+#----------------------------------------------------------------------------#
+# Export.
+#----------------------------------------------------------------------------#
+
+# Show calendar dumps for partners: every show joined with its artist and
+# venue in one query, read from a server-side cursor EXPORT_CHUNK rows at a
+# time and written out chunk by chunk, so memory stays flat however many
+# shows there are. `flask export shows` writes CSV or Parquet (pyarrow,
+# optional) and /api/v1/export/shows.csv streams the same CSV over HTTP.
+# --since / ?since= limits the dump to shows inserted or updated after a
+# timestamp; deleted shows are not reported.
+#
+# updated_at is stamped when a transaction flushes, which can be well before
+# it commits, so a show committed just after an export started may carry an
+# older stamp than the export. Incremental exports therefore reach back
+# EXPORT_SINCE_OVERLAP seconds before --since, and each export reports a
+# watermark, the database time it started at, to pass as the next --since:
+# every show committed since is in the next dump, with shows of the overlap
+# repeated (consumers upsert by show_id). Renaming or moving a venue or
+# artist stamps its shows too, so dumps carry the new names.
+
+COLUMNS = (
+  ('show_id', Show.id),
+  ('start_time', Show.start_time),
+  ('end_time', Show.end_time),
+  ('updated_at', Show.updated_at),
+  ('artist_id', Artist.id),
+  ('artist_name', Artist.name),
+  ('venue_id', Venue.id),
+  ('venue_name', Venue.name),
+  ('venue_city', Venue.city),
+  ('venue_state', Venue.state),
+  ('venue_timezone', Venue.timezone)
+)
+
+HEADER = [name for name, _ in COLUMNS]
+
+# venue and artist attributes a dump carries with each show
+EXPORTED = {
+  model: [column.key for _, column in COLUMNS if column.class_ is model and column.key != 'id']
+  for model in (Venue, Artist)
+}
+
+
+def watermark():
+  # the --since for the next incremental export
+  return db.session.query(utc_now()).scalar()
+
+
+def shows_query(since=None):
+  query = db.session.query(*[column.label(name) for name, column in COLUMNS]) \
+    .join(Artist, Show.artist_id == Artist.id) \
+    .join(Venue, Show.venue_id == Venue.id)
+  if since is not None:
+    since -= datetime.timedelta(seconds=app.config['EXPORT_SINCE_OVERLAP'])
+    # ix_shows_updated_at_id serves the range and the order
+    query = query.filter(Show.updated_at > since).order_by(Show.updated_at, Show.id)
+  else:
+    query = query.order_by(Show.id)
+  return query.execution_options(stream_results=True)
+
+
+@event.listens_for(Session, 'after_flush')
+def stamp_related_shows(session, flush_context):
+  # shows of venues and artists whose exported attributes changed, in one
+  # statement
+  ids = {Venue: [], Artist: []}
+  for target in session.dirty:
+    for model, names in EXPORTED.items():
+      if isinstance(target, model):
+        state = db.inspect(target)
+        if any(state.attrs[name].history.has_changes() for name in names):
+          ids[model].append(target.id)
+  if not ids[Venue] and not ids[Artist]:
+    return
+  shows = Show.__table__
+  session.connection().execute(
+    shows.update()
+    .where(db.or_(shows.c.venue_id.in_(ids[Venue]), shows.c.artist_id.in_(ids[Artist])))
+    .values(updated_at=utc_now())
+  )
+
+
+def chunks(query, size):
+  # lists of at most size rows, fetched size rows per round trip
+  chunk = []
+  for row in query.yield_per(size):
+    chunk.append(row)
+    if len(chunk) == size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+def csv_chunks(query, size):
+  # the CSV text of each chunk, header first
+  buffer = io.StringIO()
+  writer = csv.writer(buffer)
+  writer.writerow(HEADER)
+  for chunk in chunks(query, size):
+    writer.writerows(chunk)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+  if buffer.tell():
+    yield buffer.getvalue()
+
+
+def write_csv(query, out, size):
+  rows = 0
+  writer = csv.writer(out)
+  writer.writerow(HEADER)
+  for chunk in chunks(query, size):
+    writer.writerows(chunk)
+    rows += len(chunk)
+  return rows
+
+
+def write_parquet(query, path, size):
+  # one row group per chunk through a single ParquetWriter
+  try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+  except ImportError:
+    raise click.UsageError('Parquet export needs pyarrow: pip install pyarrow')
+  schema = pa.schema([
+    ('show_id', pa.int64()),
+    ('start_time', pa.timestamp('us')),
+    ('end_time', pa.timestamp('us')),
+    ('updated_at', pa.timestamp('us')),
+    ('artist_id', pa.int64()),
+    ('artist_name', pa.string()),
+    ('venue_id', pa.int64()),
+    ('venue_name', pa.string()),
+    ('venue_city', pa.string()),
+    ('venue_state', pa.string()),
+    ('venue_timezone', pa.string())
+  ])
+  rows = 0
+  with pq.ParquetWriter(path, schema, compression='snappy') as writer:
+    for chunk in chunks(query, size):
+      columns = list(zip(*chunk))
+      writer.write_table(pa.Table.from_arrays(
+        [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+        schema=schema
+      ))
+      rows += len(chunk)
+  return rows
+
+
+@app.cli.group('export')
+def export_group():
+  """Export data for partners."""
+
+
+@export_group.command('shows')
+@click.option('--output', '-o', 'path', default='-', show_default=True, help='File to write, - for stdout.')
+@click.option('--format', type=click.Choice(['csv', 'parquet']), help='Defaults to the file extension, csv for stdout.')
+@click.option('--since', help='Only shows inserted or updated after this UTC time (ISO 8601).')
+@click.option('--chunk-size', default=None, type=int, help='Rows per fetch and per Parquet row group. Defaults to EXPORT_CHUNK.')
+def export_shows_command(path, format, since, chunk_size):
+  """Dump every show with its artist and venue as CSV or Parquet."""
+  format = format or ('parquet' if path.lower().endswith('.parquet') else 'csv')
+  chunk_size = chunk_size or app.config['EXPORT_CHUNK']
+  if format == 'parquet' and path == '-':
+    raise click.UsageError('Parquet export needs --output PATH')
+  try:
+    since = Show.parse_start_time(since) if since else None
+  except ValueError:
+    raise click.BadParameter(since, param_hint='--since')
+
+  started = time.time()
+  next_since = watermark()
+  query = shows_query(since)
+  if format == 'parquet':
+    rows = write_parquet(query, path, chunk_size)
+  elif path == '-':
+    rows = write_csv(query, sys.stdout, chunk_size)
+  else:
+    with open(path, 'w', newline='') as out:
+      rows = write_csv(query, out, chunk_size)
+  elapsed = time.time() - started
+  click.echo('exported %d shows in %.1fs (%.0f rows/s)' % (
+    rows, elapsed, rows / elapsed if elapsed else 0), err=True)
+  click.echo('next --since %s' % next_since.isoformat(), err=True)
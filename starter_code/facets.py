@@ -0,0 +1,135 @@
+from app import app, db
+from models import Venue, Artist
+from forms import genres
+from flask import abort
+import cache
+
+#----------------------------------------------------------------------------#
+# Facets.
+#----------------------------------------------------------------------------#
+
+# Genre browsing for /venues and /artists. ?genre= (repeatable) filters with
+# array containment (genres @> ARRAY[...], every genre) or, with match=any,
+# overlap (genres && ARRAY[...], any genre); both are served by the genres
+# GIN indexes and combine with ?city= and ?state=. Facet counts per genre
+# and per state, plus the total, come from one aggregate query that unnests
+# the genres and groups by GROUPING SETS ((genre), (state), ()). Facet
+# results are cached for FACET_CACHE_TTL seconds per filter combination and
+# not invalidated on writes; counts may lag by that long.
+
+GENRES = {genre.lower(): genre for genre, _ in genres}
+
+facet_cache = cache.LRUCache(app.config['FACET_CACHE_MAXSIZE'], app.config['FACET_CACHE_TTL'])
+
+
+def filters_from(args):
+  # normalized filters from request arguments; unknown genres are a 400
+  try:
+    selected = sorted(set(GENRES[genre.lower()] for genre in args.getlist('genre') if genre))
+  except KeyError:
+    abort(400)
+  return {
+    'genres': selected,
+    'match': 'any' if args.get('match') == 'any' else 'all',
+    'city': args.get('city') or None,
+    'state': args.get('state').upper() if args.get('state') else None
+  }
+
+
+def criteria(model, filters):
+  conditions = []
+  if filters['genres']:
+    if filters['match'] == 'any':
+      conditions.append(model.genres.overlap(filters['genres']))
+    else:
+      conditions.append(model.genres.contains(filters['genres']))
+  if filters['city']:
+    conditions.append(model.city == filters['city'])
+  if filters['state']:
+    conditions.append(model.state == filters['state'])
+  return conditions
+
+
+def facet_query(model, filters):
+  # array_append(genres, NULL) keeps rows without genres in the state and
+  # total groups; unnest repeats a row per genre, hence count(DISTINCT id)
+  rows = db.session.query(
+    model.id.label('id'),
+    model.state.label('state'),
+    db.func.unnest(db.func.array_append(model.genres, db.null())).label('genre')
+  ).filter(*criteria(model, filters)).subquery()
+  return db.session.query(
+    db.func.grouping(rows.c.genre).label('no_genre'),
+    db.func.grouping(rows.c.state).label('no_state'),
+    rows.c.genre,
+    rows.c.state,
+    db.func.count(db.distinct(rows.c.id)).label('count')
+  ).group_by(db.func.grouping_sets(rows.c.genre, rows.c.state, db.text('()')))
+
+
+def cache_key(model, filters):
+  return '%s:%s:%s:%s:%s' % (model.__tablename__, ','.join(filters['genres']), filters['match'],
+                             filters['city'] or '', filters['state'] or '')
+
+
+def tally(rows):
+  # facet_query rows -> {'total', 'genres': {genre: count}, 'states': {state: count}}
+  data = {'total': 0, 'genres': {}, 'states': {}}
+  for row in rows:
+    if row.no_genre and row.no_state:
+      data['total'] = row.count
+    elif not row.no_genre and row.genre is not None:
+      data['genres'][row.genre] = row.count
+    elif not row.no_state and row.state is not None:
+      data['states'][row.state] = row.count
+  return data
+
+
+def counts(model, filters):
+  key = cache_key(model, filters)
+  data = facet_cache.get(key)
+  if data is None:
+    data = tally(facet_query(model, filters))
+    facet_cache.set(key, data)
+  return data
+
+
+def _args(filters, **changes):
+  # url_for arguments for the filters with some of them changed
+  values = dict(filters, **changes)
+  args = {}
+  if values['genres']:
+    args['genre'] = values['genres']
+    if values['match'] == 'any':
+      args['match'] = 'any'
+  if values['city']:
+    args['city'] = values['city']
+  if values['state']:
+    args['state'] = values['state']
+  return args
+
+
+def facets(model, filters, data=None):
+  # facet counts and toggle links for templates/pages/facets.html; data
+  # is counts() when the caller already has it
+  if data is None:
+    data = counts(model, filters)
+  selected = set(filters['genres'])
+  genre_links = []
+  for genre, count in sorted(data['genres'].items(), key=lambda item: (-item[1], item[0])):
+    toggled = sorted(selected ^ set([genre]))
+    genre_links.append({'name': genre, 'count': count, 'active': genre in selected, 'args': _args(filters, genres=toggled)})
+  state_links = [{
+    'name': state,
+    'count': count,
+    'active': state == filters['state'],
+    'args': _args(filters, state=None if state == filters['state'] else state)
+  } for state, count in sorted(data['states'].items(), key=lambda item: (-item[1], item[0]))]
+  return {
+    'total': data['total'],
+    'genres': genre_links,
+    'states': state_links,
+    'match': filters['match'],
+    'match_args': _args(filters, match='all' if filters['match'] == 'any' else 'any'),
+    'filtered': any((filters['genres'], filters['city'], filters['state']))
+  }
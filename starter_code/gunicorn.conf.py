@@ -0,0 +1,9 @@
+#----------------------------------------------------------------------------#
+# Gunicorn settings, read from the working directory by `gunicorn app:app`.
+#----------------------------------------------------------------------------#
+
+# every worker builds its in-memory indexes once the app is loaded, before
+# accepting requests; after the fork, so each has its own refresh threads
+def post_worker_init(worker):
+  from app import start_worker
+  start_worker()
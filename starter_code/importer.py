@@ -0,0 +1,323 @@
+from app import app, db
+from models import Venue, Artist, Show
+from sqlalchemy import exc
+import cache
+import conflicts
+import resolver
+import versions
+import babel.dates
+import click
+import csv
+import json
+import time
+
+#----------------------------------------------------------------------------#
+# Import.
+#----------------------------------------------------------------------------#
+
+# `flask import venues|artists|shows FILE` streams a JSON-lines or CSV file
+# into the database in batches through bulk_insert_mappings. Show rows name
+# their artist and venue by id or by name; names are resolved through maps
+# built once per run, and ids are checked against the ids loaded with them.
+# Rows that fail validation are written to a reject file with the reason
+# instead of aborting the import; so are rows the database refuses (a venue
+# deleted since the maps were built, a booking that raced the conflict
+# check), with the database's error, after their batch is retried one row
+# at a time.
+
+def _bool(value):
+  if isinstance(value, str):
+    return value.strip().lower() in ('1', 'true', 'yes', 'y', 't')
+  return bool(value)
+
+
+def _list(value):
+  # CSV cells hold genres as "Jazz,Swing"; JSON records hold a list
+  if value is None or value == '':
+    return []
+  if isinstance(value, str):
+    return [item.strip() for item in value.split(',') if item.strip()]
+  return list(value)
+
+
+def _get(record, key, default=None):
+  value = record.get(key)
+  return default if value is None or value == '' else value
+
+
+def _require(record, *keys):
+  missing = [key for key in keys if not record.get(key)]
+  if missing:
+    raise ValueError('missing ' + ', '.join(missing))
+
+
+def _timezone(name):
+  if name is not None:
+    try:
+      babel.dates.get_timezone(name)
+    except LookupError:
+      raise ValueError('unknown timezone %r' % name)
+  return name
+
+
+def venue_mapping(record):
+  _require(record, 'name', 'city', 'state')
+  return {
+    'name': record['name'],
+    'city': record['city'],
+    'state': record['state'],
+    'address': _get(record, 'address'),
+    'phone': _get(record, 'phone'),
+    'genres': _list(record.get('genres')),
+    'image_link': _get(record, 'image_link'),
+    'facebook_link': _get(record, 'facebook_link', "https://facebook.com"),
+    'website': _get(record, 'website', "https://pydata.co"),
+    'seeking_talent': _bool(_get(record, 'seeking_talent', False)),
+    'seeking_description': _get(record, 'seeking_description'),
+    'timezone': _timezone(_get(record, 'timezone'))
+  }
+
+
+def artist_mapping(record):
+  _require(record, 'name', 'city', 'state')
+  return {
+    'name': record['name'],
+    'city': record['city'],
+    'state': record['state'],
+    'phone': _get(record, 'phone'),
+    'genres': _list(record.get('genres')),
+    'image_link': _get(record, 'image_link'),
+    'website': _get(record, 'website'),
+    'facebook_link': _get(record, 'facebook_link'),
+    'seeking_venue': _bool(_get(record, 'seeking_venue', False)),
+    'seeking_description': _get(record, 'seeking_description')
+  }
+
+
+def name_map(model, only=None):
+  # name -> id, with None marking names shared by several rows; `only`
+  # restricts the map to the given names
+  query = db.session.query(model.id, model.name)
+  if only is not None:
+    query = query.filter(model.name.in_(list(only)))
+  names = {}
+  for entity_id, name in query.yield_per(10000):
+    names[name] = None if name in names else entity_id
+  return names
+
+
+def id_set(model):
+  return set(entity_id for entity_id, in db.session.query(model.id).yield_per(10000))
+
+
+def _resolve(record, kind, names, ids):
+  entity_id = _get(record, kind + '_id')
+  if entity_id is not None:
+    try:
+      entity_id = int(entity_id)
+    except (TypeError, ValueError):
+      raise ValueError('invalid %s_id %r' % (kind, entity_id))
+    if entity_id not in ids:
+      raise ValueError('unknown %s_id %d' % (kind, entity_id))
+    return entity_id
+  name = _get(record, kind + '_name')
+  if name is None:
+    raise ValueError('missing %s_id or %s_name' % (kind, kind))
+  if name not in names:
+    raise ValueError('unknown %s %r' % (kind, name))
+  if names[name] is None:
+    raise ValueError('ambiguous %s %r' % (kind, name))
+  return names[name]
+
+
+def _booking(record):
+  # start_time and end_time (default: Show.DEFAULT_DURATION later)
+  start_time = Show.parse_start_time(record['start_time'])
+  return start_time, Show.parse_end_time(_get(record, 'end_time'), start_time)
+
+
+def show_mapping(record, artists, venues):
+  # artists and venues: (name_map, id_set) pairs
+  _require(record, 'start_time')
+  start_time, end_time = _booking(record)
+  return {
+    'artist_id': _resolve(record, 'artist', *artists),
+    'venue_id': _resolve(record, 'venue', *venues),
+    'start_time': start_time,
+    'end_time': end_time
+  }
+
+
+def show_mapping_for(records):
+  # show mapping for API batches: ids and names resolved through the
+  # resolver cache, uncached ones in one query per kind for the whole batch
+  resolve = resolver.batch(records)
+  def mapping(record):
+    _require(record, 'start_time')
+    start_time, end_time = _booking(record)
+    return {
+      'artist_id': resolve(record, 'artist'),
+      'venue_id': resolve(record, 'venue'),
+      'start_time': start_time,
+      'end_time': end_time
+    }
+  return mapping
+
+
+# the next `count` ids of a table's serial, numbered 1..count
+ALLOCATE_IDS_SQL = db.text(
+  "SELECT ordinal, nextval(pg_get_serial_sequence(:table, 'id')) FROM generate_series(1, :count) AS ordinal")
+
+
+def _insert(table, rows):
+  # multi-row INSERT with ids drawn from the table's sequence first and
+  # assigned to rows by ordinal, rather than read back from RETURNING,
+  # whose row order PostgreSQL does not guarantee
+  ids = dict(db.session.execute(ALLOCATE_IDS_SQL, {'table': table.name, 'count': len(rows)}).fetchall())
+  for ordinal, row in enumerate(rows, 1):
+    row['id'] = ids[ordinal]
+  db.session.execute(table.insert().values(rows))
+
+
+def insert_records(model, records, mapping, chunk_size=1000):
+  # Validates records and inserts the valid ones in one transaction with
+  # multi-row INSERTs. Returns the inserted mappings, each with its new
+  # 'id', and an error entry per rejected record. Shows that would
+  # double-book a venue or an artist are rejected too, and when the
+  # database refuses a chunk (an id deleted since it was resolved, a
+  # booking racing the conflict check) the rows are retried one at a time
+  # and the failing ones reported with the database's error.
+  rows, positions, errors = [], [], []
+  for position, record in enumerate(records):
+    try:
+      if not isinstance(record, dict):
+        raise ValueError('expected an object')
+      rows.append(mapping(record))
+      positions.append(position)
+    except (ValueError, TypeError, KeyError) as error:
+      errors.append({'index': position, 'error': str(error)})
+
+  if model is Show:
+    clashes = conflicts.check(rows, ['record %d' % position for position in positions])
+    errors.extend({'index': positions[index], 'error': reason} for index, reason in clashes.items())
+    rows = [row for index, row in enumerate(rows) if index not in clashes]
+    positions = [position for index, position in enumerate(positions) if index not in clashes]
+
+  table = model.__table__
+  try:
+    for start in range(0, len(rows), chunk_size):
+      _insert(table, rows[start:start + chunk_size])
+  except exc.SQLAlchemyError:
+    db.session.rollback()
+    rows, failed = insert_each(rows, lambda row: _insert(table, [row]))
+    errors.extend({'index': positions[index], 'error': reason} for index, reason in failed.items())
+  errors.sort(key=lambda error: error['index'])
+  versions.bump_rows(model, rows)
+  db.session.commit()
+  return rows, errors
+
+
+def database_error(error):
+  # the database's message for a failed statement, on one line
+  return ' '.join(str(getattr(error, 'orig', None) or error).split())
+
+
+def insert_each(rows, insert):
+  # insert(row) for each row in its own savepoint, for a batch the database
+  # refused as a whole; returns the rows inserted and {index: error} for
+  # the others
+  inserted, failed = [], {}
+  for index, row in enumerate(rows):
+    savepoint = db.session.begin_nested()
+    try:
+      insert(row)
+      savepoint.commit()
+      inserted.append(row)
+    except exc.SQLAlchemyError as error:
+      savepoint.rollback()
+      failed[index] = database_error(error)
+  return inserted, failed
+
+
+def read_records(path, format):
+  with open(path, newline='') as source:
+    if format == 'csv':
+      for record in csv.DictReader(source):
+        yield record
+    else:
+      for line in source:
+        if line.strip():
+          yield json.loads(line)
+
+
+@app.cli.command('import')
+@click.argument('kind', type=click.Choice(['venues', 'artists', 'shows']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', type=click.Choice(['jsonl', 'csv']), help='Defaults to the file extension.')
+@click.option('--batch-size', default=5000, show_default=True)
+@click.option('--rejects', type=click.Path(dir_okay=False), help='Defaults to PATH.rejects.jsonl.')
+def import_command(kind, path, format, batch_size, rejects):
+  """Bulk import venues, artists or shows from a JSON-lines or CSV file."""
+  format = format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+  rejects = rejects or path + '.rejects.jsonl'
+
+  if kind == 'shows':
+    artists, venues = (name_map(Artist), id_set(Artist)), (name_map(Venue), id_set(Venue))
+    model, mapping = Show, lambda record: show_mapping(record, artists, venues)
+  elif kind == 'venues':
+    model, mapping = Venue, venue_mapping
+  else:
+    model, mapping = Artist, artist_mapping
+
+  started = time.time()
+  inserted = rejected = 0
+  batch, sources = [], []
+
+  def reject(line_number, error, record):
+    nonlocal rejected
+    rejected += 1
+    reject_file.write(json.dumps({'line': line_number, 'error': error, 'record': record}, default=str) + '\n')
+
+  def flush():
+    # shows clashing with booked shows, or with each other, are rejected;
+    # a batch the database refuses is retried row by row and the failing
+    # rows rejected; returns the number of rows inserted
+    entries = list(zip(batch, sources))
+    if model is Show:
+      clashes = conflicts.check(batch, ['line %d' % line_number for line_number, _ in sources])
+      for index in sorted(clashes):
+        reject(sources[index][0], clashes[index], sources[index][1])
+      entries = [entry for index, entry in enumerate(entries) if index not in clashes]
+    rows = [row for row, _ in entries]
+    try:
+      db.session.bulk_insert_mappings(model, rows)
+    except exc.SQLAlchemyError:
+      db.session.rollback()
+      rows, failed = insert_each(rows, lambda row: db.session.bulk_insert_mappings(model, [row]))
+      for index in sorted(failed):
+        line_number, record = entries[index][1]
+        reject(line_number, failed[index], record)
+    versions.bump_rows(model, rows)
+    db.session.commit()
+    cache.invalidate_rows(model, rows)
+    resolver.invalidate_rows(model, rows)
+    del batch[:], sources[:]
+    return len(rows)
+
+  with open(rejects, 'w') as reject_file:
+    for line_number, record in enumerate(read_records(path, format), 1):
+      try:
+        batch.append(mapping(record))
+        sources.append((line_number, record))
+      except (ValueError, TypeError, KeyError) as error:
+        reject(line_number, str(error), record)
+        continue
+      if len(batch) >= batch_size:
+        inserted += flush()
+        click.echo('%d rows, %.0f rows/s' % (inserted, inserted / (time.time() - started)))
+    if batch:
+      inserted += flush()
+
+  elapsed = time.time() - started
+  click.echo('imported %d %s in %.1fs (%.0f rows/s), %d rejected -> %s' % (
+    inserted, kind, elapsed, inserted / elapsed if elapsed else 0, rejected, rejects))
@@ -0,0 +1,146 @@
+from app import app
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import click
+import collections
+import json
+import logging
+import math
+import time
+
+#----------------------------------------------------------------------------#
+# Instrumentation.
+#----------------------------------------------------------------------------#
+
+# Per-request query count, database time and template render time, gathered
+# from cursor execution events and Flask's template signals. Every response
+# gets a Server-Timing header; requests slower than SLOW_REQUEST_MS are
+# written as JSON lines to PERF_LOG together with their most repeated SQL
+# statements, which is where N+1 loops show up. `flask perf-report`
+# summarizes that log per endpoint.
+
+perf_logger = logging.getLogger('fyyur.perf')
+perf_logger.propagate = False
+if app.config['PERF_LOG']:
+  perf_handler = logging.FileHandler(app.config['PERF_LOG'])
+  perf_handler.setFormatter(logging.Formatter('%(message)s'))
+  perf_logger.addHandler(perf_handler)
+  perf_logger.setLevel(logging.INFO)
+
+
+def _perf():
+  return g.get('perf') if has_request_context() else None
+
+
+@app.before_request
+def start_timer():
+  g.perf = {
+    'started': time.perf_counter(),
+    'queries': 0,
+    'db': 0.0,
+    'render': 0.0,
+    'statements': collections.Counter()
+  }
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  elapsed = time.perf_counter() - conn.info['query_started'].pop()
+  perf = _perf()
+  if perf is not None:
+    perf['queries'] += 1
+    perf['db'] += elapsed
+    perf['statements'][statement] += 1
+
+
+def _before_render(sender, template, context, **extra):
+  perf = _perf()
+  if perf is not None:
+    perf['render_started'] = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+  perf = _perf()
+  if perf is not None and 'render_started' in perf:
+    perf['render'] += time.perf_counter() - perf.pop('render_started')
+
+
+before_render_template.connect(_before_render, app)
+template_rendered.connect(_rendered, app)
+
+
+@app.after_request
+def record_timing(response):
+  perf = _perf()
+  if perf is None:
+    return response
+  total = (time.perf_counter() - perf['started']) * 1000
+  db_ms, render_ms = perf['db'] * 1000, perf['render'] * 1000
+  if app.config['SERVER_TIMING']:
+    response.headers.add('Server-Timing', 'db;dur=%.2f;desc="%d queries", render;dur=%.2f, total;dur=%.2f' % (
+      db_ms, perf['queries'], render_ms, total))
+  if total >= app.config['SLOW_REQUEST_MS']:
+    perf_logger.info(json.dumps({
+      'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+      'method': request.method,
+      'path': request.full_path.rstrip('?'),
+      'endpoint': request.endpoint,
+      'status': response.status_code,
+      'total_ms': round(total, 2),
+      'db_ms': round(db_ms, 2),
+      'render_ms': round(render_ms, 2),
+      'queries': perf['queries'],
+      'repeated': [
+        {'statement': statement, 'count': count}
+        for statement, count in perf['statements'].most_common(5) if count > 1
+      ]
+    }))
+  return response
+
+
+#----------------------------------------------------------------------------#
+# Report.
+#----------------------------------------------------------------------------#
+
+def _percentile(values, pct):
+  ordered = sorted(values)
+  return ordered[max(int(math.ceil(pct / 100.0 * len(ordered))) - 1, 0)] if ordered else 0.0
+
+
+@app.cli.command('perf-report')
+@click.option('--log', 'path', type=click.Path(exists=True, dir_okay=False), help='Defaults to PERF_LOG.')
+@click.option('--top', default=5, show_default=True, help='Repeated statements to list.')
+def perf_report(path, top):
+  """Summarize slow requests recorded in the performance log."""
+  routes = collections.defaultdict(list)
+  repeated = collections.Counter()
+  with open(path or app.config['PERF_LOG']) as log:
+    for line in log:
+      if not line.strip():
+        continue
+      entry = json.loads(line)
+      routes[(entry['method'], entry['endpoint'])].append(entry)
+      for item in entry['repeated']:
+        repeated[(entry['endpoint'], item['statement'])] += item['count']
+
+  click.echo('%-8s %-28s %6s %10s %10s %9s %9s %9s' % (
+    'method', 'endpoint', 'slow', 'p50 ms', 'p95 ms', 'queries', 'db ms', 'render'))
+  for (method, endpoint), entries in sorted(routes.items(), key=lambda item: -len(item[1])):
+    totals = [entry['total_ms'] for entry in entries]
+    click.echo('%-8s %-28s %6d %10.1f %10.1f %9.1f %9.1f %9.1f' % (
+      method, endpoint, len(entries),
+      _percentile(totals, 50), _percentile(totals, 95),
+      sum(entry['queries'] for entry in entries) / float(len(entries)),
+      sum(entry['db_ms'] for entry in entries) / float(len(entries)),
+      sum(entry['render_ms'] for entry in entries) / float(len(entries))))
+
+  if repeated:
+    click.echo('\nMost repeated statements (possible N+1):')
+    for (endpoint, statement), count in repeated.most_common(top):
+      click.echo('%8d  %s  %s' % (count, endpoint, ' '.join(statement.split())[:160]))
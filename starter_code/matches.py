@@ -0,0 +1,352 @@
+from app import app, db
+from models import Venue, Artist, Show
+from forms import genres
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import datetime
+import numpy
+import threading
+import time
+
+#----------------------------------------------------------------------------#
+# Matches.
+#----------------------------------------------------------------------------#
+
+# Venue <-> artist matchmaking for /venues/<id>/matches and
+# /artists/<id>/matches. Each side is held in memory as parallel NumPy
+# arrays: ids, a uint32 genre bitset, interned city and state codes and the
+# seeking_talent / seeking_venue flag. Ranking one entity against every
+# counterpart is a handful of vectorized operations over those arrays plus
+# one indexed query for the entity's past shows, then argpartition for the
+# top k. Only counterparts that are seeking are ranked. The score is
+#
+#   GENRE_WEIGHT * shared genres + CITY_WEIGHT * same city
+#     + STATE_WEIGHT * same state + HISTORY_WEIGHT * log(1 + past shows together)
+#
+# Like the suggest index, each serving process builds the arrays at startup
+# (app.start_worker) and rebuilds them every MATCH_INDEX_TTL seconds on a
+# background thread, to pick up writes made by other processes; a rebuild
+# fills new arrays and swaps them in, so rankings never wait on the
+# database. Writes made through the session are queued at flush and applied
+# in place when their transaction commits.
+
+GENRE_WEIGHT = 1.0
+CITY_WEIGHT = 1.5
+STATE_WEIGHT = 0.5
+HISTORY_WEIGHT = 1.0
+
+GENRES = [genre for genre, _ in genres]
+GENRE_BITS = dict((genre, 1 << position) for position, genre in enumerate(GENRES))
+assert len(GENRES) <= 32, 'genre bitsets are uint32'
+
+# set bits per 16-bit half of a bitset
+POPCOUNT16 = sum((numpy.arange(1 << 16) >> bit) & 1 for bit in range(16)).astype(numpy.uint8)
+
+
+def genre_bits(values):
+  bits = 0
+  for genre in values or ():
+    bits |= GENRE_BITS.get(genre, 0)
+  return bits
+
+
+def bits_genres(bits):
+  return [genre for genre in GENRES if bits & GENRE_BITS[genre]]
+
+
+def popcount(bitsets):
+  return POPCOUNT16[bitsets & 0xFFFF] + POPCOUNT16[bitsets >> 16]
+
+
+def _city_key(city, state):
+  # cities are only the same within a state
+  return '%s|%s' % (city, state) if city else None
+
+
+class MatchIndex(object):
+
+  # attributes a load replaces together
+  STATE = ('_size', '_positions', '_codes', 'ids', 'bits', 'cities', 'states', 'seeking', 'names', 'places')
+
+  def __init__(self, capacity=1024):
+    self._lock = threading.Lock()
+    self._reload_lock = threading.Lock()
+    self._replay = None
+    self._allocate(capacity)
+    self.loaded = False
+    self.loaded_at = 0
+
+  def _allocate(self, capacity):
+    self._size = 0
+    self._positions = {}
+    self._codes = {}
+    self.ids = numpy.zeros(capacity, dtype=numpy.int64)
+    self.bits = numpy.zeros(capacity, dtype=numpy.uint32)
+    self.cities = numpy.zeros(capacity, dtype=numpy.int32)
+    self.states = numpy.zeros(capacity, dtype=numpy.int32)
+    self.seeking = numpy.zeros(capacity, dtype=bool)
+    self.names = [None] * capacity
+    self.places = [None] * capacity
+
+  def _grow(self):
+    capacity = len(self.ids) * 2
+    for name in ('ids', 'bits', 'cities', 'states', 'seeking'):
+      array = getattr(self, name)
+      grown = numpy.zeros(capacity, dtype=array.dtype)
+      grown[:len(array)] = array
+      setattr(self, name, grown)
+    self.names.extend([None] * (capacity - len(self.names)))
+    self.places.extend([None] * (capacity - len(self.places)))
+
+  def _code(self, value):
+    # small integer per distinct city / state, 0 when unknown
+    if not value:
+      return 0
+    return self._codes.setdefault(value.strip().lower(), len(self._codes) + 1)
+
+  def _known_code(self, value):
+    # code of a value from the other side; -1 (matching nothing) if unseen
+    if not value:
+      return -1
+    return self._codes.get(value.strip().lower(), -1)
+
+  def _set(self, position, entity_id, name, genres, city, state, seeking):
+    self.ids[position] = entity_id
+    self.names[position] = name
+    self.places[position] = (city, state)
+    self.bits[position] = genre_bits(genres)
+    self.cities[position] = self._code(_city_key(city, state))
+    self.states[position] = self._code(state)
+    self.seeking[position] = bool(seeking)
+
+  def load(self, entries):
+    # entries: iterable of (id, name, genres, city, state, seeking); the new
+    # arrays are filled without the lock and swapped in under it
+    entries = list(entries)
+    fresh = MatchIndex(max(1024, len(entries) * 5 // 4))
+    for entry in entries:
+      fresh._upsert(*entry)
+    with self._lock:
+      for name in self.STATE:
+        setattr(self, name, getattr(fresh, name))
+      for change in self._replay or ():
+        self._apply(*change)
+      self.loaded = True
+      self.loaded_at = time.time()
+
+  def reload(self, read):
+    # load(read()), one reload at a time; writes applied while read() runs
+    # are replayed over its entries, which may predate their commit
+    with self._reload_lock:
+      with self._lock:
+        self._replay = []
+      try:
+        self.load(read())
+      finally:
+        with self._lock:
+          self._replay = None
+
+  def upsert(self, entity_id, name, genres, city, state, seeking):
+    self._change(entity_id, (name, genres, city, state, seeking))
+
+  def remove(self, entity_id):
+    # the slot stays, out of the ranking, until the next load
+    self._change(entity_id, None)
+
+  def _change(self, entity_id, entry):
+    with self._lock:
+      self._apply(entity_id, entry)
+      if self._replay is not None:
+        self._replay.append((entity_id, entry))
+
+  def _apply(self, entity_id, entry):
+    # entry: (name, genres, city, state, seeking), None to remove
+    if entry is not None:
+      self._upsert(entity_id, *entry)
+      return
+    position = self._positions.pop(entity_id, None)
+    if position is not None:
+      self.seeking[position] = False
+
+  def _upsert(self, entity_id, name, genres, city, state, seeking):
+    position = self._positions.get(entity_id)
+    if position is None:
+      if self._size == len(self.ids):
+        self._grow()
+      position = self._positions[entity_id] = self._size
+      self._size += 1
+    self._set(position, entity_id, name, genres, city, state, seeking)
+
+  def get(self, entity_id):
+    with self._lock:
+      position = self._positions.get(entity_id)
+      if position is None:
+        return None
+      city, state = self.places[position]
+      return {'bits': int(self.bits[position]), 'city': city, 'state': state}
+
+  def top(self, entity, history=None, limit=10):
+    # best `limit` seeking rows for an entity {'bits', 'city', 'state'} of
+    # the other side; history maps row ids to past shows together
+    with self._lock:
+      source = {
+        'bits': entity['bits'],
+        'city': self._known_code(_city_key(entity['city'], entity['state'])),
+        'state': self._known_code(entity['state'])
+      }
+      size = self._size
+      bits = self.bits[:size]
+      shared = popcount(bits & numpy.uint32(source['bits']))
+      scores = GENRE_WEIGHT * shared.astype(numpy.float32)
+      if source['city'] > 0:
+        scores += CITY_WEIGHT * (self.cities[:size] == source['city'])
+      if source['state'] > 0:
+        scores += STATE_WEIGHT * (self.states[:size] == source['state'])
+      together = numpy.zeros(size, dtype=numpy.int64)
+      if history:
+        known = [(self._positions[entity_id], count) for entity_id, count in history.items() if entity_id in self._positions]
+        if known:
+          positions, counts = zip(*known)
+          together[list(positions)] = counts
+          scores += HISTORY_WEIGHT * numpy.log1p(together).astype(numpy.float32)
+      scores[~self.seeking[:size] | (scores <= 0)] = -numpy.inf
+
+      candidates = numpy.flatnonzero(scores > -numpy.inf)
+      if len(candidates) > limit:
+        # everything above the limit-th best score, then the lowest ids
+        # among the rows tied with it
+        kth = -numpy.partition(-scores[candidates], limit - 1)[limit - 1]
+        above = candidates[scores[candidates] > kth]
+        tied = candidates[scores[candidates] == kth]
+        needed = limit - len(above)
+        if len(tied) > needed:
+          tied = tied[numpy.argpartition(self.ids[tied], needed - 1)[:needed]]
+        candidates = numpy.concatenate([above, tied])
+      # highest score first, ties by id
+      candidates = candidates[numpy.lexsort((self.ids[candidates], -scores[candidates]))]
+      return [{
+        'id': int(self.ids[position]),
+        'name': self.names[position],
+        'score': round(float(scores[position]), 3),
+        'shared_genres': bits_genres(int(bits[position] & source['bits'])),
+        'past_shows_together': int(together[position])
+      } for position in candidates]
+
+  def __len__(self):
+    return len(self._positions)
+
+
+venue_index = MatchIndex()
+artist_index = MatchIndex()
+# (model, index, seeking flag) per side
+SIDES = ((Venue, venue_index, 'seeking_talent'), (Artist, artist_index, 'seeking_venue'))
+
+
+def _entries(model, seeking):
+  def read():
+    return db.session.query(
+      model.id, model.name, model.genres, model.city, model.state, getattr(model, seeking)).yield_per(10000)
+  return read
+
+
+def load_indexes():
+  for model, index, seeking in SIDES:
+    index.reload(_entries(model, seeking))
+
+
+def _refresh(interval, delay):
+  # rebuilds every interval seconds, after the first delay, for the life of
+  # the process
+  time.sleep(delay)
+  while True:
+    try:
+      with app.app_context():
+        load_indexes()
+    except Exception:
+      app.logger.exception('match index refresh failed')
+    time.sleep(interval)
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start(load=True):
+  # once per serving process, like suggest.start
+  global _refresher
+  with _refresher_lock:
+    if _refresher is not None:
+      return
+    if load:
+      load_indexes()
+    interval = app.config['MATCH_INDEX_TTL']
+    _refresher = threading.Thread(target=_refresh, args=(interval, interval if load else 0), name='match-index', daemon=True)
+    _refresher.start()
+
+
+def _history(column, other, entity_id):
+  # counterpart id -> past shows together, from the (owner, start_time) index
+  rows = db.session.query(other, db.func.count()) \
+    .filter(column == entity_id, Show.start_time <= datetime.datetime.utcnow()) \
+    .group_by(other)
+  return dict(rows)
+
+
+def _matches(own, other, model, entity_id, column, other_column, limit):
+  if _refresher is None:
+    start(load=False)
+  entity = own.get(entity_id)
+  if entity is None:
+    # written by another process since the last load
+    row = model.query.get(entity_id)
+    if row is None:
+      return None
+    entity = {'bits': genre_bits(row.genres), 'city': row.city, 'state': row.state}
+  return other.top(entity, _history(column, other_column, entity_id), limit)
+
+
+def venue_matches(venue_id, limit=10):
+  # seeking artists for a venue, best first; None for an unknown venue
+  return _matches(venue_index, artist_index, Venue, venue_id, Show.venue_id, Show.artist_id, limit)
+
+
+def artist_matches(artist_id, limit=10):
+  # seeking venues for an artist, best first; None for an unknown artist
+  return _matches(artist_index, venue_index, Artist, artist_id, Show.artist_id, Show.venue_id, limit)
+
+
+def add_rows(model, rows):
+  # core inserts skip the session events
+  for side, index, seeking in SIDES:
+    if model is side:
+      for row in rows:
+        index.upsert(row['id'], row['name'], row.get('genres'), row.get('city'), row.get('state'), row.get(seeking))
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_changes(session, flush_context):
+  # (index, id) -> entry, None for deleted rows; applied once committed
+  changes = session.info.setdefault('match_changes', {})
+  for model, index, seeking in SIDES:
+    for target in list(session.new) + list(session.dirty):
+      if isinstance(target, model):
+        changes[(index, target.id)] = (
+          target.name, target.genres, target.city, target.state, getattr(target, seeking))
+    for target in session.deleted:
+      if isinstance(target, model):
+        changes[(index, target.id)] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_committed(session):
+  changes = session.info.pop('match_changes', None)
+  for (index, entity_id), entry in (changes or {}).items():
+    if entry is None:
+      index.remove(entity_id)
+    else:
+      index.upsert(entity_id, *entry)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(session):
+  session.info.pop('match_changes', None)
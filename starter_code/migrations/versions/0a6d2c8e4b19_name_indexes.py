@@ -0,0 +1,29 @@
+"""btree name indexes for show reference resolution
+
+Revision ID: 0a6d2c8e4b19
+Revises: f3c7a1d9b265
+Create Date: 2026-10-19 00:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6d2c8e4b19'
+down_revision = 'f3c7a1d9b265'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # equality and IN lookups by exact name; not unique, since different
+    # venues (and artists) legitimately share a name and existing data has
+    # duplicates. The resolver reports shared names as ambiguous instead.
+    op.create_index('ix_venues_name', 'venues', ['name'], unique=False)
+    op.create_index('ix_artists_name', 'artists', ['name'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_name', table_name='artists')
+    op.drop_index('ix_venues_name', table_name='venues')
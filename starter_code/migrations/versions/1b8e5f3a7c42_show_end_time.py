@@ -0,0 +1,55 @@
+"""show end time and booking exclusion constraints
+
+Revision ID: 1b8e5f3a7c42
+Revises: 0a6d2c8e4b19
+Create Date: 2026-10-19 01:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1b8e5f3a7c42'
+down_revision = '0a6d2c8e4b19'
+branch_labels = None
+depends_on = None
+
+
+OVERLAPS = """
+    SELECT count(*) FROM shows a JOIN shows b
+      ON a.id < b.id AND a.{column} = b.{column}
+     AND tsrange(a.start_time, a.end_time) && tsrange(b.start_time, b.end_time)
+"""
+
+
+def upgrade():
+    # btree_gist lets a GiST index combine venue_id = with tsrange &&
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+
+    # existing shows are booked for the default two hours
+    op.add_column('shows', sa.Column('end_time', sa.DateTime(), nullable=True))
+    op.execute("UPDATE shows SET end_time = start_time + interval '2 hours'")
+    op.alter_column('shows', 'end_time', existing_type=sa.DateTime(), nullable=False)
+    op.create_check_constraint('ck_shows_end_after_start', 'shows', 'end_time > start_time')
+
+    # exclusion constraints cannot be added NOT VALID; fail with a count
+    # instead of a bare constraint error when old data double-books
+    connection = op.get_bind()
+    for column in ('venue_id', 'artist_id'):
+        overlaps = connection.execute(sa.text(OVERLAPS.format(column=column))).scalar()
+        if overlaps:
+            raise RuntimeError('%d pairs of shows overlap on the same %s; move or delete them '
+                               'before upgrading' % (overlaps, column))
+
+    # each constraint's GiST index also serves the conflict checks in conflicts.py
+    for name, column in (('ex_shows_venue_overlap', 'venue_id'), ('ex_shows_artist_overlap', 'artist_id')):
+        op.execute('ALTER TABLE shows ADD CONSTRAINT {name} EXCLUDE USING gist '
+                   '({column} WITH =, tsrange(start_time, end_time) WITH &&)'.format(name=name, column=column))
+
+
+def downgrade():
+    op.drop_constraint('ex_shows_artist_overlap', 'shows')
+    op.drop_constraint('ex_shows_venue_overlap', 'shows')
+    op.drop_constraint('ck_shows_end_after_start', 'shows')
+    op.drop_column('shows', 'end_time')
@@ -0,0 +1,36 @@
+"""shard the listing version rows
+
+Revision ID: 5d7a2e9c4f18
+Revises: 1b8e5f3a7c42
+Create Date: 2026-10-20 10:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d7a2e9c4f18'
+down_revision = '1b8e5f3a7c42'
+branch_labels = None
+depends_on = None
+
+
+LISTINGS = ('venues', 'artists', 'shows')
+
+
+def upgrade():
+    # the single listing rows become shard 0; versions.py sums the shards
+    for key in LISTINGS:
+        op.execute(sa.text("UPDATE entity_versions SET key = :shard WHERE key = :key")
+                   .bindparams(shard=key + '#0', key=key))
+
+
+def downgrade():
+    for key in LISTINGS:
+        op.execute(sa.text("""
+            INSERT INTO entity_versions (key, version, updated_at)
+            SELECT :key, sum(version), max(updated_at) FROM entity_versions WHERE key LIKE :shards
+            HAVING count(*) > 0
+        """).bindparams(key=key, shards=key + '#%'))
+        op.execute(sa.text("DELETE FROM entity_versions WHERE key LIKE :shards").bindparams(shards=key + '#%'))
@@ -0,0 +1,59 @@
+"""hot path indexes and not-null show start time
+
+Revision ID: 7b3e5d20a4c2
+Revises: 4c1f2a9d8e01
+Create Date: 2026-10-18 20:45:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3e5d20a4c2'
+down_revision = '4c1f2a9d8e01'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # trigram operator classes for the ilike '%term%' searches on names
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    # venue and artist detail pages filter shows by owner and split on start_time
+    op.create_index('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time'], unique=False)
+    # /shows keyset pagination orders on (start_time, id); rows without a
+    # start_time can never be reached by a cursor. The original schema allowed
+    # them, so stop rather than guess a time for them or drop bookings
+    undated = op.get_bind().execute(sa.text('SELECT count(*) FROM shows WHERE start_time IS NULL')).scalar()
+    if undated:
+        raise RuntimeError(
+            '%d shows have no start_time; set one or delete them '
+            '(SELECT * FROM shows WHERE start_time IS NULL) and run the upgrade again' % undated)
+    op.alter_column('shows', 'start_time', existing_type=sa.DateTime(), nullable=False)
+    op.create_index('ix_shows_start_time_id', 'shows', ['start_time', 'id'], unique=False)
+
+    # /venues groups areas by state, city
+    op.create_index('ix_venues_state_city', 'venues', ['state', 'city'], unique=False)
+
+    op.create_index('ix_venues_name_trgm', 'venues', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_artists_name_trgm', 'artists', ['name'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+
+    # genre containment / overlap filters (@>, &&)
+    op.create_index('ix_venues_genres', 'venues', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_artists_genres', 'artists', ['genres'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_artists_genres', table_name='artists')
+    op.drop_index('ix_venues_genres', table_name='venues')
+    op.drop_index('ix_artists_name_trgm', table_name='artists')
+    op.drop_index('ix_venues_name_trgm', table_name='venues')
+    op.drop_index('ix_venues_state_city', table_name='venues')
+    op.drop_index('ix_shows_start_time_id', table_name='shows')
+    op.alter_column('shows', 'start_time', existing_type=sa.DateTime(), nullable=True)
+    op.drop_index('ix_shows_artist_id_start_time', table_name='shows')
+    op.drop_index('ix_shows_venue_id_start_time', table_name='shows')
@@ -0,0 +1,31 @@
+"""search indexes on city and state
+
+Revision ID: a9d04f6c1b37
+Revises: 7b3e5d20a4c2
+Create Date: 2026-10-18 21:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d04f6c1b37'
+down_revision = '7b3e5d20a4c2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # every branch of the search OR needs an index for a bitmap OR plan
+    op.create_index('ix_venues_city_trgm', 'venues', ['city'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'})
+    op.create_index('ix_artists_city_trgm', 'artists', ['city'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'})
+    op.create_index('ix_artists_state', 'artists', ['state'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_state', table_name='artists')
+    op.drop_index('ix_artists_city_trgm', table_name='artists')
+    op.drop_index('ix_venues_city_trgm', table_name='venues')
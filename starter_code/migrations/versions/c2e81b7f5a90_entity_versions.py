@@ -0,0 +1,29 @@
+"""entity version stamps for conditional requests
+
+Revision ID: c2e81b7f5a90
+Revises: a9d04f6c1b37
+Create Date: 2026-10-18 21:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e81b7f5a90'
+down_revision = 'a9d04f6c1b37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('entity_versions',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('entity_versions')
@@ -0,0 +1,24 @@
+"""venue timezone
+
+Revision ID: d5a3c9e2f174
+Revises: c2e81b7f5a90
+Create Date: 2026-10-18 22:05:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a3c9e2f174'
+down_revision = 'c2e81b7f5a90'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('timezone', sa.String(length=50), nullable=True))
+
+
+def downgrade():
+    op.drop_column('venues', 'timezone')
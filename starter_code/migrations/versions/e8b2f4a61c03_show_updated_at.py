@@ -0,0 +1,30 @@
+"""show updated_at
+
+Revision ID: e8b2f4a61c03
+Revises: d5a3c9e2f174
+Create Date: 2026-10-18 23:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b2f4a61c03'
+down_revision = 'd5a3c9e2f174'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # existing rows get the migration time, so the first incremental export
+    # after upgrading includes all of them
+    op.add_column('shows', sa.Column('updated_at', sa.DateTime(), nullable=False,
+                                     server_default=sa.text("timezone('utc', now())")))
+    # `flask export shows --since` scans (updated_at, id) in order
+    op.create_index('ix_shows_updated_at_id', 'shows', ['updated_at', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_updated_at_id', table_name='shows')
+    op.drop_column('shows', 'updated_at')
@@ -0,0 +1,110 @@
+"""upcoming and past show counters on venues and artists
+
+Revision ID: f3c7a1d9b265
+Revises: e8b2f4a61c03
+Create Date: 2026-10-18 23:40:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3c7a1d9b265'
+down_revision = 'e8b2f4a61c03'
+branch_labels = None
+depends_on = None
+
+
+# A show counts as upcoming while its start_time is after the watermark and
+# as past otherwise. Statement level triggers apply the net change of each
+# INSERT, UPDATE or DELETE on shows in one UPDATE per owner table, so bulk
+# imports cost two aggregated updates rather than a trigger call per row.
+# `flask counters roll` moves the watermark forward. It locks the watermark
+# row FOR UPDATE, and the triggers read it FOR SHARE, so a show written
+# during a roll is counted against the watermark it commits under.
+
+DELTA = """
+    UPDATE {table} AS o
+       SET upcoming_shows_count = o.upcoming_shows_count + d.upcoming,
+           past_shows_count = o.past_shows_count + d.past
+      FROM (SELECT owner_id,
+                   sum(CASE WHEN start_time > mark THEN n ELSE 0 END) AS upcoming,
+                   sum(CASE WHEN start_time > mark THEN 0 ELSE n END) AS past
+              FROM ({rows}) AS changed
+             GROUP BY owner_id) AS d
+     WHERE o.id = d.owner_id AND (d.upcoming <> 0 OR d.past <> 0);
+"""
+
+ROWS = {
+    'insert': ['SELECT {column} AS owner_id, start_time, 1 AS n FROM new_rows'],
+    'delete': ['SELECT {column} AS owner_id, start_time, -1 AS n FROM old_rows'],
+    'update': ['SELECT {column} AS owner_id, start_time, 1 AS n FROM new_rows',
+               'SELECT {column} AS owner_id, start_time, -1 AS n FROM old_rows'],
+}
+
+REFERENCING = {
+    'insert': 'REFERENCING NEW TABLE AS new_rows',
+    'delete': 'REFERENCING OLD TABLE AS old_rows',
+    'update': 'REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows',
+}
+
+
+def function_sql(event):
+    body = ''
+    for table, column in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        rows = ' UNION ALL '.join(select.format(column=column) for select in ROWS[event])
+        body += DELTA.format(table=table, rows=rows)
+    return """
+CREATE FUNCTION shows_count_{event}() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    mark timestamp;
+BEGIN
+    SELECT rolled_at INTO mark FROM show_counter_watermark FOR SHARE;
+{body}
+    RETURN NULL;
+END
+$$""".format(event=event, body=body)
+
+
+def upgrade():
+    for table in ('venues', 'artists'):
+        op.add_column(table, sa.Column('upcoming_shows_count', sa.Integer(), nullable=False, server_default='0'))
+        op.add_column(table, sa.Column('past_shows_count', sa.Integer(), nullable=False, server_default='0'))
+
+    op.create_table('show_counter_watermark',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('rolled_at', sa.DateTime(), nullable=False),
+        sa.CheckConstraint('id = 1', name='ck_show_counter_watermark_single_row'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO show_counter_watermark (id, rolled_at) VALUES (1, timezone('utc', now()))")
+
+    for table, column in (('venues', 'venue_id'), ('artists', 'artist_id')):
+        op.execute("""
+            UPDATE {table} AS o
+               SET upcoming_shows_count = d.upcoming, past_shows_count = d.past
+              FROM (SELECT {column} AS owner_id,
+                           count(*) FILTER (WHERE start_time > w.rolled_at) AS upcoming,
+                           count(*) FILTER (WHERE start_time <= w.rolled_at) AS past
+                      FROM shows, show_counter_watermark AS w
+                     GROUP BY {column}) AS d
+             WHERE o.id = d.owner_id
+        """.format(table=table, column=column))
+
+    for event in ('insert', 'update', 'delete'):
+        op.execute(function_sql(event))
+        op.execute("""
+            CREATE TRIGGER shows_count_{event} AFTER {operation} ON shows
+            {referencing} FOR EACH STATEMENT EXECUTE PROCEDURE shows_count_{event}()
+        """.format(event=event, operation=event.upper(), referencing=REFERENCING[event]))
+
+
+def downgrade():
+    for event in ('delete', 'update', 'insert'):
+        op.execute('DROP TRIGGER shows_count_{event} ON shows'.format(event=event))
+        op.execute('DROP FUNCTION shows_count_{event}()'.format(event=event))
+    op.drop_table('show_counter_watermark')
+    for table in ('artists', 'venues'):
+        op.drop_column(table, 'past_shows_count')
+        op.drop_column(table, 'upcoming_shows_count')
@@ -1,8 +1,38 @@
 from app import db
+from sqlalchemy.dialects.postgresql import ExcludeConstraint
+from sqlalchemy.orm import aliased
 import datetime
+import itertools
+
+# split already-fetched show rows into past and upcoming around a single "now"
+def split_shows(shows, now):
+  past_shows = []
+  upcoming_shows = []
+  for show in shows:
+    if show['start_time'] > now:
+      upcoming_shows.append(show)
+    else:
+      past_shows.append(show)
+  return past_shows, upcoming_shows
+
+# an entity's key in entity_versions ('artist:1') as a SQL expression, for
+# reading versions in the same query as the rows they stamp
+def version_key(kind, entity_id):
+  return db.literal(kind + ':') + db.cast(entity_id, db.String)
+
+# the database clock as naive UTC, as of the statement being run
+def utc_now():
+  return db.func.timezone('utc', db.func.statement_timestamp())
 
 class Venue(db.Model):
   __tablename__ = 'venues'
+  __table_args__ = (
+    db.Index('ix_venues_state_city', 'state', 'city'),
+    db.Index('ix_venues_name', 'name'),
+    db.Index('ix_venues_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    db.Index('ix_venues_city_trgm', 'city', postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'}),
+    db.Index('ix_venues_genres', 'genres', postgresql_using='gin'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(50))
@@ -16,15 +46,20 @@ class Venue(db.Model):
   website = db.Column(db.String(120))
   seeking_talent = db.Column(db.Boolean, default=False)
   seeking_description = db.Column(db.String(500))
+  timezone = db.Column(db.String(50)) # IANA name, e.g. "America/Los_Angeles"; None renders UTC
+  # maintained by triggers on shows and `flask counters roll`, see counters.py
+  upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
   shows = db.relationship('Show', backref='venue', lazy='dynamic')
 
   def __repr__(self):
     return f"<Venue: {self.id} {self.name}>"
 
-  def __init__(self, name, city, state, address=None, phone=None, image_link=None, facebook_link=None, website=None, seeking_talent=False, seeking_description=None):
+  def __init__(self, name, city, state, address=None, phone=None, image_link=None, facebook_link=None, website=None, seeking_talent=False, seeking_description=None, timezone=None, genres=None):
     self.name = name
     self.city = city
     self.state = state
+    self.genres = genres or []
     self.address =address
     self.phone = phone
     self.image_link = image_link
@@ -32,6 +67,7 @@ class Venue(db.Model):
     self.website = website
     self.seeking_talent = seeking_talent
     self.seeking_description = seeking_description
+    self.timezone = timezone
 
   # decorator that allows to view a venue with number of upcoming shows
   @property
@@ -39,26 +75,109 @@ class Venue(db.Model):
     return {
       'id' : self.id,
       'name': self.name,
-      'no_upcoming_shows': len(Show.query.filter(Show.start_time>datetime.datetime.now()).filter(self.id==Show.venue_id).all())
+      'no_upcoming_shows': self.upcoming_shows_count
     }
 
-  @property
-  def format_with_shows_count(self):
-    # venues.format - city, state, 
-    # Venue.format_shows_count (id, name, num_upcoming_shows)
+  # one query for the /venues listing: venues ordered by state/city so
+  # consecutive rows share an area, upcoming shows read from the counter;
+  # criteria are the browse filters (see facets.py)
+  @staticmethod
+  def areas_query(criteria=()):
+    return db.session.query(
+      Venue.id,
+      Venue.name,
+      Venue.city,
+      Venue.state,
+      Venue.upcoming_shows_count.label('num_upcoming_shows')
+    ).filter(*criteria) \
+      .order_by(Venue.state, Venue.city, Venue.id)
+
+  # venues.html areas - city, state, venues (id, name, num_upcoming_shows)
+  @staticmethod
+  def areas(criteria=()):
+    return Venue.group_areas(Venue.areas_query(criteria))
+
+  # areas from areas_query rows, however they were fetched
+  @staticmethod
+  def group_areas(results):
+    data = []
+    for (city, state), rows in itertools.groupby(results, key=lambda row: (row.city, row.state)):
+      data.append({
+        'city': city,
+        'state': state,
+        'venues': [{
+          'id': row.id,
+          'name': row.name,
+          'num_upcoming_shows': row.num_upcoming_shows
+        } for row in rows]
+      })
+    return data
+
+  # columns of a show tile on the venue page; the artists' versions key the
+  # tiles' fragment cache
+  @staticmethod
+  def show_columns():
+    return (
+      Show.start_time,
+      Artist.id.label('artist_id'),
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'),
+      EntityVersion.version.label('artist_version')
+    )
+
+  # shows at a venue joined to their artists, ordered by start time
+  @staticmethod
+  def shows_query(venue_id):
+    return db.session.query(*Venue.show_columns()) \
+      .join(Artist, Show.artist_id == Artist.id) \
+      .outerjoin(EntityVersion, EntityVersion.key == version_key('artist', Artist.id)) \
+      .filter(Show.venue_id == venue_id) \
+      .order_by(Show.start_time)
+
+  # the venue outer-joined to its shows and their artists, one row per show
+  # (one row with NULL show columns when the venue has none)
+  @staticmethod
+  def detail_query(venue_id):
+    return db.session.query(Venue, *Venue.show_columns()) \
+      .outerjoin(Show, Show.venue_id == Venue.id) \
+      .outerjoin(Artist, Show.artist_id == Artist.id) \
+      .outerjoin(EntityVersion, EntityVersion.key == version_key('artist', Artist.id)) \
+      .filter(Venue.id == venue_id) \
+      .order_by(Show.start_time)
+
+  # venue detail page in one query
+  @staticmethod
+  def get_with_shows(venue_id):
+    rows = Venue.detail_query(venue_id).all()
+    if not rows:
+      return None
+    shows = [Venue.format_show(row) for row in rows if row.start_time is not None]
+    past_shows, upcoming_shows = split_shows(shows, datetime.datetime.utcnow())
+    return rows[0][0].format_detail(past_shows, upcoming_shows)
+
+  # a show tile on the venue page (artist_id, artist_name, artist_image_link, start_time)
+  @staticmethod
+  def format_show(row):
     return {
-      'city': self.city,
-      'state': self.state,
-      'venues': [venue.format for venue in Venue.query.filter(Show.venue_id==self.id).all()]
+      'artist_id': row.artist_id,
+      'artist_name': row.artist_name,
+      'artist_image_link': row.artist_image_link,
+      'artist_version': row.artist_version,
+      'start_time': row.start_time
     }
 
   @property
   def format_with_shows(self):
-    
+    now = datetime.datetime.utcnow()
+    shows = [Venue.format_show(row) for row in Venue.shows_query(self.id)]
+    past_shows, upcoming_shows = split_shows(shows, now)
+    return self.format_detail(past_shows, upcoming_shows)
+
+  def format_detail(self, past_shows, upcoming_shows):
     return {
       'id' : self.id,
       'name': self.name,
-      'genres': self.genres, # [artist.genres for artist in Artist.query.filter(Show.artist_id==Artist.id)],
+      'genres': self.genres,
       'address': self.address,
       'city': self.city,
       'state': self.state,
@@ -67,19 +186,12 @@ class Venue(db.Model):
       'website': self.website,
       'facebook_link': self.facebook_link,
       'seeking_talent': self.seeking_talent,
-      'description': self.seeking_description,
-      'past_shows': [show.format_with_artist for show in Show.query.filter(Show.venue_id==self.id, Show.start_time<datetime.datetime.now())],
-      'past_shows_count': len(Show.query.filter(Show.venue_id==self.id, Show.start_time<datetime.datetime.now()).all()),
-      'upcoming_shows':  [show.format_with_artist for show in Show.query.filter(Show.venue_id==self.id, Show.start_time>datetime.datetime.now())],
-      'upcoming_shows_count': len(Show.query.filter(Show.venue_id==self.id, Show.start_time>datetime.datetime.now()).all()),
-    }
-
-  @property
-  def format_with_city_state(self):
-    return {
-      'city': self.city,
-      'state': self.state,
-      'venues': [venue.format_with_shows_count for venue in Venue.query.filter(Venue.city==self.city, Venue.state==self.state).all()]
+      'seeking_description': self.seeking_description,
+      'timezone': self.timezone,
+      'past_shows': past_shows,
+      'past_shows_count': len(past_shows),
+      'upcoming_shows': upcoming_shows,
+      'upcoming_shows_count': len(upcoming_shows),
     }
 
   def insert(self):
@@ -97,6 +209,13 @@ class Venue(db.Model):
 
 class Artist(db.Model):
   __tablename__ = 'artists'
+  __table_args__ = (
+    db.Index('ix_artists_name_trgm', 'name', postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'}),
+    db.Index('ix_artists_city_trgm', 'city', postgresql_using='gin', postgresql_ops={'city': 'gin_trgm_ops'}),
+    db.Index('ix_artists_state', 'state'),
+    db.Index('ix_artists_name', 'name'),
+    db.Index('ix_artists_genres', 'genres', postgresql_using='gin'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
   name = db.Column(db.String(50))
@@ -109,6 +228,8 @@ class Artist(db.Model):
   facebook_link = db.Column(db.String(120))
   seeking_venue = db.Column(db.Boolean, default=False)
   seeking_description = db.Column(db.String(500))
+  upcoming_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+  past_shows_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
   shows = db.relationship('Show', backref='artist', lazy="dynamic")
 
   def __init__(self, name, city, state, phone=None, image_link=None, website=None, facebook_link=None, seeking_venue=False, seeking_description=None,  genres=[]):
@@ -130,8 +251,50 @@ class Artist(db.Model):
       'name': self.name
     }
 
+  # shows of an artist joined to their venues, ordered by start time; the
+  # venues' versions key the show tiles' fragment cache
+  @staticmethod
+  def shows_query(artist_id):
+    return db.session.query(
+      Show.start_time,
+      Venue.id.label('venue_id'),
+      Venue.name.label('venue_name'),
+      Venue.image_link.label('venue_image_link'),
+      Venue.timezone.label('venue_timezone'),
+      EntityVersion.version.label('venue_version')
+    ).join(Venue, Show.venue_id == Venue.id) \
+      .outerjoin(EntityVersion, EntityVersion.key == version_key('venue', Venue.id)) \
+      .filter(Show.artist_id == artist_id) \
+      .order_by(Show.start_time)
+
+  # artist detail page in two queries: the artist, then its shows with venues
+  @staticmethod
+  def get_with_shows_venue(artist_id):
+    artist = Artist.query.get(artist_id)
+    if artist is None:
+      return None
+    return artist.format_with_shows_venue
+
+  # a show tile on the artist page (venue_id, venue_name, venue_image_link, start_time)
+  @staticmethod
+  def format_show(row):
+    return {
+      'venue_id': row.venue_id,
+      'venue_name': row.venue_name,
+      'venue_image_link': row.venue_image_link,
+      'venue_timezone': row.venue_timezone,
+      'venue_version': row.venue_version,
+      'start_time': row.start_time
+    }
+
   @property
   def format_with_shows_venue(self):
+    now = datetime.datetime.utcnow()
+    shows = [Artist.format_show(row) for row in Artist.shows_query(self.id)]
+    past_shows, upcoming_shows = split_shows(shows, now)
+    return self.format_detail(past_shows, upcoming_shows)
+
+  def format_detail(self, past_shows, upcoming_shows):
     return {
       'id': self.id,
       'name': self.name,
@@ -144,10 +307,10 @@ class Artist(db.Model):
       'seeking_venue': self.seeking_venue,
       'seeking_description': self.seeking_description,
       'image_link': self.image_link,
-      'past_shows': [show.format_with_venue for show in Show.query.filter(Show.start_time<datetime.datetime.now()).all()],
-      'upcoming_shows': [show.format_with_venue for show in Show.query.filter(Show.start_time>datetime.datetime.now()).all()],
-      'past_shows_count': len(Show.query.filter(Show.start_time<datetime.datetime.now()).all()),
-      'upcoming_shows_count': len(Show.query.filter(Show.start_time>datetime.datetime.now()).all())
+      'past_shows': past_shows,
+      'upcoming_shows': upcoming_shows,
+      'past_shows_count': len(past_shows),
+      'upcoming_shows_count': len(upcoming_shows)
     }
 
 
@@ -171,11 +334,32 @@ class Artist(db.Model):
 # TODO Implement Show and Artist models, and complete all model relationships and properties, as a database migration.
 class Show(db.Model):
   __tablename__ = 'shows'
+  __table_args__ = (
+    db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+    db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+    db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+    db.Index('ix_shows_updated_at_id', 'updated_at', 'id'),
+    db.CheckConstraint('end_time > start_time', name='ck_shows_end_after_start'),
+    # no venue or artist is booked twice at once; GiST indexes from btree_gist
+    ExcludeConstraint(('venue_id', '='), (db.func.tsrange(db.column('start_time'), db.column('end_time')), '&&'),
+                      name='ex_shows_venue_overlap', using='gist'),
+    ExcludeConstraint(('artist_id', '='), (db.func.tsrange(db.column('start_time'), db.column('end_time')), '&&'),
+                      name='ex_shows_artist_overlap', using='gist'),
+  )
 
   id = db.Column(db.Integer, primary_key=True)
-  start_time = db.Column(db.DateTime())
+  start_time = db.Column(db.DateTime(), nullable=False)
+  end_time = db.Column(db.DateTime(), nullable=False) # bookings are [start_time, end_time)
   artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'), nullable=False)
   venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'), nullable=False)
+  # naive UTC from the database clock, set on insert and on every ORM update
+  # (and when the show's venue or artist changes, see export.py); drives
+  # incremental exports
+  updated_at = db.Column(db.DateTime(), nullable=False, default=utc_now(),
+    onupdate=utc_now(), server_default=db.text("timezone('utc', now())"))
+
+  CURSOR_FORMAT = '%Y%m%dT%H%M%S%f'
+  DEFAULT_DURATION = datetime.timedelta(hours=2)
 
   def __repr__(self):
     return f"<Show: {self.artist_id} {self.venue_id}, {self.start_time}>"
@@ -184,45 +368,112 @@ class Show(db.Model):
   def format(self):
     return {
       'start_time': self.start_time,
+      'end_time': self.end_time,
       'artist_id': self.artist_id,
       'venue_id': self.venue_id
     }
 
-  @property
-  def format_with_artist(self):
-    # artist_id, artist_name, artist_image_link, start_time
-    return {
-      'artist_id': self.artist_id,
-      'artist_name' : Artist.query.filter(Artist.id==self.artist_id).one_or_none().name,
-      'artist_image_link': Artist.query.filter(Artist.id==self.artist_id).one_or_none().image_link,
-      'start_time': datetime.datetime.strftime(self.start_time, "%d-%m-%Y %H:%M:%S")
-    }
+  # cursor for keyset pagination over (start_time, id)
+  @staticmethod
+  def encode_cursor(start_time, show_id):
+    return '%s_%d' % (start_time.strftime(Show.CURSOR_FORMAT), show_id)
+
+  @staticmethod
+  def decode_cursor(cursor):
+    start_time, show_id = cursor.split('_')
+    return datetime.datetime.strptime(start_time, Show.CURSOR_FORMAT), int(show_id)
+
+  # shows JOIN artists JOIN venues, selecting only the columns pages/shows.html
+  # renders and the venue and artist versions keying its tiles
+  @staticmethod
+  def page_query():
+    venue_version, artist_version = aliased(EntityVersion), aliased(EntityVersion)
+    return db.session.query(
+      Show.id,
+      Show.start_time,
+      Venue.id.label('venue_id'),
+      Venue.name.label('venue_name'),
+      Venue.timezone.label('venue_timezone'),
+      venue_version.version.label('venue_version'),
+      Artist.id.label('artist_id'),
+      Artist.name.label('artist_name'),
+      Artist.image_link.label('artist_image_link'),
+      artist_version.version.label('artist_version')
+    ).join(Artist, Show.artist_id == Artist.id) \
+      .join(Venue, Show.venue_id == Venue.id) \
+      .outerjoin(venue_version, venue_version.key == version_key('venue', Venue.id)) \
+      .outerjoin(artist_version, artist_version.key == version_key('artist', Artist.id))
+
+  # one keyset page of /shows
+  @staticmethod
+  def page(after=None, before=None, per_page=30):
+    return Show.format_page(Show.keyset_query(after, before, per_page).all(), after, before, per_page)
+
+  # the page after / before a cursor, plus one row telling whether more follow
+  @staticmethod
+  def keyset_query(after=None, before=None, per_page=30):
+    key = db.tuple_(Show.start_time, Show.id)
+    query = Show.page_query()
+    if before is not None:
+      # walk backwards from the cursor; format_page restores ascending order
+      query = query.filter(key < db.tuple_(*Show.decode_cursor(before))) \
+        .order_by(Show.start_time.desc(), Show.id.desc())
+    else:
+      if after is not None:
+        query = query.filter(key > db.tuple_(*Show.decode_cursor(after)))
+      query = query.order_by(Show.start_time, Show.id)
+    return query.limit(per_page + 1)
+
+  @staticmethod
+  def format_page(rows, after=None, before=None, per_page=30):
+    if before is not None:
+      has_prev, has_next = len(rows) > per_page, True
+      rows = rows[:per_page][::-1]
+    else:
+      has_prev, has_next = after is not None, len(rows) > per_page
+      rows = rows[:per_page]
+
+    # a tile per show: venue_id, venue_name, artist_id, artist_name, artist_image_link, start_time
+    shows = [{
+      'venue_id': row.venue_id,
+      'venue_name': row.venue_name,
+      'artist_id': row.artist_id,
+      'artist_name': row.artist_name,
+      'artist_image_link': row.artist_image_link,
+      'start_time': row.start_time,
+      'venue_timezone': row.venue_timezone,
+      'venue_version': row.venue_version,
+      'artist_version': row.artist_version
+    } for row in rows]
 
-    
-  # shows.format_with_artist_venue = venue_id, venue_name, artist_id, artist_name, artist_image_link, start_time
-  @property
-  def format_with_artist_venue(self):
     return {
-      'venue_id':self.venue_id, # self.venue_id
-      'venue_name': Venue.query.filter(self.venue_id==Venue.id).one_or_none().name, # self.venue_id = Venue.id
-      'artist_id': self.artist_id, # self.artist_id
-      'artist_name': Artist.query.filter(self.artist_id==Artist.id).one_or_none().name, # self.artist_id = Artist.id
-      'artist_image_link': Artist.query.filter(self.artist_id==Artist.id).one_or_none().image_link, #self.artist_id = Artist.id
-      'start_time': datetime.datetime.strftime(self.start_time, "%d-%m-%Y %H:%M:%S") # self.start_time
+      'shows': shows,
+      'prev_cursor': Show.encode_cursor(rows[0].start_time, rows[0].id) if rows and has_prev else None,
+      'next_cursor': Show.encode_cursor(rows[-1].start_time, rows[-1].id) if rows and has_next else None
     }
 
-  # shows.format_with_venue (venue_id, venue_name, venue_image_link, start_time)
-  @property
-  def format_with_venue(self):
-    return {
-      'venue_id': self.venue_id, # self.venue_id
-      'venue_name': Venue.query.filter(self.venue_id==Venue.id).one_or_none().name, # self.venue_id == venue.id
-      'venue_image_link': Venue.query.filter(self.venue_id==Venue.id).one_or_none().image_link, # self.venue_id == venue.id
-      'start_time': datetime.datetime.strftime(self.start_time, "%d-%m-%Y %H:%M:%S") # self.start_time
-    }
-
-  def __init__(self, artist_id, venue_id, start_time):
-    self.start_time = datetime.datetime.strptime(start_time, "%Y-%m-%dT%H:%M:%S.%fZ")
+  # accepts the JSON API format ("2019-05-21T21:30:00.000Z"), any ISO 8601
+  # string such as the show form's "2019-05-21 21:30:00", or a datetime
+  @staticmethod
+  def parse_start_time(value):
+    if isinstance(value, datetime.datetime):
+      return value
+    try:
+      return datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%fZ")
+    except ValueError:
+      return datetime.datetime.fromisoformat(value.rstrip('Z'))
+
+  # end of a booking: the given end time, or DEFAULT_DURATION after the start
+  @staticmethod
+  def parse_end_time(value, start_time):
+    end_time = Show.parse_start_time(value) if value else start_time + Show.DEFAULT_DURATION
+    if end_time <= start_time:
+      raise ValueError('end_time must be after start_time')
+    return end_time
+
+  def __init__(self, artist_id, venue_id, start_time, end_time=None):
+    self.start_time = Show.parse_start_time(start_time)
+    self.end_time = Show.parse_end_time(end_time, self.start_time)
     self.artist_id = artist_id
     self.venue_id = venue_id
 
@@ -236,3 +487,28 @@ class Show(db.Model):
   def delete(self):
     db.session.delete(self)
     db.session.commit()
+
+# version stamp per entity ('venue:1') and per listing ('venues'), bumped in
+# the same transaction as every write; drives ETag / Last-Modified
+class EntityVersion(db.Model):
+  __tablename__ = 'entity_versions'
+
+  key = db.Column(db.String(64), primary_key=True)
+  version = db.Column(db.Integer, nullable=False, default=1)
+  updated_at = db.Column(db.DateTime(), nullable=False)
+
+  def __repr__(self):
+    return f"<EntityVersion: {self.key} {self.version}>"
+
+# the time upcoming_shows_count / past_shows_count were last rolled to; one row
+class ShowCounterWatermark(db.Model):
+  __tablename__ = 'show_counter_watermark'
+  __table_args__ = (
+    db.CheckConstraint('id = 1', name='ck_show_counter_watermark_single_row'),
+  )
+
+  id = db.Column(db.Integer, primary_key=True)
+  rolled_at = db.Column(db.DateTime(), nullable=False)
+
+  def __repr__(self):
+    return f"<ShowCounterWatermark: {self.rolled_at}>"
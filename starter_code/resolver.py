@@ -0,0 +1,169 @@
+from app import app, db
+from models import Venue, Artist
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import cache
+
+#----------------------------------------------------------------------------#
+# Resolver.
+#----------------------------------------------------------------------------#
+
+# Turns the artist and venue references of a show (an id, or a name) into
+# ids. Batch records say which they give (artist_id or artist_name); the show
+# form's single field takes '#12' for an id, or a name, with bare digits read
+# as a name first since bands are called '311' or '1975'. Lookups go through
+# a bounded LRU keyed by name or id, and misses are fetched for a whole batch
+# with one indexed IN query per kind (btree indexes ix_venues_name /
+# ix_artists_name). Names are not unique, so a name shared by several rows is
+# reported as ambiguous (409) rather than picked arbitrarily; unknown ids and
+# names are 404. Committed ORM writes and core inserts invalidate the names
+# and ids they touch; other workers catch up within RESOLVER_CACHE_TTL.
+
+MODELS = {'artist': Artist, 'venue': Venue}
+
+lookup_cache = cache.LRUCache(app.config['RESOLVER_CACHE_MAXSIZE'], app.config['RESOLVER_CACHE_TTL'])
+
+
+class ResolveError(ValueError):
+  status = 400
+
+
+class NotFound(ResolveError):
+  status = 404
+
+
+class Ambiguous(ResolveError):
+  status = 409
+
+
+def _lookup(kind, field, values):
+  # value -> tuple of at most two matching ids, for the values that exist;
+  # cache misses are loaded with one query
+  model = MODELS[kind]
+  column = getattr(model, field)
+  found, missing = {}, []
+  for value in set(values):
+    ids = lookup_cache.get('%s:%s:%s' % (kind, field, value))
+    if ids is None:
+      missing.append(value)
+    else:
+      found[value] = ids
+  if missing:
+    loaded = {}
+    for value, entity_id in db.session.query(column, model.id).filter(column.in_(missing)).order_by(model.id):
+      ids = loaded.get(value, ())
+      if len(ids) < 2:
+        loaded[value] = ids + (entity_id,)
+    for value, ids in loaded.items():
+      tags = ['%s:%s:%s' % (kind, field, value)] + ['%s:%d' % (kind, entity_id) for entity_id in ids]
+      lookup_cache.set('%s:%s:%s' % (kind, field, value), ids, tags)
+    found.update(loaded)
+  return found
+
+
+def _reference(record, kind):
+  # (field, value) a record uses to name its artist or venue
+  entity_id = record.get(kind + '_id')
+  if entity_id is not None and entity_id != '':
+    try:
+      return 'id', int(entity_id.lstrip('#') if isinstance(entity_id, str) else entity_id)
+    except (TypeError, ValueError):
+      raise ResolveError('invalid %s_id %r' % (kind, entity_id))
+  name = record.get(kind + '_name')
+  if not name:
+    raise ResolveError('missing %s_id or %s_name' % (kind, kind))
+  return 'name', name
+
+
+def _pick(kind, field, value, found):
+  ids = found.get(value)
+  if not ids:
+    raise NotFound('unknown %s %s %r' % (kind, field, value))
+  if len(ids) > 1:
+    raise Ambiguous('ambiguous %s name %r matches several %ss, use %s_id' % (kind, value, kind, kind))
+  return ids[0]
+
+
+def batch(records):
+  # resolve(record, kind) for a batch of show records, after loading every
+  # uncached reference the batch uses in one query per kind and field
+  wanted = dict(((kind, field), []) for kind in MODELS for field in ('id', 'name'))
+  for record in records:
+    if not isinstance(record, dict):
+      continue
+    for kind in MODELS:
+      try:
+        field, value = _reference(record, kind)
+      except ResolveError:
+        continue
+      wanted[kind, field].append(value)
+  found = dict((key, _lookup(key[0], key[1], values) if values else {}) for key, values in wanted.items())
+
+  def resolve_record(record, kind):
+    field, value = _reference(record, kind)
+    return _pick(kind, field, value, found[kind, field])
+  return resolve_record
+
+
+def resolve(kind, value):
+  # an id (int, or '#12') or a name -> id. A name of digits ('1975') may
+  # also be meant as an id: it resolves to whichever exists, and is
+  # ambiguous when both do and differ
+  if isinstance(value, int):
+    return _pick(kind, 'id', value, _lookup(kind, 'id', [value]))
+  value = str(value).strip()
+  if value.startswith('#') and value[1:].isdigit():
+    entity_id = int(value[1:])
+    return _pick(kind, 'id', entity_id, _lookup(kind, 'id', [entity_id]))
+  if not value:
+    raise ResolveError('missing %s' % kind)
+  named = _lookup(kind, 'name', [value])
+  if not value.isdigit():
+    return _pick(kind, 'name', value, named)
+  numbered = _lookup(kind, 'id', [int(value)])
+  if value in named and int(value) in numbered and named[value] != numbered[int(value)]:
+    raise Ambiguous('%s %r is both a name and an id, use #%s for the id' % (kind, value, value))
+  if value in named:
+    return _pick(kind, 'name', value, named)
+  return _pick(kind, 'id', int(value), numbered)
+
+
+#----------------------------------------------------------------------------#
+# Invalidation.
+#----------------------------------------------------------------------------#
+
+def _tags_for_instance(target):
+  tags = set()
+  for kind, model in MODELS.items():
+    if isinstance(target, model):
+      state = db.inspect(target)
+      names = [target.name] + list(state.attrs.name.history.deleted)
+      tags.update('%s:name:%s' % (kind, name) for name in names if name)
+      tags.add('%s:%s' % (kind, target.id))
+  return tags
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_tags(session, flush_context):
+  tags = session.info.setdefault('resolver_tags', set())
+  for target in list(session.new) + list(session.dirty) + list(session.deleted):
+    tags |= _tags_for_instance(target)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed(session):
+  tags = session.info.pop('resolver_tags', None)
+  if tags:
+    lookup_cache.invalidate(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_tags(session):
+  session.info.pop('resolver_tags', None)
+
+
+def invalidate_rows(model, rows):
+  # core inserts of venues or artists: a new row can make a cached name ambiguous
+  for kind, kind_model in MODELS.items():
+    if model is kind_model:
+      lookup_cache.invalidate(set('%s:name:%s' % (kind, row['name']) for row in rows))
@@ -0,0 +1,148 @@
+from flask import has_request_context, request, session as flask_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import create_engine, event, orm, text
+from sqlalchemy.engine import make_url
+import itertools
+import threading
+import time
+
+#----------------------------------------------------------------------------#
+# Read replica routing.
+#----------------------------------------------------------------------------#
+
+# GET and HEAD requests read from the replicas in SQLALCHEMY_REPLICA_URIS,
+# round-robin over those that passed their last health check. Everything
+# else stays on the primary: other HTTP methods, CLI commands, flushes, the
+# rest of a request once its session has written, and, for
+# REPLICA_READ_AFTER_WRITE_SECONDS after a commit that wrote, every request
+# from the same browser session so users see their own writes despite
+# replication lag. With no replicas configured this behaves exactly like
+# flask_sqlalchemy.SQLAlchemy.
+#
+# Health checks run on a background thread every REPLICA_HEALTH_INTERVAL
+# seconds, so no request waits on one; connecting to a PostgreSQL replica
+# gives up after REPLICA_CONNECT_TIMEOUT seconds. A replica takes reads once
+# its first check has passed.
+
+class ReplicaSet(object):
+
+  def __init__(self, urls, engine_options, health_interval, connect_timeout=None):
+    self.engines = [create_engine(url, **self._options(url, engine_options, connect_timeout)) for url in urls]
+    self.health_interval = health_interval
+    self._healthy = dict((engine, False) for engine in self.engines)
+    self._next = itertools.cycle(range(len(self.engines)))
+    self._lock = threading.Lock()
+    self._checker = None
+
+  @staticmethod
+  def _options(url, engine_options, connect_timeout):
+    # libpq's connect_timeout; other drivers keep their own defaults
+    options = dict(engine_options)
+    if connect_timeout and make_url(url).get_backend_name() == 'postgresql':
+      options['connect_args'] = dict(options.get('connect_args', {}), connect_timeout=connect_timeout)
+    return options
+
+  def choose(self):
+    # next healthy replica, or None when every replica is down
+    self._start_checker()
+    for _ in range(len(self.engines)):
+      with self._lock:
+        engine = self.engines[next(self._next)]
+      if self._healthy[engine]:
+        return engine
+    return None
+
+  def is_healthy(self, engine):
+    return self._healthy[engine]
+
+  def check(self):
+    # SELECT 1 on every replica; any failure marks it down until the next check
+    for engine in self.engines:
+      try:
+        with engine.connect() as connection:
+          connection.execute(text('SELECT 1'))
+        self._healthy[engine] = True
+      except Exception:
+        self._healthy[engine] = False
+
+  def _start_checker(self):
+    # one checker per process, started by its first replica read (after any
+    # fork of the serving process)
+    if self._checker is not None or not self.engines:
+      return
+    with self._lock:
+      if self._checker is None:
+        self._checker = threading.Thread(target=self._check_forever, name='replica-health', daemon=True)
+        self._checker.start()
+
+  def _check_forever(self):
+    while True:
+      self.check()
+      time.sleep(self.health_interval)
+
+  def status(self):
+    return [{
+      'url': repr(engine.url),
+      'healthy': self._healthy[engine],
+      'pool': engine.pool.status()
+    } for engine in self.engines]
+
+
+class RoutingSession(SignallingSession):
+
+  def __init__(self, db, **options):
+    # SignallingSession keeps only db's app and binds
+    self.db = db
+    SignallingSession.__init__(self, db, **options)
+
+  def get_bind(self, mapper=None, clause=None, **kwargs):
+    # SQLAlchemy 1.4 passes extra keywords SignallingSession.get_bind does not take
+    if self._use_replica():
+      engine = self.db.replicas.choose()
+      if engine is not None:
+        return engine
+    return SignallingSession.get_bind(self, mapper, clause)
+
+  def _use_replica(self):
+    if not self.db.replicas.engines or self._flushing or self.info.get('wrote'):
+      return False
+    if not has_request_context() or request.method not in ('GET', 'HEAD'):
+      return False
+    return flask_session.get('_primary_until', 0) < time.time()
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def mark_written(session, flush_context):
+  session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def stick_to_primary(session):
+  if session.info.pop('wrote', False) and has_request_context():
+    window = session.app.config['REPLICA_READ_AFTER_WRITE_SECONDS']
+    flask_session['_primary_until'] = time.time() + window
+
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def forget_writes(session):
+  session.info.pop('wrote', None)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+  _replicas = None
+
+  def create_session(self, options):
+    return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+  @property
+  def replicas(self):
+    if self._replicas is None:
+      config = self.get_app().config
+      self._replicas = ReplicaSet(
+        config['SQLALCHEMY_REPLICA_URIS'],
+        config['SQLALCHEMY_ENGINE_OPTIONS'],
+        config['REPLICA_HEALTH_INTERVAL'],
+        config['REPLICA_CONNECT_TIMEOUT']
+      )
+    return self._replicas
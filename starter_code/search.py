@@ -0,0 +1,86 @@
+from app import db
+from models import Venue, Artist
+from forms import genres
+
+#----------------------------------------------------------------------------#
+# Search.
+#----------------------------------------------------------------------------#
+
+# Ranked search over name, city, state and genres. Matching is index backed:
+# trigram GIN indexes serve the ilike filters on name and city, the
+# (state, city) btree serves state equality and the genres GIN index serves
+# array containment. Relevance is trigram similarity on name and city plus a
+# bonus for exact state or genre hits. One query returns the page of results,
+# the total match count and the upcoming show counter of every hit; a page
+# past the end takes a second query for the count.
+
+GENRES = {genre.lower(): genre for genre, _ in genres}
+
+
+# (filters matching term, relevance of a match) over model
+def criteria(model, term):
+  term = term.strip()
+  pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+  genre = GENRES.get(term.lower())
+
+  matches = [
+    model.name.ilike(pattern, escape='\\'),
+    model.city.ilike(pattern, escape='\\'),
+    model.state == term.upper()
+  ]
+  rank = db.func.similarity(model.name, term) * 2 \
+    + db.func.similarity(model.city, term) \
+    + db.case((model.state == term.upper(), 1.0), else_=0.0)
+  if genre is not None:
+    matches.append(model.genres.contains([genre]))
+    rank = rank + db.case((model.genres.contains([genre]), 1.0), else_=0.0)
+  return matches, rank
+
+
+# one page of ranked matches, every row carrying the total match count
+def page_query(model, term, page=1, per_page=20):
+  matches, rank = criteria(model, term)
+  return db.session.query(
+    model.id,
+    model.name,
+    model.upcoming_shows_count.label('num_upcoming_shows'),
+    db.func.count().over().label('total')
+  ).filter(db.or_(*matches)) \
+    .order_by(rank.desc(), model.name, model.id) \
+    .limit(per_page) \
+    .offset((page - 1) * per_page)
+
+
+def count_query(model, term):
+  matches, _ = criteria(model, term)
+  return db.session.query(db.func.count(model.id)).filter(db.or_(*matches))
+
+
+def search(model, term, page=1, per_page=20):
+  rows = page_query(model, term, page, per_page).all()
+
+  if rows:
+    total = rows[0].total
+  elif page > 1:
+    # past the last page no row carries the window count; count separately
+    total = count_query(model, term).scalar()
+  else:
+    total = 0
+  return {
+    'count': total,
+    'page': page,
+    'pages': (total + per_page - 1) // per_page,
+    'data': [{
+      'id': row.id,
+      'name': row.name,
+      'num_upcoming_shows': row.num_upcoming_shows
+    } for row in rows]
+  }
+
+
+def search_venues(term, page=1, per_page=20):
+  return search(Venue, term, page, per_page)
+
+
+def search_artists(term, page=1, per_page=20):
+  return search(Artist, term, page, per_page)
@@ -0,0 +1,203 @@
+from app import app, db
+from models import Venue, Artist
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+import bisect
+import sys
+import threading
+import time
+
+#----------------------------------------------------------------------------#
+# Suggest.
+#----------------------------------------------------------------------------#
+
+# In-memory prefix index over venue and artist names for type-ahead. Keys are
+# kept in a sorted list of (lowercased name, kind, id) tuples, so a prefix
+# lookup is a bisect to the first candidate followed by a short scan. Each
+# serving process builds the index at startup (app.start_worker) and
+# rebuilds it every SUGGEST_INDEX_TTL seconds on a background thread, to pick
+# up writes made by other processes (workers, flask import); requests keep
+# reading the old index until the new one is swapped in. Servers that skip
+# start_worker get the thread on their first lookup, with an empty index
+# until it has loaded. Writes made through the session are queued at flush
+# and applied when their transaction commits.
+
+class PrefixIndex(object):
+
+  def __init__(self):
+    self._keys = []
+    self._names = {}
+    self._lock = threading.Lock()
+    self._reload_lock = threading.Lock()
+    self._replay = None
+    self.loaded = False
+    self.loaded_at = 0
+
+  def load(self, entries):
+    # entries: iterable of (kind, id, name)
+    names = {}
+    for kind, entity_id, name in entries:
+      if name:
+        names[(kind, entity_id)] = name
+    keys = sorted((name.lower(), kind, entity_id) for (kind, entity_id), name in names.items())
+    with self._lock:
+      self._keys = keys
+      self._names = names
+      for change in self._replay or ():
+        self._set(*change)
+      self.loaded = True
+      self.loaded_at = time.time()
+
+  def reload(self, read):
+    # load(read()), one reload at a time; writes applied while read() runs
+    # are replayed over its entries, which may predate their commit
+    with self._reload_lock:
+      with self._lock:
+        self._replay = []
+      try:
+        self.load(read())
+      finally:
+        with self._lock:
+          self._replay = None
+
+  def add(self, kind, entity_id, name):
+    # a None name removes the entry
+    with self._lock:
+      self._set(kind, entity_id, name)
+      if self._replay is not None:
+        self._replay.append((kind, entity_id, name))
+
+  def remove(self, kind, entity_id):
+    self.add(kind, entity_id, None)
+
+  def _set(self, kind, entity_id, name):
+    self._remove((kind, entity_id))
+    if name:
+      self._names[(kind, entity_id)] = name
+      bisect.insort(self._keys, (name.lower(), kind, entity_id))
+
+  def _remove(self, ref):
+    name = self._names.pop(ref, None)
+    if name is None:
+      return
+    key = (name.lower(),) + ref
+    position = bisect.bisect_left(self._keys, key)
+    if position < len(self._keys) and self._keys[position] == key:
+      del self._keys[position]
+
+  def suggest(self, prefix, limit=10):
+    prefix = prefix.strip().lower()
+    if not prefix:
+      return []
+    results = []
+    with self._lock:
+      position = bisect.bisect_left(self._keys, (prefix,))
+      while position < len(self._keys) and len(results) < limit:
+        name, kind, entity_id = self._keys[position]
+        if not name.startswith(prefix):
+          break
+        results.append({
+          'type': kind,
+          'id': entity_id,
+          'name': self._names[(kind, entity_id)]
+        })
+        position += 1
+    return results
+
+  def memory_usage(self):
+    # approximate bytes held by the index structures
+    with self._lock:
+      size = sys.getsizeof(self._keys) + sys.getsizeof(self._names)
+      for key in self._keys:
+        size += sys.getsizeof(key) + sys.getsizeof(key[0])
+      for ref, name in self._names.items():
+        size += sys.getsizeof(ref) + sys.getsizeof(name)
+    return size
+
+  def __len__(self):
+    return len(self._keys)
+
+
+index = PrefixIndex()
+KINDS = ((Venue, 'venue'), (Artist, 'artist'))
+
+
+def _entries():
+  venues = (('venue', venue_id, name) for venue_id, name in db.session.query(Venue.id, Venue.name))
+  artists = (('artist', artist_id, name) for artist_id, name in db.session.query(Artist.id, Artist.name))
+  return list(venues) + list(artists)
+
+
+def load_index():
+  index.reload(_entries)
+
+
+def _refresh(interval, delay):
+  # rebuilds every interval seconds, after the first delay, for the life of
+  # the process
+  time.sleep(delay)
+  while True:
+    try:
+      with app.app_context():
+        load_index()
+    except Exception:
+      app.logger.exception('suggest index refresh failed')
+    time.sleep(interval)
+
+
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def start(load=True):
+  # once per serving process: load the index now (in an app context) or
+  # leave the first load to the thread, then keep it fresh; not at import,
+  # so CLI commands such as flask db upgrade never touch the index
+  global _refresher
+  with _refresher_lock:
+    if _refresher is not None:
+      return
+    if load:
+      load_index()
+    interval = app.config['SUGGEST_INDEX_TTL']
+    _refresher = threading.Thread(target=_refresh, args=(interval, interval if load else 0), name='suggest-index', daemon=True)
+    _refresher.start()
+
+
+def suggest(prefix, limit=10):
+  if _refresher is None:
+    start(load=False)
+  return index.suggest(prefix, limit)
+
+
+def _kind(target):
+  for model, kind in KINDS:
+    if isinstance(target, model):
+      return kind
+  return None
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_changes(session, flush_context):
+  # (kind, id) -> name, None for deleted rows; applied once committed
+  changes = session.info.setdefault('suggest_changes', {})
+  for target in list(session.new) + list(session.dirty):
+    kind = _kind(target)
+    if kind is not None:
+      changes[(kind, target.id)] = target.name
+  for target in session.deleted:
+    kind = _kind(target)
+    if kind is not None:
+      changes[(kind, target.id)] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def apply_committed(session):
+  changes = session.info.pop('suggest_changes', None)
+  for (kind, entity_id), name in (changes or {}).items():
+    index.add(kind, entity_id, name)
+
+
+@event.listens_for(Session, 'after_rollback')
+def discard_changes(session):
+  session.info.pop('suggest_changes', None)
@@ -0,0 +1,83 @@
+from app import app
+from jinja2 import nodes, FileSystemBytecodeCache
+from jinja2.ext import Extension
+import os
+import cache
+import versions
+
+#----------------------------------------------------------------------------#
+# Templating.
+#----------------------------------------------------------------------------#
+
+# Fragment cache: {% cache 'name', key, ... %}...{% endcache %} renders its
+# body once per distinct key and serves the stored HTML afterwards. Keys
+# carry entity versions from versions.py, so a write moves every fragment it
+# affects to a new key and nothing needs invalidating; entries simply age out
+# after FRAGMENT_CACHE_TTL. Show tiles use the versions their page query
+# reads with the rows (models.version_key), which keeps a tile's key and its
+# contents from the same snapshot, even on a detail page served from a cache
+# entry another worker has not invalidated yet:
+#
+#   {% cache 'artist-show', show.venue_id, show.venue_version, show.start_time %}
+#
+# Other blocks look versions up through entity_version('venues'), memoized
+# per request by versions.current().
+#
+# Compiled templates are also kept on disk (JINJA_BYTECODE_CACHE_DIR), so
+# new workers load them without compiling.
+
+
+class FragmentCacheExtension(Extension):
+  tags = set(['cache'])
+
+  def __init__(self, environment):
+    super(FragmentCacheExtension, self).__init__(environment)
+    # None renders every block
+    environment.extend(fragment_cache=None)
+
+  def parse(self, parser):
+    lineno = next(parser.stream).lineno
+    parts = [parser.parse_expression()]
+    while parser.stream.skip_if('comma'):
+      parts.append(parser.parse_expression())
+    body = parser.parse_statements(['name:endcache'], drop_needle=True)
+    return nodes.CallBlock(self.call_method('_cache', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+  def _cache(self, parts, caller):
+    store = self.environment.fragment_cache
+    if store is None:
+      return caller()
+    key = 'fragment:' + '|'.join(str(part) for part in parts)
+    fragment = store.get(key)
+    if fragment is not None:
+      return fragment
+    if self.environment.is_async:
+      return self._cache_async(store, key, caller)
+    fragment = caller()
+    store.set(key, fragment)
+    return fragment
+
+  async def _cache_async(self, store, key, caller):
+    fragment = await caller()
+    store.set(key, fragment)
+    return fragment
+
+
+def entity_version(*keys):
+  # versions of entity keys ('venue:1', 'venues') for fragment cache keys
+  known = versions.current(keys)
+  return tuple(known[key] for key in keys)
+
+
+def bytecode_cache(directory, pattern='__jinja2_%s.cache'):
+  if not directory:
+    return None
+  os.makedirs(directory, exist_ok=True)
+  return FileSystemBytecodeCache(directory, pattern)
+
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+if app.config['FRAGMENT_CACHE_MAXSIZE']:
+  app.jinja_env.fragment_cache = cache.LRUCache(app.config['FRAGMENT_CACHE_MAXSIZE'], app.config['FRAGMENT_CACHE_TTL'])
+app.jinja_env.globals['entity_version'] = entity_version
+app.jinja_env.bytecode_cache = bytecode_cache(app.config['JINJA_BYTECODE_CACHE_DIR'])
@@ -0,0 +1,45 @@
+#----------------------------------------------------------------------------#
+# Test fixtures.
+#
+#   FYYUR_TEST_DATABASE_URL=postgresql://localhost/fyyur_test python -m pytest -q
+#
+# Tests that need the database migrate FYYUR_TEST_DATABASE_URL to head and
+# truncate it after each test; they are skipped when it is not set.
+#----------------------------------------------------------------------------#
+
+import os
+import sys
+import pytest
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+
+@pytest.fixture(scope='session')
+def app():
+  url = os.environ.get('FYYUR_TEST_DATABASE_URL')
+  if not url:
+    pytest.skip('set FYYUR_TEST_DATABASE_URL to a scratch PostgreSQL database')
+  import flask_migrate
+  from app import app
+  app.config.update(SQLALCHEMY_DATABASE_URI=url, SQLALCHEMY_REPLICA_URIS=[], TESTING=True, WTF_CSRF_ENABLED=False)
+  with app.app_context():
+    flask_migrate.upgrade(directory=os.path.join(BASE_DIR, 'migrations'))
+  return app
+
+
+@pytest.fixture
+def db(app):
+  from app import db
+  import cache
+  with app.app_context():
+    yield db
+    db.session.remove()
+    db.session.execute(db.text('TRUNCATE shows, venues, artists, entity_versions RESTART IDENTITY CASCADE'))
+    db.session.commit()
+    cache.detail_cache.clear()
+
+
+@pytest.fixture
+def client(app, db):
+  return app.test_client()
@@ -0,0 +1,30 @@
+import datetime
+
+
+def test_batch_reports_database_errors_per_record(db, client):
+  from models import Venue, Artist, Show
+  import resolver
+  venue = Venue('The Musical Hop', 'San Francisco', 'CA')
+  artist, gone = Artist('Guns N Petals', 'San Francisco', 'CA'), Artist('Matt Quevedo', 'New York', 'NY')
+  db.session.add_all([venue, artist, gone])
+  db.session.commit()
+  venue_id, artist_id, gone_id = venue.id, artist.id, gone.id
+  # cached as existing, then deleted behind the resolver's back: only the
+  # foreign key catches it
+  resolver.resolve('artist', gone_id)
+  db.session.execute(db.text('DELETE FROM artists WHERE id = :id'), {'id': gone_id})
+  db.session.commit()
+
+  start = datetime.datetime(2035, 5, 21, 21, 30)
+  response = client.post('/shows', json=[
+    {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': start.isoformat()},
+    {'artist_id': gone_id, 'venue_id': venue_id, 'start_time': (start + datetime.timedelta(days=1)).isoformat()},
+    {'artist_id': artist_id, 'venue_id': venue_id, 'start_time': (start + datetime.timedelta(days=2)).isoformat()},
+  ])
+
+  body = response.get_json()
+  assert response.status_code == 200
+  assert [error['index'] for error in body['errors']] == [1]
+  assert 'foreign key' in body['errors'][0]['error']
+  created = dict(db.session.query(Show.id, Show.start_time).filter(Show.id.in_(body['created'])))
+  assert [created[show_id] for show_id in body['created']] == [start, start + datetime.timedelta(days=2)]
@@ -0,0 +1,38 @@
+import datetime
+
+
+def add_show(db):
+  from models import Venue, Artist, Show
+  venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street')
+  artist = Artist(name='Guns N Petals', city='San Francisco', state='CA')
+  db.session.add_all([venue, artist])
+  db.session.flush()
+  show = Show(artist.id, venue.id, datetime.datetime(2100, 1, 1, 20))
+  db.session.add(show)
+  db.session.commit()
+  return venue, artist, show
+
+
+def test_since_reaches_back_over_the_overlap(app, db):
+  from models import Show
+  import export
+  _, _, show = add_show(db)
+  stamped = db.session.query(Show.updated_at).filter(Show.id == show.id).scalar()
+  # a show flushed before the previous export's watermark but committed after it
+  since = stamped + datetime.timedelta(seconds=app.config['EXPORT_SINCE_OVERLAP'] // 2)
+
+  rows = export.shows_query(since).all()
+
+  assert [row.show_id for row in rows] == [show.id]
+
+
+def test_renaming_a_venue_stamps_its_shows(db):
+  from models import Show
+  venue, _, show = add_show(db)
+  show_id = show.id
+  stamped = db.session.query(Show.updated_at).filter(Show.id == show_id).scalar()
+
+  venue.name = 'The Musical Hop Annex'
+  db.session.commit()
+
+  assert db.session.query(Show.updated_at).filter(Show.id == show_id).scalar() > stamped
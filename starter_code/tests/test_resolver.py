@@ -0,0 +1,20 @@
+import pytest
+
+
+def test_digit_names_resolve_as_names(db):
+  from models import Artist
+  import resolver
+  artists = [Artist('Artist %d' % number, 'San Francisco', 'CA') for number in range(3)]
+  db.session.add_all(artists)
+  db.session.commit()
+  band = Artist(str(artists[0].id), 'San Diego', 'CA')
+  numbered = Artist('1975', 'Manchester', 'NY')
+  db.session.add_all([band, numbered])
+  db.session.commit()
+
+  assert resolver.resolve('artist', '1975') == numbered.id
+  assert resolver.resolve('artist', '#%d' % artists[1].id) == artists[1].id
+  assert resolver.resolve('artist', str(artists[1].id)) == artists[1].id
+  assert resolver.resolve('artist', artists[0].id) == artists[0].id
+  with pytest.raises(resolver.Ambiguous):
+    resolver.resolve('artist', str(artists[0].id))
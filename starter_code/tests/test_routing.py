@@ -0,0 +1,134 @@
+import time
+import pytest
+from flask import Flask, session as flask_session
+from routing import RoutingSQLAlchemy, ReplicaSet
+
+# Routing only, on SQLite: the primary and the replica are separate
+# in-memory databases, so no PostgreSQL is needed.
+
+
+@pytest.fixture
+def routed():
+  app = Flask(__name__)
+  app.config.update(
+    SECRET_KEY='test',
+    SQLALCHEMY_DATABASE_URI='sqlite://',
+    SQLALCHEMY_REPLICA_URIS=['sqlite://'],
+    SQLALCHEMY_ENGINE_OPTIONS={},
+    SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    REPLICA_READ_AFTER_WRITE_SECONDS=0.5,
+    REPLICA_HEALTH_INTERVAL=60,
+    REPLICA_CONNECT_TIMEOUT=1
+  )
+  db = RoutingSQLAlchemy(app)
+
+  class Note(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+
+  @app.route('/notes', methods=['POST'])
+  def create_note():
+    db.session.add(Note())
+    db.session.commit()
+    return ''
+
+  @app.route('/notes')
+  def count_notes():
+    return str(Note.query.count())
+
+  @app.route('/bind')
+  def bind():
+    return 'replica' if db.session.get_bind() in db.replicas.engines else 'primary'
+
+  with app.app_context():
+    db.create_all()
+    db.Model.metadata.create_all(db.replicas.engines[0])
+    db.replicas.check()
+    yield app, db
+
+
+def test_reads_go_to_a_healthy_replica(routed):
+  app, db = routed
+  with app.test_request_context('/venues'):
+    assert db.session()._use_replica()
+    assert db.session.get_bind() is db.replicas.engines[0]
+  with app.test_request_context('/venues', method='HEAD'):
+    assert db.session()._use_replica()
+
+
+def test_writes_and_non_requests_stay_on_the_primary(routed):
+  app, db = routed
+  with app.test_request_context('/venues', method='POST'):
+    assert not db.session()._use_replica()
+  assert not db.session()._use_replica()
+  with app.test_request_context('/venues'):
+    # the rest of a request whose session has flushed
+    db.session().info['wrote'] = True
+    assert not db.session()._use_replica()
+    db.session().info.pop('wrote')
+    assert db.session()._use_replica()
+
+
+def test_writer_sticks_to_the_primary_for_the_window(routed):
+  app, db = routed
+  client = app.test_client()
+  assert client.get('/bind').data == b'replica'
+  client.post('/notes')
+  assert client.get('/bind').data == b'primary'
+  # other browser sessions are unaffected
+  assert app.test_client().get('/bind').data == b'replica'
+  time.sleep(app.config['REPLICA_READ_AFTER_WRITE_SECONDS'])
+  assert client.get('/bind').data == b'replica'
+
+
+def test_queries_run_on_the_chosen_database(routed):
+  app, db = routed
+  client = app.test_client()
+  client.post('/notes')
+  # the note exists on the primary only
+  assert client.get('/notes').data == b'1'
+  assert app.test_client().get('/notes').data == b'0'
+
+
+def test_app_session_queries_with_and_without_replicas(app, db):
+  from models import Venue
+  with app.test_request_context('/venues'):
+    assert db.session.query(Venue).count() == 0
+  replicas = ReplicaSet([app.config['SQLALCHEMY_DATABASE_URI']], {}, 60)
+  replicas.check()
+  db._replicas = replicas
+  try:
+    with app.test_request_context('/venues'):
+      assert db.session.get_bind() is replicas.engines[0]
+      assert db.session.query(Venue).count() == 0
+  finally:
+    db._replicas = None
+    replicas.engines[0].dispose()
+
+
+def test_window_comes_from_the_browser_session(routed):
+  app, db = routed
+  with app.test_request_context('/venues'):
+    flask_session['_primary_until'] = time.time() + 60
+    assert not db.session()._use_replica()
+    flask_session['_primary_until'] = time.time() - 1
+    assert db.session()._use_replica()
+
+
+def test_unreachable_replicas_are_skipped():
+  unreachable = 'sqlite:////nonexistent/fyyur/replica.db'
+  replicas = ReplicaSet([unreachable, 'sqlite://'], {}, 60, connect_timeout=1)
+  replicas.check()
+  assert [replicas.is_healthy(engine) for engine in replicas.engines] == [False, True]
+  assert replicas.choose() is replicas.engines[1]
+  assert replicas.choose() is replicas.engines[1]
+
+  replicas = ReplicaSet([unreachable], {}, 60)
+  replicas.check()
+  assert replicas.choose() is None
+
+
+def test_connect_timeout_applies_to_postgresql_only():
+  options = {'pool_pre_ping': True, 'connect_args': {'options': '-c statement_timeout=1000'}}
+  assert ReplicaSet._options('postgresql://replica/fyyur', options, 2)['connect_args'] == {
+    'options': '-c statement_timeout=1000', 'connect_timeout': 2}
+  assert ReplicaSet._options('sqlite://', options, 2) == options
@@ -0,0 +1,11 @@
+def test_search_total_past_the_last_page(db):
+  from models import Venue
+  import search
+  db.session.add_all([Venue('Music Hall %d' % number, 'San Francisco', 'CA') for number in range(3)])
+  db.session.commit()
+
+  first = search.search_venues('music', page=1, per_page=2)
+  assert (first['count'], first['pages'], len(first['data'])) == (3, 2, 2)
+
+  past_end = search.search_venues('music', page=5, per_page=2)
+  assert (past_end['count'], past_end['pages'], past_end['data']) == (3, 2, [])
@@ -0,0 +1,20 @@
+import datetime
+
+
+def test_form_times_round_trip_through_the_venue_timezone(db, client):
+  from models import Venue, Artist, Show
+  venue = Venue('The Musical Hop', 'San Francisco', 'CA', address='1015 Folsom Street', timezone='America/Los_Angeles')
+  artist = Artist('Guns N Petals', 'San Francisco', 'CA')
+  db.session.add_all([venue, artist])
+  db.session.commit()
+  venue_id, artist_id = venue.id, artist.id
+
+  client.post('/shows/create', data={
+    'artist_id': '#%d' % artist_id, 'venue_id': '#%d' % venue_id, 'start_time': '2035-05-21 21:30'})
+
+  show = db.session.query(Show).filter(Show.venue_id == venue_id).one()
+  # PDT is UTC-7
+  assert show.start_time == datetime.datetime(2035, 5, 22, 4, 30)
+  assert show.end_time == datetime.datetime(2035, 5, 22, 6, 30)
+  response = client.get('/venues/%d' % venue_id)
+  assert b'9:30PM' in response.data
@@ -0,0 +1,60 @@
+import datetime
+from sqlalchemy import event
+
+
+def count_queries(engine, request):
+  statements = []
+  def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements.append(statement)
+  event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+  try:
+    response = request()
+  finally:
+    event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+  return response, statements
+
+
+def test_venue_detail_query_count(db, client):
+  from models import Venue, Artist, Show
+  import cache
+  venue = Venue(name='The Musical Hop', city='San Francisco', state='CA', address='1015 Folsom Street',
+                phone='123-123-1234', genres=['Jazz'])
+  artists = [Artist(name='Artist %d' % number, city='San Francisco', state='CA') for number in range(4)]
+  db.session.add(venue)
+  db.session.add_all(artists)
+  db.session.flush()
+  now = datetime.datetime.utcnow().replace(microsecond=0)
+  # past and upcoming shows, spaced so no two bookings overlap
+  for number in range(8):
+    start_time = now + datetime.timedelta(days=number * 7 - 21)
+    db.session.add(Show(artists[number % len(artists)].id, venue.id, start_time))
+  db.session.commit()
+  venue_id = venue.id
+  cache.detail_cache.clear()
+
+  response, statements = count_queries(db.engine, lambda: client.get('/venues/%d' % venue_id))
+
+  assert response.status_code == 200
+  assert b'Artist 3' in response.data
+  assert len(statements) <= 2, statements
+
+
+def test_venue_detail_splits_past_and_upcoming(db):
+  from models import Venue, Artist, Show
+  venue = Venue(name='Park Square Live Music & Coffee', city='San Francisco', state='CA', address='34 Whiskey Moore Ave')
+  artist = Artist(name='Guns N Petals', city='San Francisco', state='CA')
+  empty = Venue(name='The Dueling Pianos Bar', city='New York', state='NY', address='335 Delancey Street')
+  db.session.add_all([venue, artist, empty])
+  db.session.flush()
+  now = datetime.datetime.utcnow()
+  db.session.add(Show(artist.id, venue.id, now - datetime.timedelta(days=2)))
+  db.session.add(Show(artist.id, venue.id, now + datetime.timedelta(days=2)))
+  db.session.commit()
+
+  data = Venue.get_with_shows(venue.id)
+  assert (data['past_shows_count'], data['upcoming_shows_count']) == (1, 1)
+  assert data['upcoming_shows'][0]['artist_name'] == 'Guns N Petals'
+
+  data = Venue.get_with_shows(empty.id)
+  assert (data['past_shows'], data['upcoming_shows']) == ([], [])
+  assert Venue.get_with_shows(empty.id + 1) is None
@@ -0,0 +1,187 @@
+from app import app, db
+from models import Venue, Artist, Show, EntityVersion, version_key
+from flask import request, session, make_response, Response, g
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+import datetime
+import functools
+import hashlib
+import random
+import time
+
+#----------------------------------------------------------------------------#
+# Versions.
+#----------------------------------------------------------------------------#
+
+# Conditional GET support. Every write bumps a version row per touched
+# entity ('venue:1', 'artist:4') and per listing ('venues', 'artists',
+# 'shows') in the same transaction, so a page's ETag and Last-Modified can be
+# derived from one primary key lookup query. Views wrapped in @conditional
+# answer If-None-Match / If-Modified-Since with 304 before querying or
+# rendering anything.
+#
+# Every write bumps a listing, so a single row per listing would serialize
+# all writers on its row lock. Listings are kept in VERSION_LISTING_SHARDS
+# rows instead ('venues#0' .. 'venues#15'); a transaction bumps one shard,
+# picked at random when it first bumps, and a listing's version is the sum
+# of its shards' versions, its last modification the latest of theirs.
+
+LISTINGS = {Venue: 'venues', Artist: 'artists', Show: 'shows'}
+LISTING_KEYS = set(LISTINGS.values())
+SHARDS = app.config['VERSION_LISTING_SHARDS']
+
+
+def keys_for_row(model, row):
+  get = row.get if isinstance(row, dict) else lambda name: getattr(row, name, None)
+  if model is Venue:
+    return set(['venues', 'venue:%s' % get('id')])
+  if model is Artist:
+    return set(['artists', 'artist:%s' % get('id')])
+  return set(['shows', 'venue:%s' % get('venue_id'), 'artist:%s' % get('artist_id')])
+
+
+def _shard_keys(key):
+  return ['%s#%d' % (key, shard) for shard in range(SHARDS)] if key in LISTING_KEYS else [key]
+
+
+def bump(session, keys):
+  # upsert in key order so concurrent writers lock rows in the same order;
+  # listings go to this transaction's shard
+  if not keys:
+    return
+  shard = session.info.setdefault('version_shard', random.randrange(SHARDS))
+  keys = set('%s#%d' % (key, shard) if key in LISTING_KEYS else key for key in keys)
+  now = datetime.datetime.utcnow()
+  table = EntityVersion.__table__
+  statement = postgresql.insert(table).values([
+    {'key': key, 'version': 1, 'updated_at': now} for key in sorted(keys)
+  ])
+  session.connection().execute(statement.on_conflict_do_update(
+    index_elements=[table.c.key],
+    set_={'version': table.c.version + 1, 'updated_at': now}
+  ))
+
+
+def bump_rows(model, rows):
+  # writes that skip the unit of work (core inserts, bulk mappings)
+  keys = set()
+  for row in rows:
+    keys |= keys_for_row(model, row)
+  bump(db.session, keys)
+
+
+def _related_keys(connection, venue_ids, artist_ids):
+  # version keys of the artists playing the given venues and of the venues
+  # the given artists play, in one query
+  shows = Show.__table__
+  selects = []
+  if venue_ids:
+    selects.append(db.select([version_key('artist', shows.c.artist_id)]).where(shows.c.venue_id.in_(venue_ids)))
+  if artist_ids:
+    selects.append(db.select([version_key('venue', shows.c.venue_id)]).where(shows.c.artist_id.in_(artist_ids)))
+  if not selects:
+    return set()
+  return set(row[0] for row in connection.execute(db.union(*selects)))
+
+
+@event.listens_for(Session, 'after_flush')
+def bump_flushed(session, flush_context):
+  dirty = session.dirty
+  keys = set()
+  venue_ids, artist_ids = [], []
+  for target in list(session.new) + list(session.dirty) + list(session.deleted):
+    for model in LISTINGS:
+      if isinstance(target, model):
+        keys |= keys_for_row(model, target)
+    if isinstance(target, Show):
+      state = db.inspect(target)
+      keys.update('venue:%s' % value for value in state.attrs.venue_id.history.deleted)
+      keys.update('artist:%s' % value for value in state.attrs.artist_id.history.deleted)
+    elif target in dirty and isinstance(target, Venue):
+      venue_ids.append(target.id)
+    elif target in dirty and isinstance(target, Artist):
+      artist_ids.append(target.id)
+  # a renamed artist changes the show tiles on every venue page it appears
+  # on, and the other way round
+  keys |= _related_keys(session.connection(), venue_ids, artist_ids)
+  bump(session, keys)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def release_shard(session):
+  session.info.pop('version_shard', None)
+
+
+def _read(keys):
+  # {key: (version, updated_at)} for the keys that have rows; a listing
+  # sums its shards
+  stored = dict((key, (version, updated_at)) for key, version, updated_at in
+                db.session.query(EntityVersion.key, EntityVersion.version, EntityVersion.updated_at)
+                .filter(EntityVersion.key.in_([shard for key in keys for shard in _shard_keys(key)])))
+  versions = {}
+  for key in keys:
+    rows = [stored[shard] for shard in _shard_keys(key) if shard in stored]
+    if rows:
+      versions[key] = (sum(version for version, _ in rows), max(updated_at for _, updated_at in rows))
+  return versions
+
+
+def current(keys):
+  # {key: version} covering keys, each read at most once per request; keys
+  # without a row are version 0. Views pass every key the page's fragment
+  # cache keys use (see templating.py) so they are read in one query.
+  known = g.setdefault('entity_versions', {})
+  missing = set(key for key in keys if key not in known)
+  if missing:
+    found = _read(missing)
+    known.update((key, found.get(key, (0, None))[0]) for key in missing)
+  return known
+
+
+def stamp(keys, bucket_seconds):
+  # (etag, last_modified) for a set of version keys; the time bucket makes
+  # pages expire as upcoming shows become past shows
+  versions = _read(keys)
+  # the page's fragments need no second read of the same keys
+  g.setdefault('entity_versions', {}).update((key, versions.get(key, (0, None))[0]) for key in keys)
+  bucket = int(time.time()) // bucket_seconds
+  digest = hashlib.sha1(request.full_path.encode())
+  for key in sorted(keys):
+    digest.update(('%s=%s;' % (key, versions.get(key, (0, None))[0])).encode())
+  digest.update(str(bucket).encode())
+  last_modified = max(
+    [updated_at for _, updated_at in versions.values()] +
+    [datetime.datetime.utcfromtimestamp(bucket * bucket_seconds)]
+  ).replace(microsecond=0)
+  return digest.hexdigest(), last_modified
+
+
+def _not_modified(etag, last_modified):
+  if request.if_none_match:
+    return request.if_none_match.contains(etag)
+  if request.if_modified_since:
+    return last_modified <= request.if_modified_since.replace(tzinfo=None)
+  return False
+
+
+def conditional(*keys):
+  # keys may reference view arguments: @conditional('venue:{venue_id}')
+  def decorator(view):
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+      # pending flash messages are part of the page, so render it
+      if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        return view(**kwargs)
+      etag, last_modified = stamp([key.format(**kwargs) for key in keys], app.config['ETAG_TIME_BUCKET'])
+      if _not_modified(etag, last_modified):
+        response = Response(status=304)
+      else:
+        response = make_response(view(**kwargs))
+      response.set_etag(etag)
+      response.last_modified = last_modified
+      response.cache_control.no_cache = True
+      return response
+    return wrapper
+  return decorator